@@ -0,0 +1,68 @@
+"""
+Benchmark：prompt 裡 K 線編碼方式（PROMPT_CANDLE_ENCODING）的 token 數比較。
+
+python bench_candle_encoding.py [--stub] [--symbol BTCUSDT]
+
+對同一份 state 分別用 json / compact / features 組出三位分析師的 prompt，
+印出 K 線本身與整個 request（三個分析師 prompt）的 token 數。
+token 數用 llm_client.estimate_tokens（有裝 tiktoken 就是精確值，否則是估算）。
+
+--stub 用本地 binance_stub 產生 K 線，不打 Binance。
+"""
+
+import argparse
+import os
+
+os.environ.setdefault("KLINE_STORE_ENABLED", "false")
+os.environ.setdefault("KLINE_STREAM_ENABLED", "false")
+
+import data_binance as db
+import graph_crypto_agent as g
+from candle_encoding import ENCODINGS, encoding_stats
+from llm_client import JSON_PROMPT_PREFIX, estimate_tokens, tiktoken
+
+KINDS = ("weekly", "daily", "risk")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--stub", action="store_true", help="use a local Binance stand-in for klines")
+    ap.add_argument("--symbol", default="BTCUSDT")
+    args = ap.parse_args()
+
+    if args.stub:
+        from binance_stub import start_stub_server
+
+        db.configure_binance_hosts([start_stub_server().base_url])
+
+    import builtins
+
+    _print = builtins.print
+    builtins.print = lambda *a, **k: None  # 關掉抓 K 線的 [INFO] log
+    try:
+        state = g.fetch_and_analyze({"symbol": args.symbol, "user_text": f"{args.symbol} 投資建議"})
+    finally:
+        builtins.print = _print
+
+    rows = state["daily_candles"]
+    precision = g._price_precision(args.symbol, rows)
+    candles = encoding_stats(rows, estimate_tokens, precision)
+
+    original = g.CANDLE_ENCODING
+    prompts = {}
+    try:
+        for enc in ENCODINGS:
+            g.CANDLE_ENCODING = enc
+            prompts[enc] = sum(estimate_tokens(JSON_PROMPT_PREFIX + g.build_analyst_prompt(k, state)) for k in KINDS)
+    finally:
+        g.CANDLE_ENCODING = original
+
+    print(f"{args.symbol}: {len(rows)} daily candles, price decimals={precision}, "
+          f"tokens via {'tiktoken' if tiktoken is not None else 'estimate (install tiktoken for exact counts)'}")
+    print(f"{'encoding':<9} {'candles':>8} {'3 analyst prompts':>18} {'vs json':>8}")
+    for enc in ENCODINGS:
+        print(f"{enc:<9} {candles[enc]:>8} {prompts[enc]:>18} {prompts[enc] / prompts['json']:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark：舊的 DataFrame hot path vs CandleArray（columnar）。
+
+python bench_candles.py [rows] [iterations]
+
+兩條路徑做同樣的事：Binance JSON rows → 容器 → 排序 / 取最後 35 根 → 轉成 prompt 用的 list[dict]。
+用合成資料，不會打 Binance。
+"""
+
+import random
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+from candles import CandleArray
+from graph_crypto_agent import _serialize_candles
+
+_COLS = [
+    "open_time",
+    "open",
+    "high",
+    "low",
+    "close",
+    "volume",
+    "close_time",
+    "quote_asset_volume",
+    "number_of_trades",
+    "taker_buy_base_asset_volume",
+    "taker_buy_quote_asset_volume",
+    "ignore",
+]
+
+
+def _fake_rows(n: int):
+    rnd = random.Random(0)
+    day = 86_400_000
+    t0 = 1_500_000_000_000 // day * day
+    p = 30000.0
+    rows = []
+    for i in range(n):
+        o = p
+        c = p * (1 + rnd.uniform(-0.03, 0.03))
+        v = rnd.uniform(1e3, 5e4)
+        t = t0 + i * day
+        rows.append([
+            t, f"{o:.8f}", f"{max(o, c) * 1.01:.8f}", f"{min(o, c) * 0.99:.8f}", f"{c:.8f}", f"{v:.8f}",
+            t + day - 1, f"{v * c:.8f}", rnd.randint(1000, 90000), f"{v / 2:.8f}", f"{v * c / 2:.8f}", "0",
+        ])
+        p = c
+    return rows
+
+
+def _dataframe_path(rows):
+    # 與改版前 data_binance._get_klines + _serialize_candles 相同的步驟
+    df = pd.DataFrame(rows, columns=_COLS)
+    df["open_time"] = pd.to_datetime(df["open_time"], unit="ms", utc=True)
+    df["close_time"] = pd.to_datetime(df["close_time"], unit="ms", utc=True)
+    for c in ["open", "high", "low", "close", "volume"]:
+        df[c] = pd.to_numeric(df[c], errors="coerce")
+    return df, _serialize_candles(df, 35)
+
+
+def _candles_path(rows):
+    c = CandleArray.from_rows(rows)
+    return c, _serialize_candles(c, 35)
+
+
+def _time(fn, rows, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn(rows)
+    return (time.perf_counter() - t0) / n
+
+
+def _peak_alloc(fn, rows) -> int:
+    tracemalloc.start()
+    fn(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    iters = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rows = _fake_rows(n_rows)
+
+    df, rec_df = _dataframe_path(rows)
+    c, rec_c = _candles_path(rows)
+    assert rec_df == rec_c, "serialized candles differ"
+
+    t_df = _time(_dataframe_path, rows, iters)
+    t_c = _time(_candles_path, rows, iters)
+
+    print(f"rows / iterations        : {n_rows} / {iters}")
+    print(f"DataFrame   time         : {t_df * 1e3:8.3f} ms")
+    print(f"CandleArray time         : {t_c * 1e3:8.3f} ms  ({t_df / t_c:.1f}x)")
+    print(f"DataFrame   memory (deep): {df.memory_usage(deep=True).sum() / 1024:8.1f} KiB")
+    print(f"CandleArray memory       : {c.nbytes / 1024:8.1f} KiB")
+    print(f"DataFrame   peak alloc   : {_peak_alloc(_dataframe_path, rows) / 1024:8.1f} KiB")
+    print(f"CandleArray peak alloc   : {_peak_alloc(_candles_path, rows) / 1024:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+Microbenchmark：每個請求重新 build_graph()（舊做法）vs 重用 compile 好的 graph（get_graph）。
+
+python bench_graph.py [iterations]
+
+只量 graph 建構 / 取得的 per-request overhead，不會打 Binance 或 LLM。
+"""
+
+import sys
+import time
+
+from graph_crypto_agent import build_graph, get_graph
+
+
+def _bench(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    get_graph()  # 第一次 compile 不算在 per-request 裡
+
+    before = _bench(build_graph, n)
+    after = _bench(get_graph, n)
+
+    print(f"iterations              : {n}")
+    print(f"build_graph() / request : {before * 1e3:.3f} ms")
+    print(f"get_graph()   / request : {after * 1e6:.3f} us")
+    print(f"speedup                 : {before / after:,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
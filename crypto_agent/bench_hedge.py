@@ -0,0 +1,67 @@
+"""
+Benchmark：hedged requests 對 Binance klines 長尾延遲的影響（本地 stand-in server，不會打 Binance）。
+
+python bench_hedge.py [requests] [tail_prob] [tail_delay_sec]
+
+- primary：每個 request 有 tail_prob 的機率多等 tail_delay_sec（模擬長尾）
+- mirror ：固定 5ms
+比較只打 primary 與開 hedge 兩種情況的 p50 / p95 / p99，以及各 host 的輸贏次數。
+"""
+
+import os
+import sys
+import time
+
+os.environ.setdefault("KLINE_STORE_ENABLED", "false")
+
+import numpy as np
+
+import data_binance as db
+from binance_stub import start_stub_server
+
+
+def _run(n: int) -> np.ndarray:
+    lat = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        db._get_candles("BTCUSDT", "1d", 100)  # type: ignore[arg-type]
+        lat.append(time.perf_counter() - t0)
+    return np.array(lat) * 1000
+
+
+def _report(name: str, lat: np.ndarray) -> None:
+    p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+    print(f"{name:<10} p50={p50:7.1f}ms  p95={p95:7.1f}ms  p99={p99:7.1f}ms  max={lat.max():7.1f}ms")
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    tail_prob = float(sys.argv[2]) if len(sys.argv) > 2 else 0.04
+    tail_delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+
+    primary = start_stub_server(delay_sec=0.005, tail_prob=tail_prob, tail_delay_sec=tail_delay)
+    mirror = start_stub_server(delay_sec=0.005)
+
+    import builtins
+
+    _print = builtins.print
+    builtins.print = lambda *a, **k: None  # 關掉 _get_candles 的 [INFO] log
+    try:
+        db.configure_binance_hosts([primary.base_url])
+        single = _run(n)
+        db.configure_binance_hosts([primary.base_url, mirror.base_url])
+        hedged = _run(n)
+    finally:
+        builtins.print = _print
+
+    print(f"requests={n}  primary tail: {tail_prob:.0%} × +{tail_delay * 1000:.0f}ms")
+    _report("primary", single)
+    _report("hedged", hedged)
+    stats = db.binance_host_stats()
+    print(f"hedged={stats['hedged']}  hedge_wins={stats['hedge_wins']}")
+    for host, st in stats["hosts"].items():
+        print(f"  {host}: {st}")
+
+
+if __name__ == "__main__":
+    main()
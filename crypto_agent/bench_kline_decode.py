@@ -0,0 +1,96 @@
+"""
+Benchmark：Binance klines response bytes → typed candles。
+
+python bench_kline_decode.py [rows] [iterations]
+
+比較三種解析方式（合成的 1000 根 payload，不會打 Binance）：
+  1. legacy   : json.loads → DataFrame → pd.to_numeric / pd.to_datetime（改版前 _get_klines 的做法）
+  2. json     : json.loads → CandleArray.from_rows
+  3. bytes    : CandleArray.from_json_bytes（不經過 Python 物件，一次解析成 typed arrays）
+"""
+
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from candles import KLINE_COLUMNS, CandleArray
+
+_COLS = [*KLINE_COLUMNS, "ignore"]
+
+
+def _fake_payload(n: int) -> bytes:
+    rnd = random.Random(0)
+    day = 86_400_000
+    t0 = 1_500_000_000_000 // day * day
+    p = 30000.0
+    rows = []
+    for i in range(n):
+        o = p
+        c = p * (1 + rnd.uniform(-0.03, 0.03))
+        v = rnd.uniform(1e3, 5e4)
+        t = t0 + i * day
+        rows.append([
+            t, f"{o:.8f}", f"{max(o, c) * 1.01:.8f}", f"{min(o, c) * 0.99:.8f}", f"{c:.8f}", f"{v:.8f}",
+            t + day - 1, f"{v * c:.8f}", rnd.randint(1000, 90000), f"{v / 2:.8f}", f"{v * c / 2:.8f}", "0",
+        ])
+        p = c
+    return json.dumps(rows, separators=(",", ":")).encode()
+
+
+def _legacy(data: bytes):
+    df = pd.DataFrame(json.loads(data), columns=_COLS)
+    df["open_time"] = pd.to_datetime(df["open_time"], unit="ms", utc=True)
+    df["close_time"] = pd.to_datetime(df["close_time"], unit="ms", utc=True)
+    for c in ["open", "high", "low", "close", "volume"]:
+        df[c] = pd.to_numeric(df[c], errors="coerce")
+    return df
+
+
+def _json(data: bytes):
+    return CandleArray.from_rows(json.loads(data))
+
+
+def _bytes(data: bytes):
+    return CandleArray.from_json_bytes(data)
+
+
+def _time(fn, data, n: int) -> float:
+    fn(data)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn(data)
+    return (time.perf_counter() - t0) / n
+
+
+def _peak_alloc(fn, data) -> int:
+    tracemalloc.start()
+    fn(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    iters = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    data = _fake_payload(n_rows)
+
+    a, b = _json(data), _bytes(data)
+    for c in KLINE_COLUMNS:
+        assert getattr(a, c).dtype == getattr(b, c).dtype, c
+        assert np.array_equal(getattr(a, c), getattr(b, c)), c
+
+    print(f"payload: {n_rows} rows, {len(data) / 1024:.1f} KiB, {iters} iterations")
+    for name, fn in (("legacy", _legacy), ("json", _json), ("bytes", _bytes)):
+        t = _time(fn, data, iters)
+        peak = _peak_alloc(fn, data)
+        print(f"  {name:7s}: {t * 1e3:7.3f} ms   peak alloc {peak / 1024:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Benchmark：分析師 prompt 的排列順序對 Ollama prefix cache（KV 重用）的影響。
+
+python bench_prompt_prefix.py [--stub] [--rounds N] [--symbol BTCUSDT]
+
+比較兩種排列：
+- legacy：角色指示 → 使用者提問 → 市場資料（舊版，每個分析師一開頭就不同）
+- prefix：市場資料（已收盤 K 線 → 最新那根）→ 使用者提問（只有風控）→ 角色指示（build_analyst_prompt）
+
+模擬同一根日線內兩位使用者（不同 intent、第二位時價格小幅變動）各跑三位分析師，依序送出：
+1) 離線：相鄰兩個 prompt 的共同前綴比例（不需要 Ollama）
+2) Ollama：用 /api/chat 的 prompt_eval_count / prompt_eval_duration 量實際要 eval 的 token 與時間
+   （num_predict=1，只量 prompt eval；每種排列開始前先送一個無關 prompt 清掉 cache）
+
+--stub 用本地 binance_stub 產生 K 線，不打 Binance。
+"""
+
+import argparse
+import copy
+import os
+import time
+from typing import Any, Dict, List, Tuple
+
+os.environ.setdefault("KLINE_STORE_ENABLED", "false")
+os.environ.setdefault("KLINE_STREAM_ENABLED", "false")
+
+import requests
+
+import data_binance as db
+from config import OLLAMA_BASE_URL, OLLAMA_MODEL
+from graph_crypto_agent import (
+    ANALYST_ROLES,
+    ANALYST_TEMPLATES,
+    MARKET_ANALYSTS,
+    _build_market_ctx,
+    _build_user_ctx,
+    assemble_prompt,
+    build_analyst_prompt,
+    fetch_and_analyze,
+)
+from llm_client import JSON_PROMPT_PREFIX
+
+KINDS = ("weekly", "daily", "risk")
+
+
+def _legacy_prompt(kind: str, state: Dict[str, Any]) -> str:
+    role = ANALYST_TEMPLATES[kind].format(role=ANALYST_ROLES[kind])
+    return assemble_prompt(role, _build_user_ctx(state), _build_market_ctx(state))
+
+
+def _states(symbol: str) -> List[Dict[str, Any]]:
+    a = fetch_and_analyze({"symbol": symbol, "user_text": f"{symbol} 投資建議", "intent": "general_advice"})
+    # 第二位使用者：同一根日線，價格小幅變動、不同 intent
+    b = copy.deepcopy(a)
+    b.update(user_text=f"{symbol} 怕回撤", intent="risk_averse")
+    b["daily_candles"][-1]["close"] = round(b["daily_candles"][-1]["close"] * 1.001, 2)
+    b["weekly_row"] = {**b["weekly_row"], "close": b["daily_candles"][-1]["close"]}
+    return [a, b]
+
+
+def _sequence(states: List[Dict[str, Any]], layout: str) -> List[str]:
+    build = build_analyst_prompt if layout == "prefix" else _legacy_prompt
+    return [JSON_PROMPT_PREFIX + build(kind, st) for st in states for kind in KINDS]
+
+
+def _common_prefix(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _offline(prompts: List[str]) -> float:
+    shared = sum(_common_prefix(prev, cur) for prev, cur in zip(prompts, prompts[1:]))
+    return shared / sum(len(p) for p in prompts[1:])
+
+
+def _ollama_eval(prompt: str) -> Tuple[int, float]:
+    r = requests.post(
+        f"{OLLAMA_BASE_URL.rstrip('/')}/api/chat",
+        json={
+            "model": OLLAMA_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": False,
+            "options": {"num_predict": 1, "temperature": 0},
+        },
+        timeout=600,
+    )
+    r.raise_for_status()
+    data = r.json()
+    return int(data.get("prompt_eval_count", 0)), data.get("prompt_eval_duration", 0) / 1e9
+
+
+def _run_ollama(prompts: List[str]) -> Tuple[int, float]:
+    _ollama_eval(f"flush {time.time()}")
+    tokens, sec = 0, 0.0
+    for p in prompts:
+        n, d = _ollama_eval(p)
+        tokens += n
+        sec += d
+    return tokens, sec
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--stub", action="store_true", help="use a local Binance stand-in for klines")
+    ap.add_argument("--rounds", type=int, default=2)
+    ap.add_argument("--symbol", default="BTCUSDT")
+    args = ap.parse_args()
+
+    if args.stub:
+        from binance_stub import start_stub_server
+
+        db.configure_binance_hosts([start_stub_server().base_url])
+
+    import builtins
+
+    _print = builtins.print
+    builtins.print = lambda *a, **k: None  # 關掉抓 K 線的 [INFO] log
+    try:
+        states = _states(args.symbol)
+    finally:
+        builtins.print = _print
+
+    seqs = {layout: _sequence(states, layout) for layout in ("legacy", "prefix")}
+    print(f"prompts: {len(KINDS)} analysts × {len(states)} users (market analysts: {', '.join(MARKET_ANALYSTS)})")
+    for layout, prompts in seqs.items():
+        print(f"{layout:<7} avg prompt {sum(map(len, prompts)) / len(prompts):7.0f} chars, "
+              f"shared prefix with previous call {_offline(prompts):6.1%}")
+
+    try:
+        requests.get(f"{OLLAMA_BASE_URL.rstrip('/')}/api/version", timeout=2).raise_for_status()
+    except Exception as e:
+        print(f"Ollama not reachable at {OLLAMA_BASE_URL} ({type(e).__name__}); skipped prompt-eval timing")
+        return
+
+    results: Dict[str, List[Tuple[int, float]]] = {"legacy": [], "prefix": []}
+    for _ in range(args.rounds):
+        for layout, prompts in seqs.items():
+            results[layout].append(_run_ollama(prompts))
+    for layout, runs in results.items():
+        tokens = sum(t for t, _ in runs) / len(runs)
+        sec = sum(s for _, s in runs) / len(runs)
+        print(f"{layout:<7} prompt_eval tokens {tokens:7.0f}  prompt_eval {sec:7.2f}s  ({OLLAMA_MODEL})")
+    legacy = sum(s for _, s in results["legacy"]) / args.rounds
+    prefix = sum(s for _, s in results["prefix"]) / args.rounds
+    if legacy > 0:
+        print(f"prompt-eval time saved: {legacy - prefix:.2f}s per 2 users ({1 - prefix / legacy:.0%})")
+
+
+if __name__ == "__main__":
+    main()
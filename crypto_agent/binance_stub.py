@@ -0,0 +1,347 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from resample import INTERVAL_MS, candle_open_ms
+
+try:
+    import websockets
+except Exception:  # pragma: no cover
+    websockets = None
+
+"""
+本地 Binance stand-in server（開發 / 驗證用，不需要網路）。
+
+- GET /api/v3/klines：依 symbol / interval / startTime / endTime / limit 回傳決定性的假 K 線
+  （同一組參數每次結果一樣，頁與頁之間可以互相對得起來）
+- delay_sec：每個 request 先 sleep，模擬慢回應；tail_prob / tail_delay_sec：部分 request 特別慢（長尾）
+- stats：記錄收到的 request 數與同時在途的最大值
+- weight_limit：模擬 Binance 每分鐘 request weight（klines = 2），回 X-MBX-USED-WEIGHT-1M，超過回 429 + Retry-After
+- fail_status / fail_retry_after：設了就每個 request 都回這個 HTTP status（測試重試 / hedge 用）
+- GET /api/v3/exchangeInfo：STUB_SYMBOLS 這幾個交易對（格式同 Binance，含 PRICE_FILTER / LOT_SIZE，weight 20）
+- start_stub_stream()：websocket kline 串流（格式同 Binance combined stream），每 interval_sec 推一次目前那根
+
+用法：
+    BINANCE_API_BASE=http://127.0.0.1:8900 python run_local.py
+    python binance_stub.py --port 8900 --delay 0.05 --ws-port 8901
+    KLINE_STREAM_URL=ws://127.0.0.1:8901/stream
+"""
+
+# 假資料從 2017-08-14（週一）開始，跟 BTCUSDT 在 Binance 上市的時間差不多
+STUB_FIRST_OPEN_MS = 1502668800000
+
+
+# (symbol, base, quote, tickSize)；最後一個是已下架的，exchangeInfo 會回但 status 不是 TRADING
+STUB_SYMBOLS: List[Tuple[str, str, str, str]] = [
+    ("BTCUSDT", "BTC", "USDT", "0.01000000"),
+    ("ETHUSDT", "ETH", "USDT", "0.01000000"),
+    ("BNBUSDT", "BNB", "USDT", "0.01000000"),
+    ("SOLUSDT", "SOL", "USDT", "0.01000000"),
+    ("DOGEUSDT", "DOGE", "USDT", "0.00001000"),
+    ("SHIBUSDT", "SHIB", "USDT", "0.00000001"),
+    ("ADAUSDT", "ADA", "USDT", "0.00010000"),
+    ("1000SATSUSDT", "1000SATS", "USDT", "0.00000010"),
+    ("ETHBTC", "ETH", "BTC", "0.00001000"),
+    ("LUNAUSDT", "LUNA", "USDT", "0.00010000"),
+]
+
+
+def stub_exchange_info() -> Dict[str, Any]:
+    symbols = []
+    for i, (sym, base, quote, tick) in enumerate(STUB_SYMBOLS):
+        symbols.append(
+            {
+                "symbol": sym,
+                "status": "BREAK" if i == len(STUB_SYMBOLS) - 1 else "TRADING",
+                "baseAsset": base,
+                "quoteAsset": quote,
+                "filters": [
+                    {"filterType": "PRICE_FILTER", "minPrice": tick, "maxPrice": "1000000.00000000", "tickSize": tick},
+                    {"filterType": "LOT_SIZE", "minQty": "0.00001000", "maxQty": "9000.00000000", "stepSize": "0.00001000"},
+                ],
+            }
+        )
+    return {"timezone": "UTC", "serverTime": int(time.time() * 1000), "rateLimits": [], "symbols": symbols}
+
+
+def stub_kline(open_ms: int, interval: str) -> List[Any]:
+    """open_ms 那根的決定性假資料（格式同 Binance，數字是字串）。"""
+    step = INTERVAL_MS[interval]
+    i = (open_ms - STUB_FIRST_OPEN_MS) // step
+    base = 10000.0 + (i % 500) * 10.0
+    o, c = base, base + (5.0 if i % 2 else -5.0)
+    vol = 100.0 + (i % 37)
+    return [
+        open_ms,
+        f"{o:.8f}",
+        f"{max(o, c) + 20:.8f}",
+        f"{min(o, c) - 20:.8f}",
+        f"{c:.8f}",
+        f"{vol:.8f}",
+        open_ms + step - 1,
+        f"{vol * c:.8f}",
+        int(100 + i % 11),
+        f"{vol / 2:.8f}",
+        f"{vol * c / 2:.8f}",
+        "0",
+    ]
+
+
+def stub_klines(
+    interval: str,
+    limit: int = 500,
+    start_ms: Optional[int] = None,
+    end_ms: Optional[int] = None,
+    now_ms: Optional[int] = None,
+) -> List[List[Any]]:
+    """照 Binance 規則挑出 open_time 落在 [startTime, endTime] 的 K 線（最多 limit 根）。"""
+    step = INTERVAL_MS[interval]
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    last = candle_open_ms(min(now_ms, end_ms) if end_ms is not None else now_ms, interval)
+    if start_ms is not None:
+        first = max(candle_open_ms(start_ms, interval), STUB_FIRST_OPEN_MS)
+        if first < start_ms:
+            first += step
+        opens = range(first, min(last, first + (limit - 1) * step) + 1, step)
+    else:
+        first = max(last - (limit - 1) * step, candle_open_ms(STUB_FIRST_OPEN_MS, interval))
+        opens = range(first, last + 1, step)
+    return [stub_kline(t, interval) for t in opens]
+
+
+def stub_kline_event(symbol: str, interval: str, open_ms: int, closed: bool = False) -> Dict[str, Any]:
+    """open_ms 那根的 kline 串流訊息（Binance combined stream 格式）。"""
+    row = stub_kline(open_ms, interval)
+    k = {
+        "t": row[0], "T": row[6], "s": symbol.upper(), "i": interval,
+        "o": row[1], "h": row[2], "l": row[3], "c": row[4], "v": row[5],
+        "n": row[8], "x": closed, "q": row[7], "V": row[9], "Q": row[10],
+    }
+    return {
+        "stream": f"{symbol.lower()}@kline_{interval}",
+        "data": {"e": "kline", "E": int(time.time() * 1000), "s": symbol.upper(), "k": k},
+    }
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server: "BinanceStubServer"
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        pass
+
+    def _send_json(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:  # noqa: N802
+        srv = self.server
+        srv.enter()
+        try:
+            delay = srv.delay_sec
+            if srv.tail_prob > 0 and random.random() < srv.tail_prob:
+                delay += srv.tail_delay_sec
+            if delay > 0:
+                time.sleep(delay)
+            url = urlparse(self.path)
+            q = {k: v[0] for k, v in parse_qs(url.query).items()}
+            used, retry_after = srv.use_weight(20 if url.path == "/api/v3/exchangeInfo" else 2)
+            headers = {"X-MBX-USED-WEIGHT-1M": str(used)}
+            if retry_after is not None:
+                headers["Retry-After"] = str(retry_after)
+                self._send_json(429, {"code": -1003, "msg": "Too many requests."}, headers)
+                return
+            if srv.fail_status is not None:
+                if srv.fail_retry_after is not None:
+                    headers["Retry-After"] = str(srv.fail_retry_after)
+                self._send_json(srv.fail_status, {"code": -1, "msg": "stub failure"}, headers)
+                return
+            if url.path == "/api/v3/exchangeInfo":
+                self._send_json(200, stub_exchange_info(), headers)
+                return
+            if url.path != "/api/v3/klines":
+                self._send_json(404, {"code": -1, "msg": "not found"})
+                return
+            interval = q.get("interval", "")
+            if interval not in INTERVAL_MS:
+                self._send_json(400, {"code": -1120, "msg": "Invalid interval."})
+                return
+            rows = stub_klines(
+                interval,
+                limit=min(int(q.get("limit", 500)), 1000),
+                start_ms=int(q["startTime"]) if "startTime" in q else None,
+                end_ms=int(q["endTime"]) if "endTime" in q else None,
+            )
+            self._send_json(200, rows, headers)
+        finally:
+            srv.leave()
+
+
+class BinanceStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        addr: Tuple[str, int],
+        delay_sec: float = 0.0,
+        weight_limit: int = 6000,
+        tail_prob: float = 0.0,
+        tail_delay_sec: float = 0.0,
+    ):
+        super().__init__(addr, _StubHandler)
+        self.delay_sec = delay_sec
+        self.tail_prob = tail_prob
+        self.tail_delay_sec = tail_delay_sec
+        self.weight_limit = weight_limit
+        self.fail_status: Optional[int] = None
+        self.fail_retry_after: Optional[int] = None
+        self._lock = threading.Lock()
+        self._window = 0
+        self._used = 0
+        self.stats: Dict[str, int] = {"requests": 0, "inflight": 0, "max_inflight": 0, "rate_limited": 0}
+
+    def use_weight(self, weight: int) -> Tuple[int, Optional[int]]:
+        """記一次 weight；回傳 (這分鐘已用 weight, 超過上限時的 Retry-After 秒數)。"""
+        now = time.time()
+        with self._lock:
+            window = int(now // 60)
+            if window != self._window:
+                self._window, self._used = window, 0
+            self._used += weight
+            if self._used > self.weight_limit:
+                self.stats["rate_limited"] += 1
+                return self._used, int(60 - now % 60) + 1
+            return self._used, None
+
+    def enter(self) -> None:
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["inflight"] += 1
+            self.stats["max_inflight"] = max(self.stats["max_inflight"], self.stats["inflight"])
+
+    def leave(self) -> None:
+        with self._lock:
+            self.stats["inflight"] -= 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_stub_server(
+    port: int = 0,
+    delay_sec: float = 0.0,
+    host: str = "127.0.0.1",
+    weight_limit: int = 6000,
+    tail_prob: float = 0.0,
+    tail_delay_sec: float = 0.0,
+) -> BinanceStubServer:
+    """在背景 thread 啟動 stub server；port=0 會自動挑空的 port（看 server.base_url）。"""
+    server = BinanceStubServer(
+        (host, port),
+        delay_sec=delay_sec,
+        weight_limit=weight_limit,
+        tail_prob=tail_prob,
+        tail_delay_sec=tail_delay_sec,
+    )
+    threading.Thread(target=server.serve_forever, name="binance-stub", daemon=True).start()
+    return server
+
+
+class StubStream:
+    """背景 thread 跑的 websocket kline 串流（需要 `websockets`）。"""
+
+    def __init__(self, host: str, port: int, interval_sec: float):
+        self.interval_sec = interval_sec
+        self.connections = 0
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._server: Any = None
+        self.port = port
+        self.host = host
+        threading.Thread(target=self._run, name="binance-stub-ws", daemon=True).start()
+        self._ready.wait(5)
+
+    async def _handler(self, ws: Any) -> None:
+        self.connections += 1
+        path = getattr(getattr(ws, "request", None), "path", None) or getattr(ws, "path", "")
+        streams = parse_qs(urlparse(path).query).get("streams", [""])[0].split("/")
+        subs = [(n.split("@kline_")[0], n.split("@kline_")[1]) for n in streams if "@kline_" in n]
+        try:
+            while True:
+                now = int(time.time() * 1000)
+                for sym, itv in subs:
+                    await ws.send(json.dumps(stub_kline_event(sym, itv, candle_open_ms(now, itv))))
+                await asyncio.sleep(self.interval_sec)
+        except websockets.ConnectionClosed:
+            pass
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+
+        async def main() -> None:
+            self._server = await websockets.serve(self._handler, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+            self._ready.set()
+            await self._server.wait_closed()
+
+        self._loop.run_until_complete(main())
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}/stream"
+
+    def drop_connections(self) -> None:
+        """把目前的連線都斷掉（測試 client 重連用）。"""
+        def close_all() -> None:
+            for conn in list(getattr(self._server, "connections", ())):
+                asyncio.ensure_future(conn.close())
+
+        self._loop.call_soon_threadsafe(close_all)
+
+    def close(self) -> None:
+        self._loop.call_soon_threadsafe(self._server.close)
+
+
+def start_stub_stream(port: int = 0, interval_sec: float = 1.0, host: str = "127.0.0.1") -> StubStream:
+    if websockets is None:
+        raise RuntimeError("`websockets` is not installed")
+    return StubStream(host, port, interval_sec)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Binance klines stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to sleep per request")
+    parser.add_argument("--tail-prob", type=float, default=0.0, help="fraction of requests that get --tail-delay extra")
+    parser.add_argument("--tail-delay", type=float, default=0.0)
+    parser.add_argument("--ws-port", type=int, default=0, help="also serve a kline websocket stream on this port")
+    args = parser.parse_args()
+
+    if args.ws_port:
+        ws = start_stub_stream(args.ws_port, host=args.host)
+        print(f"[INFO] Binance stub stream on {ws.url}")
+
+    srv = BinanceStubServer(
+        (args.host, args.port), delay_sec=args.delay, tail_prob=args.tail_prob, tail_delay_sec=args.tail_delay
+    )
+    print(f"[INFO] Binance stub listening on {srv.base_url}")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
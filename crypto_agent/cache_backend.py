@@ -0,0 +1,429 @@
+from __future__ import annotations
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import SHARED_CACHE_BACKEND, SHARED_CACHE_LEASE_SEC, SHARED_CACHE_LOCK_WAIT_SEC, SHARED_CACHE_PATH
+
+"""
+Cache backend：K 線與 LLM / graph 結果共用的快取介面。
+
+- InProcessCache：process 內的 dict（預設；單一 worker 時就夠了）
+- SqliteCache   ：本機 SQLite（WAL），同一台機器上所有 uvicorn / gunicorn worker 共用一份 warm cache
+    * 每次 put 是一個 transaction（INSERT OR REPLACE），其他 worker 不會讀到寫一半的值
+    * value 用 pickle 存（檔案是本機自己產生的 state，不要指到別人可寫的路徑）
+
+兩者都支援：
+- get / put（可帶 ttl_sec）/ delete / clear
+- lock(ns, key)：同一個 key 同時只讓一個呼叫者（跨 worker）去打上游
+    * 持有期間背景 thread 每 lease_sec / 3 續約一次 → 算很久（整個 graph）也不會被別人搶走；
+      持有者的 process 掛掉、沒人續約，lease_sec 秒後別人就能接手
+    * 等的人最多等 SHARED_CACHE_LOCK_WAIT_SEC 秒（持有者卡住時的保險），超過才放棄、自己算
+- get_or_compute(ns, key, fn)：沒有快取就拿 lock 算一次，其他人等結果 → worker 變多也不會放大上游負載
+"""
+
+_POLL_SEC = 0.05
+_PRUNE_EVERY_PUTS = 100
+# lease 剩 2/3 時續約
+_RENEW_FRACTION = 1 / 3
+
+
+class CacheBackend:
+    shared = False
+
+    def __init__(self) -> None:
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "hit": 0, "miss": 0, "put": 0, "computed": 0,
+            "lock_wait": 0, "lock_timeout": 0, "lease_renewed": 0, "lease_lost": 0,
+        }
+        # 持有中、需要續約的 lease：(ns, key) → (owner, lease_sec, 下次續約時間)
+        self._held: Dict[Tuple[str, str], Tuple[str, float, float]] = {}
+        self._held_cond = threading.Condition()
+        self._renewer: Optional[threading.Thread] = None
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[name] += n
+
+    # ---- 子類別實作 ----
+
+    def get(self, ns: str, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def put(self, ns: str, key: str, value: Any, ttl_sec: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, ns: str, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self, ns: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    def _try_lock(self, ns: str, key: str, lease_sec: float, wait_sec: float) -> bool:
+        """最多等 wait_sec 秒試著拿 lock（0 = 不等）。"""
+        raise NotImplementedError
+
+    def _unlock(self, ns: str, key: str) -> None:
+        raise NotImplementedError
+
+    def _lease_owner(self) -> Optional[str]:
+        """需要續約的 backend 回傳目前 thread 的 owner id；不需要續約（process 內的 lock）回 None。"""
+        return None
+
+    def _renew(self, ns: str, key: str, owner: str, lease_sec: float) -> bool:
+        """把 lease 延長到 now + lease_sec；lease 已經不是自己的就回 False。"""
+        return True
+
+    # ---- 共用邏輯 ----
+
+    @contextmanager
+    def lock(
+        self,
+        ns: str,
+        key: str,
+        lease_sec: float = SHARED_CACHE_LEASE_SEC,
+        wait_sec: float = SHARED_CACHE_LOCK_WAIT_SEC,
+    ) -> Iterator[bool]:
+        """
+        等到拿到 (ns, key) 的 lock 為止（持有期間自動續約）；等超過 wait_sec 就放棄等待
+        （yield False，照樣往下做），避免持有者卡住時所有人跟著卡死。
+        """
+        deadline = time.monotonic() + wait_sec
+        acquired = self._try_lock(ns, key, lease_sec, 0.0)
+        if not acquired:
+            self._count("lock_wait")
+        while not acquired:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            slice_ = min(remaining, _POLL_SEC)
+            t0 = time.monotonic()
+            acquired = self._try_lock(ns, key, lease_sec, slice_)
+            if not acquired:
+                time.sleep(max(0.0, slice_ - (time.monotonic() - t0)))
+        if not acquired:
+            self._count("lock_timeout")
+            yield False
+            return
+
+        owner = self._lease_owner()
+        if owner is not None:
+            self._hold(ns, key, owner, lease_sec)
+        try:
+            yield True
+        finally:
+            if owner is not None:
+                self._release_hold(ns, key)
+            self._unlock(ns, key)
+
+    # ---- lease 續約 ----
+
+    def _hold(self, ns: str, key: str, owner: str, lease_sec: float) -> None:
+        with self._held_cond:
+            self._held[(ns, key)] = (owner, lease_sec, time.monotonic() + lease_sec * _RENEW_FRACTION)
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_loop, name="cache-lease-renew", daemon=True)
+                self._renewer.start()
+            self._held_cond.notify()
+
+    def _release_hold(self, ns: str, key: str) -> None:
+        with self._held_cond:
+            self._held.pop((ns, key), None)
+
+    def _renew_loop(self) -> None:
+        while True:
+            with self._held_cond:
+                now = time.monotonic()
+                due = [(k, v) for k, v in self._held.items() if v[2] <= now]
+                for k, (owner, lease_sec, _) in due:
+                    self._held[k] = (owner, lease_sec, now + lease_sec * _RENEW_FRACTION)
+                nxt = min((v[2] for v in self._held.values()), default=None)
+                if not due:
+                    self._held_cond.wait(None if nxt is None else max(0.0, nxt - now))
+                    continue
+            for (ns, key), (owner, lease_sec, _) in due:
+                try:
+                    ok = self._renew(ns, key, owner, lease_sec)
+                except Exception as e:
+                    print(f"[WARN] Cache lease renew failed for {ns}:{key}:", repr(e))
+                    continue
+                if ok:
+                    self._count("lease_renewed")
+                    continue
+                with self._held_cond:
+                    still_held = self._held.get((ns, key), ("",))[0] == owner
+                if still_held:
+                    # 沒續到：lease 已過期被別人接手（例如這個 process 卡太久）
+                    self._count("lease_lost")
+                    print(f"[WARN] Cache lease for {ns}:{key} was taken over by another worker")
+
+    def get_or_compute(
+        self,
+        ns: str,
+        key: str,
+        fn: Callable[[], Any],
+        ttl_sec: Optional[float] = None,
+        lease_sec: float = SHARED_CACHE_LEASE_SEC,
+    ) -> Any:
+        """有快取就回傳；沒有就只讓一個呼叫者跑 fn()，結果寫回快取（None 不快取）。"""
+        value = self.get(ns, key)
+        if value is not None:
+            return value
+        with self.lock(ns, key, lease_sec):
+            # 等 lock 的期間別人可能已經算好了
+            value = self.get(ns, key)
+            if value is not None:
+                return value
+            value = fn()
+            self._count("computed")
+            if value is not None:
+                self.put(ns, key, value, ttl_sec)
+            return value
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {"backend": type(self).__name__, "shared": self.shared, **self.stats}
+
+
+class InProcessCache(CacheBackend):
+    """process 內的快取：value 直接存物件本身（不複製），呼叫端不要改它。"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._data: Dict[Tuple[str, str], Tuple[Optional[float], Any]] = {}
+        self._lock = threading.Lock()
+        # 每個 key 的 lock + 參考數（持有中 + 等待中的 thread 數）；歸零就刪掉，不會隨 key 無限增長
+        self._key_locks: Dict[Tuple[str, str], List[Any]] = {}
+        self._puts = 0
+
+    def get(self, ns: str, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get((ns, key))
+            if item is not None and item[0] is not None and item[0] <= time.time():
+                del self._data[(ns, key)]
+                item = None
+        self._count("hit" if item is not None else "miss")
+        return item[1] if item is not None else None
+
+    def put(self, ns: str, key: str, value: Any, ttl_sec: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl_sec if ttl_sec else None
+        with self._lock:
+            self._data[(ns, key)] = (expires_at, value)
+            self._puts += 1
+            if self._puts % _PRUNE_EVERY_PUTS == 0:
+                now = time.time()
+                for k in [k for k, (exp, _) in self._data.items() if exp is not None and exp <= now]:
+                    del self._data[k]
+        self._count("put")
+
+    def delete(self, ns: str, key: str) -> None:
+        with self._lock:
+            self._data.pop((ns, key), None)
+
+    def clear(self, ns: Optional[str] = None) -> None:
+        with self._lock:
+            if ns is None:
+                self._data.clear()
+            else:
+                for k in [k for k in self._data if k[0] == ns]:
+                    del self._data[k]
+
+    def _try_lock(self, ns: str, key: str, lease_sec: float, wait_sec: float) -> bool:
+        k = (ns, key)
+        with self._lock:
+            entry = self._key_locks.get(k)
+            if entry is None:
+                entry = self._key_locks[k] = [threading.Lock(), 0]
+            entry[1] += 1
+        if entry[0].acquire(timeout=wait_sec) if wait_sec > 0 else entry[0].acquire(blocking=False):
+            return True
+        self._deref(k)
+        return False
+
+    def _unlock(self, ns: str, key: str) -> None:
+        k = (ns, key)
+        self._key_locks[k][0].release()
+        self._deref(k)
+
+    def _deref(self, k: Tuple[str, str]) -> None:
+        with self._lock:
+            entry = self._key_locks[k]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._key_locks[k]
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            key_locks = len(self._key_locks)
+        return {**super().metrics(), "key_locks": key_locks}
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    ns         TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    value      BLOB NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (ns, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cache_lease (
+    ns         TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    owner      TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+) WITHOUT ROWID;
+"""
+
+
+class SqliteCache(CacheBackend):
+    """同一台機器上多個 worker 共用的快取（SQLite WAL）。"""
+
+    shared = True
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._puts = 0
+        # 同一個 process 內先用 thread lock 排隊，不用每個 thread 都去輪詢 SQLite
+        self._inproc = InProcessCache()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SQLITE_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, ns: str, key: str) -> Optional[Any]:
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM cache WHERE ns = ? AND key = ?", (ns, key)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            self._count("miss")
+            return None
+        try:
+            value = pickle.loads(row[0])
+        except Exception as e:
+            print("[WARN] Shared cache decode failed:", repr(e))
+            self._count("miss")
+            return None
+        self._count("hit")
+        return value
+
+    def put(self, ns: str, key: str, value: Any, ttl_sec: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl_sec if ttl_sec else None
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (ns, key, sqlite3.Binary(blob), expires_at),
+        )
+        self._count("put")
+        self._puts += 1
+        if self._puts % _PRUNE_EVERY_PUTS == 0:
+            conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def delete(self, ns: str, key: str) -> None:
+        self._conn().execute("DELETE FROM cache WHERE ns = ? AND key = ?", (ns, key))
+
+    def clear(self, ns: Optional[str] = None) -> None:
+        conn = self._conn()
+        if ns is None:
+            conn.execute("DELETE FROM cache")
+        else:
+            conn.execute("DELETE FROM cache WHERE ns = ?", (ns,))
+
+    def _owner(self) -> str:
+        return f"{os.getpid()}:{threading.get_ident()}"
+
+    def _lease_owner(self) -> Optional[str]:
+        return self._owner()
+
+    def _renew(self, ns: str, key: str, owner: str, lease_sec: float) -> bool:
+        cur = self._conn().execute(
+            "UPDATE cache_lease SET expires_at = ? WHERE ns = ? AND key = ? AND owner = ?",
+            (time.time() + lease_sec, ns, key, owner),
+        )
+        return cur.rowcount > 0
+
+    def _try_lock(self, ns: str, key: str, lease_sec: float, wait_sec: float) -> bool:
+        if not self._inproc._try_lock(ns, key, lease_sec, wait_sec):
+            return False
+        now = time.time()
+        conn = self._conn()
+        try:
+            # BEGIN IMMEDIATE：拿寫鎖後才檢查 lease，兩個 worker 不會同時拿到
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT expires_at FROM cache_lease WHERE ns = ? AND key = ?", (ns, key)
+            ).fetchone()
+            ok = row is None or row[0] <= now
+            if ok:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_lease (ns, key, owner, expires_at) VALUES (?, ?, ?, ?)",
+                    (ns, key, self._owner(), now + lease_sec),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            ok = False
+        if not ok:
+            self._inproc._unlock(ns, key)
+        return ok
+
+    def _unlock(self, ns: str, key: str) -> None:
+        try:
+            self._conn().execute(
+                "DELETE FROM cache_lease WHERE ns = ? AND key = ? AND owner = ?", (ns, key, self._owner())
+            )
+        finally:
+            self._inproc._unlock(ns, key)
+
+
+# ----------------------------
+# Module-level backend
+# ----------------------------
+
+_backend: Optional[CacheBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_cache_backend() -> CacheBackend:
+    """依 SHARED_CACHE_BACKEND（memory / sqlite）建立全域快取；sqlite 開不起來就退回 memory。"""
+    global _backend
+    if _backend is not None:
+        return _backend
+    with _backend_lock:
+        if _backend is None:
+            kind = SHARED_CACHE_BACKEND
+            if kind == "sqlite":
+                try:
+                    _backend = SqliteCache(SHARED_CACHE_PATH)
+                    print(f"[INFO] Shared cache: sqlite {SHARED_CACHE_PATH}")
+                except Exception as e:
+                    print("[WARN] Shared cache init failed, using in-process cache:", repr(e))
+            elif kind != "memory":
+                print(f"[WARN] Unknown SHARED_CACHE_BACKEND={kind!r}, using in-process cache")
+            if _backend is None:
+                _backend = InProcessCache()
+    return _backend
+
+
+def cache_backend_stats() -> Dict[str, Any]:
+    return get_cache_backend().metrics()
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import json
+import math
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+"""
+K 線放進 LLM prompt 時的編碼方式（PROMPT_CANDLE_ENCODING）：
+
+- json    ：舊版，json.dumps 每根一個 dict（key 每根重複、float 全精度）→ token 最多
+- compact ：一行 header + 每根一行 CSV，價格依交易對 tickSize 決定小數位數、去掉尾端 0
+- features：不放原始 K 線，改放算好的摘要（區間高低點、報酬率、量能）+ 最近幾根 compact 列
+
+價格小數位數：有 tickSize（symbol_index）就用它；沒有就保留 6 位有效數字。
+"""
+
+ENCODINGS = ("json", "compact", "features")
+
+COMPACT_FIELDS = ("date", "open", "high", "low", "close", "volume")
+
+_PRICE_SIG_DIGITS = 6
+_VOLUME_SIG_DIGITS = 4
+# features 模式最後附上幾根原始 K 線
+FEATURE_TAIL_BARS = 5
+
+
+def _decimals_for(value: float, sig_digits: int) -> int:
+    if not value:
+        return 0
+    int_digits = int(math.floor(math.log10(abs(value)))) + 1
+    return min(8, max(0, sig_digits - int_digits))
+
+
+def fmt_number(value: float, decimals: int) -> str:
+    """固定小數位數後去掉尾端 0（13170.00 → 13170）。"""
+    s = f"{value:.{decimals}f}"
+    if "." in s:
+        s = s.rstrip("0").rstrip(".")
+    return s
+
+
+def price_decimals(rows: Sequence[Dict[str, Any]], precision: Optional[int] = None) -> int:
+    """tickSize 的小數位數優先；否則依最後一根收盤價的量級保留 6 位有效數字。"""
+    if precision is not None:
+        return precision
+    return _decimals_for(float(rows[-1]["close"]), _PRICE_SIG_DIGITS) if rows else 2
+
+
+def _compact_row(r: Dict[str, Any], pd_: int) -> str:
+    vol = float(r["volume"])
+    return ",".join(
+        [
+            str(r["date"]),
+            fmt_number(float(r["open"]), pd_),
+            fmt_number(float(r["high"]), pd_),
+            fmt_number(float(r["low"]), pd_),
+            fmt_number(float(r["close"]), pd_),
+            fmt_number(vol, _decimals_for(vol, _VOLUME_SIG_DIGITS)),
+        ]
+    )
+
+
+def encode_compact(rows: Sequence[Dict[str, Any]], precision: Optional[int] = None, header: bool = True) -> str:
+    if not rows:
+        return ""
+    pd_ = price_decimals(rows, precision)
+    lines = [",".join(COMPACT_FIELDS)] if header else []
+    lines.extend(_compact_row(r, pd_) for r in rows)
+    return "\n".join(lines)
+
+
+def _pct(a: float, b: float) -> str:
+    return f"{(a / b - 1) * 100:+.2f}%" if b else "n/a"
+
+
+def encode_features(rows: Sequence[Dict[str, Any]], precision: Optional[int] = None) -> str:
+    """區間摘要 + 最後 FEATURE_TAIL_BARS 根 compact 列。"""
+    if not rows:
+        return ""
+    pd_ = price_decimals(rows, precision)
+    closes = [float(r["close"]) for r in rows]
+    highs = [float(r["high"]) for r in rows]
+    lows = [float(r["low"]) for r in rows]
+    vols = [float(r["volume"]) for r in rows]
+    last = closes[-1]
+    hi, lo = max(highs), min(lows)
+    up_days = sum(1 for i in range(1, len(closes)) if closes[i] > closes[i - 1])
+    ranges = [(h - l) / c * 100 for h, l, c in zip(highs, lows, closes) if c]
+    recent_vol = sum(vols[-7:]) / len(vols[-7:])
+    avg_vol = sum(vols) / len(vols)
+
+    lines = [
+        f"bars={len(rows)} ({rows[0]['date']}~{rows[-1]['date']})",
+        f"last_close={fmt_number(last, pd_)}",
+        f"range_high={fmt_number(hi, pd_)} ({_pct(last, hi)} from high)",
+        f"range_low={fmt_number(lo, pd_)} ({_pct(last, lo)} from low)",
+    ]
+    rets = [f"{n}d={_pct(last, closes[-1 - n])}" for n in (1, 7, 14) if len(closes) > n]
+    rets.append(f"{len(closes) - 1}d={_pct(last, closes[0])}")
+    lines.append("returns: " + " ".join(rets))
+    lines.append(f"up_days={up_days}/{len(closes) - 1}")
+    lines.append(f"avg_range={sum(ranges) / len(ranges):.2f}%" if ranges else "avg_range=n/a")
+    lines.append(f"vol_7d_vs_avg={recent_vol / avg_vol:.2f}x" if avg_vol else "vol_7d_vs_avg=n/a")
+    lines.append(f"last {min(FEATURE_TAIL_BARS, len(rows))} bars:")
+    lines.append(encode_compact(rows[-FEATURE_TAIL_BARS:], pd_))
+    return "\n".join(lines)
+
+
+def encode_candles(
+    rows: Sequence[Dict[str, Any]],
+    encoding: str = "compact",
+    precision: Optional[int] = None,
+) -> str:
+    """rows：_serialize_candles 的輸出（[{"date", "open", "high", "low", "close", "volume"}]）。"""
+    if encoding == "json":
+        return json.dumps(list(rows), ensure_ascii=False)
+    if encoding == "features":
+        return encode_features(rows, precision)
+    return encode_compact(rows, precision)
+
+
+def encoding_stats(rows: List[Dict[str, Any]], count: Callable[[str], int], precision: Optional[int] = None) -> Dict[str, int]:
+    """每種編碼的 token 數（count = llm_client.estimate_tokens 之類的函式）。"""
+    return {enc: count(encode_candles(rows, enc, precision)) for enc in ENCODINGS}
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import io
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+"""
+CandleArray：以欄為單位（columnar）存 K 線的輕量容器，取代 hot path 上的 pandas DataFrame。
+
+- 每個欄位是一個 NumPy array（float64 / int64），沒有 per-row Python 物件
+- 時間欄位（open_time / close_time）以 int64 毫秒存放
+- tail() / 切片回傳的是 view（zero-copy）；所有 array 設為唯讀，快取可以放心共用
+- to_records() 用向量化方式轉成 JSON-friendly 的 list[dict]（給 LLM prompt 用）
+- to_dataframe() / from_dataframe() 與 data_binance._get_klines 的 DataFrame 格式互轉
+"""
+
+KLINE_COLUMNS = (
+    "open_time",
+    "open",
+    "high",
+    "low",
+    "close",
+    "volume",
+    "close_time",
+    "quote_asset_volume",
+    "number_of_trades",
+    "taker_buy_base_asset_volume",
+    "taker_buy_quote_asset_volume",
+)
+
+INT_COLUMNS = frozenset({"open_time", "close_time", "number_of_trades"})
+
+_EPOCH = pd.Timestamp(0, unit="ms", tz="UTC")
+
+
+def _freeze(a: np.ndarray) -> np.ndarray:
+    a.flags.writeable = False
+    return a
+
+
+class CandleArray:
+    __slots__ = KLINE_COLUMNS
+
+    def __init__(self, **columns: Any):
+        for name in KLINE_COLUMNS:
+            dtype = np.int64 if name in INT_COLUMNS else np.float64
+            col = columns.get(name)
+            if col is None:
+                raise ValueError(f"missing candle column: {name}")
+            # 直接接管傳進來的 array（不複製），並設為唯讀
+            arr = np.asarray(col, dtype=dtype)
+            if arr.flags.writeable:
+                _freeze(arr)
+            object.__setattr__(self, name, arr)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("CandleArray is immutable")
+
+    def __reduce__(self):
+        # pickle（跨 worker 的共用快取）：用欄位重建，__init__ 會再設為唯讀
+        return (_from_columns, ({c: getattr(self, c) for c in KLINE_COLUMNS},))
+
+    # ---- constructors ----
+
+    @classmethod
+    def empty(cls) -> "CandleArray":
+        return cls(**{c: np.empty(0) for c in KLINE_COLUMNS})
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Sequence[Any]]) -> "CandleArray":
+        """
+        Binance /api/v3/klines 的 JSON rows（list of lists，數字多半是字串）。
+        """
+        if len(rows) == 0:
+            return cls.empty()
+        cols = list(zip(*rows))
+        out: Dict[str, np.ndarray] = {}
+        for i, name in enumerate(KLINE_COLUMNS):
+            if name in INT_COLUMNS:
+                out[name] = np.array(cols[i], dtype=np.int64)
+            else:
+                out[name] = np.array(cols[i], dtype=np.float64)
+        return cls(**out)
+
+    @classmethod
+    def from_json_bytes(cls, data: bytes) -> "CandleArray":
+        """
+        直接從 Binance /api/v3/klines 的 response bytes 解析成 typed arrays，
+        不經過 json.loads（不會產生 n * 12 個 Python 字串 / 數字物件）。
+
+        [[1499040000000,"0.01634790",...,"0"],[...]]
+          → 去掉引號與空白、把 "],[" 換成換行 → CSV
+          → np.loadtxt 一次解析成 float64 矩陣（C 實作，數值與 float(str) 完全一致）
+          → open_time / close_time / number_of_trades 轉回 int64（都 < 2^53，轉換無誤差）
+        格式不符時丟 ValueError（呼叫端可退回 json 解析）。
+        """
+        body = bytes(data).translate(None, b' \t\r\n"')
+        if body == b"[]":
+            return cls.empty()
+        if not (body.startswith(b"[[") and body.endswith(b"]]")):
+            raise ValueError(f"unexpected klines payload: {body[:200]!r}")
+
+        csv = body[2:-2].replace(b"],[", b"\n")
+        m = np.loadtxt(
+            io.BytesIO(csv),
+            delimiter=",",
+            dtype=np.float64,
+            usecols=range(len(KLINE_COLUMNS)),
+            ndmin=2,
+        )
+        out: Dict[str, np.ndarray] = {}
+        for i, name in enumerate(KLINE_COLUMNS):
+            col = m[:, i]
+            out[name] = col.astype(np.int64) if name in INT_COLUMNS else np.ascontiguousarray(col)
+        return cls(**out)
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "CandleArray":
+        out: Dict[str, np.ndarray] = {}
+        for name in KLINE_COLUMNS:
+            if name not in df.columns:
+                raise ValueError(f"missing candle column: {name}")
+            s = df[name]
+            if name in ("open_time", "close_time"):
+                if pd.api.types.is_datetime64_any_dtype(s):
+                    s = (s - _EPOCH) // pd.Timedelta(milliseconds=1)
+                out[name] = s.to_numpy(dtype=np.int64, copy=True)
+            elif name in INT_COLUMNS:
+                out[name] = pd.to_numeric(s, errors="coerce").to_numpy(dtype=np.int64, copy=True)
+            else:
+                out[name] = pd.to_numeric(s, errors="coerce").to_numpy(dtype=np.float64, copy=True)
+        return cls(**out)
+
+    @classmethod
+    def concat(cls, parts: Iterable["CandleArray"]) -> "CandleArray":
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls.empty()
+        if len(parts) == 1:
+            return parts[0]
+        return cls(**{c: np.concatenate([getattr(p, c) for p in parts]) for c in KLINE_COLUMNS})
+
+    # ---- access ----
+
+    def __len__(self) -> int:
+        return len(self.open_time)
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, str):
+            return getattr(self, key)
+        if isinstance(key, slice):
+            return CandleArray(**{c: getattr(self, c)[key] for c in KLINE_COLUMNS})
+        raise TypeError("CandleArray supports column names or slices")
+
+    def take(self, idx: np.ndarray) -> "CandleArray":
+        return CandleArray(**{c: getattr(self, c)[idx] for c in KLINE_COLUMNS})
+
+    def tail(self, n: int) -> "CandleArray":
+        """最後 n 根（view，不複製）。"""
+        n = int(n)
+        if n >= len(self):
+            return self
+        return self[len(self) - n:] if n > 0 else self[0:0]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, c).nbytes for c in KLINE_COLUMNS)
+
+    def is_sorted(self) -> bool:
+        t = self.open_time
+        return len(t) < 2 or bool(np.all(t[1:] > t[:-1]))
+
+    def sorted(self) -> "CandleArray":
+        """依 open_time 排序並去除重複（後出現的為準）；本來就排好就直接回傳自己。"""
+        if self.is_sorted():
+            return self
+        t = self.open_time
+        # 反轉後 unique 取第一個 = 原本最後出現的那筆
+        _, idx_rev = np.unique(t[::-1], return_index=True)
+        idx = len(t) - 1 - idx_rev
+        return self.take(idx)
+
+    def closed_mask(self, now_ms: int) -> np.ndarray:
+        return self.close_time < int(now_ms)
+
+    def last_row(self) -> Dict[str, Any]:
+        if len(self) == 0:
+            return {}
+        return {c: getattr(self, c)[-1].item() for c in KLINE_COLUMNS}
+
+    # ---- export ----
+
+    def to_dataframe(self) -> pd.DataFrame:
+        data: Dict[str, Any] = {c: getattr(self, c) for c in KLINE_COLUMNS}
+        df = pd.DataFrame(data)
+        df["open_time"] = pd.to_datetime(df["open_time"], unit="ms", utc=True)
+        df["close_time"] = pd.to_datetime(df["close_time"], unit="ms", utc=True)
+        df["ignore"] = "0"
+        return df
+
+    def to_records(self, n: Optional[int] = None, fields: Sequence[str] = ("open", "high", "low", "close", "volume")) -> List[Dict[str, Any]]:
+        """
+        最後 n 根轉成 [{"date": "YYYY-MM-DD", "open": ..., ...}]，date 取 close_time（UTC）。
+        """
+        c = self.tail(n) if n is not None else self
+        dates = np.datetime_as_string(c.close_time.astype("datetime64[ms]"), unit="D").tolist()
+        values = [getattr(c, f).tolist() for f in fields]
+        return [dict(zip(("date", *fields), row)) for row in zip(dates, *values)]
+
+
+def _from_columns(columns: Dict[str, np.ndarray]) -> CandleArray:
+    return CandleArray(**columns)
@@ -7,6 +7,109 @@ BINANCE_API_SECRET = os.getenv("BINANCE_API_SECRET", "")
 
 SYMBOL = os.getenv("SYMBOL", "BTCUSDT").upper()
 
+# K 線快取：已收盤 K 線永久保留，只刷新未收盤那根（尾端）
+KLINE_CACHE_ENABLED = os.getenv("KLINE_CACHE_ENABLED", "true").lower() == "true"
+# 未收盤 K 線在同一個 interval 內最多多久重抓一次（秒）
+KLINE_OPEN_TAIL_REFRESH_SEC = float(os.getenv("KLINE_OPEN_TAIL_REFRESH_SEC", "60"))
+
+# 已收盤 K 線的本地持久化（SQLite），重啟後只補抓缺的區間；opt-in（開了會寫 KLINE_STORE_PATH）
+KLINE_STORE_ENABLED = os.getenv("KLINE_STORE_ENABLED", "false").lower() == "true"
+KLINE_STORE_PATH = os.getenv("KLINE_STORE_PATH", ".cache/klines.sqlite3").strip()
+
+# 跨 worker 共用快取（K 線 / LLM / 分析結果）：memory = 每個 process 各自一份；sqlite = 同機所有 worker 共用
+SHARED_CACHE_BACKEND = os.getenv("SHARED_CACHE_BACKEND", "memory").strip().lower()
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", ".cache/shared.sqlite3").strip()
+# 共用快取 lock 的 lease：持有者每 1/3 lease 續約一次，process 掛掉沒人續約時這麼久之後別人可以接手
+SHARED_CACHE_LEASE_SEC = float(os.getenv("SHARED_CACHE_LEASE_SEC", "30"))
+# 等別的 worker 算同一個 key 最多等幾秒（LLM 分析可能很久；超過就自己算，避免持有者卡住時大家一起卡）
+SHARED_CACHE_LOCK_WAIT_SEC = float(os.getenv("SHARED_CACHE_LOCK_WAIT_SEC", "600"))
+# 背景分析 worker pool：同時跑幾個分析、最多排隊幾個（滿了 LINE 直接回忙碌訊息）
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+ANALYSIS_QUEUE_MAX = int(os.getenv("ANALYSIS_QUEUE_MAX", "32"))
+# 同一個 (symbol, intent, candle epoch) 的分析結果保留幾秒給其他 worker / 重複詢問直接用（0 = 不快取）
+ANALYSIS_CACHE_TTL_SEC = float(os.getenv("ANALYSIS_CACHE_TTL_SEC", "60"))
+# 週線 / 日線分析師只看市場資料：同一個 (symbol, 日線 epoch) 算一次，所有 intent / 使用者共用（0 = 不快取）
+MARKET_ANALYST_CACHE_TTL_SEC = float(os.getenv("MARKET_ANALYST_CACHE_TTL_SEC", "172800"))
+
+# Binance REST base URL（可指向本地 stand-in server，例如 binance_stub.py）
+BINANCE_API_BASE = os.getenv("BINANCE_API_BASE", "https://api.binance.com").strip().rstrip("/")
+# 同一套 API 的多個 host（第一個為預設 primary，其餘當 hedge 用的 mirror）；
+# 沒設定時：官方 host 自動帶上 api1~api4，自訂 BINANCE_API_BASE 則只用它一個
+_BINANCE_MIRRORS = ",".join(f"https://api{i}.binance.com" for i in range(1, 5))
+BINANCE_API_HOSTS = [
+    h.strip().rstrip("/")
+    for h in (
+        os.getenv("BINANCE_API_HOSTS", "").strip()
+        or (f"{BINANCE_API_BASE},{_BINANCE_MIRRORS}" if BINANCE_API_BASE == "https://api.binance.com" else BINANCE_API_BASE)
+    ).split(",")
+    if h.strip()
+]
+# Hedged request：primary 超過 hedge delay（primary 的 p95 延遲，夾在 MIN~MAX 之間）還沒回就同時打 mirror
+BINANCE_HEDGE_ENABLED = os.getenv("BINANCE_HEDGE_ENABLED", "true").lower() == "true"
+BINANCE_HEDGE_MIN_DELAY_MS = float(os.getenv("BINANCE_HEDGE_MIN_DELAY_MS", "50"))
+BINANCE_HEDGE_MAX_DELAY_MS = float(os.getenv("BINANCE_HEDGE_MAX_DELAY_MS", "2000"))
+# 延遲樣本還不夠算 p95 時用的 hedge delay
+BINANCE_HEDGE_DEFAULT_DELAY_MS = float(os.getenv("BINANCE_HEDGE_DEFAULT_DELAY_MS", "300"))
+
+# Binance HTTP session（keep-alive 連線池 + 重試）
+BINANCE_CONNECT_TIMEOUT = float(os.getenv("BINANCE_CONNECT_TIMEOUT", "3.05"))
+BINANCE_READ_TIMEOUT = float(os.getenv("BINANCE_READ_TIMEOUT", "10"))
+BINANCE_MAX_RETRIES = int(os.getenv("BINANCE_MAX_RETRIES", "3"))
+BINANCE_BACKOFF_BASE_SEC = float(os.getenv("BINANCE_BACKOFF_BASE_SEC", "0.5"))
+# 單次等待上限；非限流錯誤（5xx 等）的 Retry-After 超過這個值就直接失敗，避免卡住 LINE 回覆
+# （429 / 418 改看 BINANCE_WEIGHT_MAX_WAIT_SEC）
+BINANCE_BACKOFF_MAX_SEC = float(os.getenv("BINANCE_BACKOFF_MAX_SEC", "8"))
+BINANCE_POOL_MAXSIZE = int(os.getenv("BINANCE_POOL_MAXSIZE", "10"))
+# 同時打 Binance 的 thread 數（多個 interval 並行抓取）
+BINANCE_FETCH_WORKERS = int(os.getenv("BINANCE_FETCH_WORKERS", "8"))
+# 長歷史分頁抓取：同時在途的頁數
+BINANCE_HISTORY_WORKERS = int(os.getenv("BINANCE_HISTORY_WORKERS", "10"))
+# Binance request weight 限制（每個 IP 每分鐘），SAFETY = 只用上限的幾成，留給其他程式
+BINANCE_WEIGHT_LIMIT_PER_MIN = int(os.getenv("BINANCE_WEIGHT_LIMIT_PER_MIN", "6000"))
+BINANCE_WEIGHT_SAFETY = float(os.getenv("BINANCE_WEIGHT_SAFETY", "0.9"))
+# weight 額度不夠時最多排隊等幾秒，超過才丟錯
+BINANCE_WEIGHT_MAX_WAIT_SEC = float(os.getenv("BINANCE_WEIGHT_MAX_WAIT_SEC", "60"))
+# 高週期 K 線改由這個 base interval 在本地 resample（留空 = 每個 interval 各打一次 Binance）
+KLINE_BASE_INTERVAL = os.getenv("KLINE_BASE_INTERVAL", "1d").strip()
+
+# K 線 websocket 串流（main.py 啟動時開始訂閱，需要 `websockets` 套件）；opt-in（開了會連 Binance websocket）
+KLINE_STREAM_ENABLED = os.getenv("KLINE_STREAM_ENABLED", "false").lower() == "true"
+KLINE_STREAM_URL = os.getenv("KLINE_STREAM_URL", "wss://stream.binance.com:9443/stream").strip()
+KLINE_STREAM_SYMBOLS = [s.strip().upper() for s in os.getenv("KLINE_STREAM_SYMBOLS", SYMBOL).split(",") if s.strip()]
+KLINE_STREAM_INTERVALS = [
+    s.strip() for s in os.getenv("KLINE_STREAM_INTERVALS", KLINE_BASE_INTERVAL or "1d,1w").split(",") if s.strip()
+]
+# 每個 (symbol, interval) ring buffer 保留幾根（要夠 resample 出 220 根週線）
+KLINE_STREAM_BUFFER = int(os.getenv("KLINE_STREAM_BUFFER", "2000"))
+# 超過幾秒沒收到訊息就當作 buffer 不新鮮，改走 REST
+KLINE_STREAM_STALE_SEC = float(os.getenv("KLINE_STREAM_STALE_SEC", "60"))
+
+# 交易對索引（exchangeInfo）：訊息裡的幣種先在本地驗證，不存在就不打 Binance / LLM
+SYMBOL_INDEX_ENABLED = os.getenv("SYMBOL_INDEX_ENABLED", "true").lower() == "true"
+# 上次成功抓到的 exchangeInfo 精簡版（重啟時先載入，不用等網路）
+SYMBOL_INDEX_SNAPSHOT_PATH = os.getenv("SYMBOL_INDEX_SNAPSHOT_PATH", ".cache/exchange_info.json").strip()
+SYMBOL_INDEX_REFRESH_SEC = float(os.getenv("SYMBOL_INDEX_REFRESH_SEC", "3600"))
+# 只打幣種（例如 BTC）時配對的報價資產
+SYMBOL_DEFAULT_QUOTE = os.getenv("SYMBOL_DEFAULT_QUOTE", "USDT").strip().upper()
+
+# 預先計算：K 線收盤後（或盤中大波動）背景跑 watchlist × intents 的完整分析，LINE 直接回存好的結果
+PRECOMPUTE_ENABLED = os.getenv("PRECOMPUTE_ENABLED", "false").lower() == "true"
+PRECOMPUTE_SYMBOLS = [s.strip().upper() for s in os.getenv("PRECOMPUTE_SYMBOLS", "BTCUSDT,ETHUSDT").split(",") if s.strip()]
+# 留空 = 全部 intent
+PRECOMPUTE_INTENTS = [s.strip() for s in os.getenv("PRECOMPUTE_INTENTS", "").split(",") if s.strip()]
+# 以哪個週期的收盤當作重算時間點
+PRECOMPUTE_INTERVAL = os.getenv("PRECOMPUTE_INTERVAL", "1d").strip()
+# 收盤後等幾秒再算（讓 Binance 那根確實收好）
+PRECOMPUTE_DELAY_SEC = float(os.getenv("PRECOMPUTE_DELAY_SEC", "10"))
+# 盤中價格相對上次計算時變動超過幾 % 就重算
+PRECOMPUTE_MOVE_PCT = float(os.getenv("PRECOMPUTE_MOVE_PCT", "3"))
+# 多久檢查一次價格（秒）
+PRECOMPUTE_CHECK_SEC = float(os.getenv("PRECOMPUTE_CHECK_SEC", "60"))
+# 同時跑幾個預先計算（每個都是完整 graph + LLM）
+PRECOMPUTE_CONCURRENCY = int(os.getenv("PRECOMPUTE_CONCURRENCY", "1"))
+# 結果超過幾秒就不拿來回覆（0 = 只要還在同一根 K 線內都算新鮮）
+PRECOMPUTE_MAX_AGE_SEC = float(os.getenv("PRECOMPUTE_MAX_AGE_SEC", "0"))
+
 # ---- LLM ----
 LLM_BACKEND = os.getenv("LLM_BACKEND", "ollama").lower()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
@@ -15,6 +118,32 @@ OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:3b")
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 
+# 每個 backend 同時進行的 LLM 呼叫上限（分析師節點並行時生效）
+# CPU-only Ollama 並行只會互搶算力，預設 1；OpenAI 可以放寬
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "1"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "4"))
+
+# K 線放進 prompt 的格式：json（舊版）/ compact（header + CSV，依 tickSize 取小數位）/ features（摘要 + 最近幾根）
+PROMPT_CANDLE_ENCODING = os.getenv("PROMPT_CANDLE_ENCODING", "compact").strip().lower()
+
+# 每次 LLM 呼叫的輸出 token 上限（0 = 不限制）；本地模型 decode 時間跟輸出長度成正比
+LLM_ANALYST_MAX_TOKENS = int(os.getenv("LLM_ANALYST_MAX_TOKENS", "384"))
+LLM_MANAGER_MAX_TOKENS = int(os.getenv("LLM_MANAGER_MAX_TOKENS", "600"))
+
+# LLM HTTP 連線池（client 全 process 共用）
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "10"))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "120"))
+LLM_HTTP_CONNECT_TIMEOUT = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "5"))
+LLM_HTTP_READ_TIMEOUT = float(os.getenv("LLM_HTTP_READ_TIMEOUT", "300"))
+
+# LLM 回應快取（opt-in；只快取 temperature=0 的呼叫）
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true"
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".cache/llm").strip()  # 留空 = 只用記憶體
+LLM_CACHE_MEM_ENTRIES = int(os.getenv("LLM_CACHE_MEM_ENTRIES", "256"))
+LLM_CACHE_DISK_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DISK_MAX_ENTRIES", "5000"))
+LLM_CACHE_MAX_AGE_SEC = float(os.getenv("LLM_CACHE_MAX_AGE_SEC", "86400"))
+
 # ---- Langfuse ----
 LANGFUSE_ENABLED = os.getenv("LANGFUSE_ENABLED", "false").lower() == "true"
 LANGFUSE_PUBLIC_KEY = os.getenv("LANGFUSE_PUBLIC_KEY", "")
@@ -1,9 +1,52 @@
 from __future__ import annotations
 
-from typing import Literal
+import json
+import queue
+import random
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from config import (
+    BINANCE_API_HOSTS,
+    BINANCE_BACKOFF_BASE_SEC,
+    BINANCE_BACKOFF_MAX_SEC,
+    BINANCE_CONNECT_TIMEOUT,
+    BINANCE_FETCH_WORKERS,
+    BINANCE_HEDGE_DEFAULT_DELAY_MS,
+    BINANCE_HEDGE_ENABLED,
+    BINANCE_HEDGE_MAX_DELAY_MS,
+    BINANCE_HEDGE_MIN_DELAY_MS,
+    BINANCE_HISTORY_WORKERS,
+    BINANCE_MAX_RETRIES,
+    BINANCE_POOL_MAXSIZE,
+    BINANCE_READ_TIMEOUT,
+    BINANCE_WEIGHT_LIMIT_PER_MIN,
+    BINANCE_WEIGHT_MAX_WAIT_SEC,
+    BINANCE_WEIGHT_SAFETY,
+    KLINE_CACHE_ENABLED,
+    KLINE_OPEN_TAIL_REFRESH_SEC,
+    KLINE_STORE_ENABLED,
+    KLINE_STORE_PATH,
+)
+from cache_backend import CacheBackend, get_cache_backend
+from candles import CandleArray
+from kline_store import KlineStore
+from resample import INTERVAL_MS, candle_open_ms, derive_intervals, required_base_limit
 
 """
 參閱 Binance API 文件：
@@ -32,9 +75,623 @@ import requests
     Ignore                          : 忽略
 """
 
-BINANCE_SPOT_KLINES_URL = "https://api.binance.com/api/v3/klines"
+BINANCE_KLINES_PATH = "/api/v3/klines"
+BINANCE_EXCHANGE_INFO_PATH = "/api/v3/exchangeInfo"
 
-def _get_klines(
+# 單次請求上限（Binance /api/v3/klines limit 最大 1000）
+BINANCE_KLINES_MAX_LIMIT = 1000
+
+# ----------------------------
+# HTTP Session
+# ----------------------------
+# 全 process 共用一個 requests.Session：
+# - keep-alive 連線池，省掉每次 TCP + TLS handshake
+# - connect / read timeout 分開設定
+# - 5xx / 429 / 連線錯誤會用 jittered exponential backoff 重試，429/503 優先照 Retry-After
+# requests.Session 底下的 urllib3 連線池是 thread-safe 的，多個 thread 共用沒問題。
+# ----------------------------
+
+_RETRY_STATUS = {418, 429, 500, 502, 503, 504}
+_RATE_LIMIT_STATUS = {418, 429}
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+# ---- 可以從別的 thread 中斷的連線（hedge 輸的那邊用） ----
+# 輸的 request 可能還卡在等 response header，這時 requests 手上沒有任何物件可以 close；
+# 所以連線池用會登記自己的 connection class：送出 request 時把「這條連線屬於哪次嘗試」記在連線上，
+# 取消時直接 shutdown 那條 socket → 卡住的 recv 立刻結束，urllib3 丟掉這條連線（不會放回連線池）。
+
+_attempt_local = threading.local()
+
+
+class _Attempt:
+    """一次送出（primary 或 mirror）的取消把手。"""
+
+    def __init__(self) -> None:
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._conn: Optional[HTTPConnection] = None
+        self._response: Optional[requests.Response] = None
+
+    def is_set(self) -> bool:
+        return self._cancelled.is_set()
+
+    def attach(self, conn: HTTPConnection) -> None:
+        with self._lock:
+            self._conn = conn
+            cancelled = self._cancelled.is_set()
+        if cancelled:
+            self._abort_conn(conn)
+
+    def attach_response(self, r: requests.Response) -> None:
+        """拿到 header 之後改用 response.close() 中斷（body 讀完、連線回到連線池後就不會再碰那條連線）。"""
+        with self._lock:
+            self._conn = None
+            self._response = r
+            cancelled = self._cancelled.is_set()
+        if cancelled:
+            r.close()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._cancelled.set()
+            conn, r = self._conn, self._response
+        if conn is not None:
+            self._abort_conn(conn)
+        if r is not None:
+            r.close()
+
+    def _abort_conn(self, conn: HTTPConnection) -> None:
+        # 這條連線已經被別的 request 拿去用了就不要動它
+        if getattr(conn, "hedge_attempt", None) is not self:
+            return
+        sock = getattr(conn, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _TrackedConnectionMixin:
+    hedge_attempt: Optional[_Attempt] = None
+
+    def request(self, *args: Any, **kwargs: Any) -> Any:
+        attempt = getattr(_attempt_local, "attempt", None)
+        self.hedge_attempt = attempt
+        if attempt is not None:
+            attempt.attach(self)  # type: ignore[arg-type]
+        return super().request(*args, **kwargs)  # type: ignore[misc]
+
+
+class _TrackedHTTPConnection(_TrackedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TrackedHTTPSConnection(_TrackedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TrackedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TrackedHTTPConnection
+
+
+class _TrackedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
+
+
+class _TrackedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TrackedHTTPConnectionPool,
+            "https": _TrackedHTTPSConnectionPool,
+        }
+
+
+def get_http_session() -> requests.Session:
+    global _session
+    if _session is not None:
+        return _session
+
+    with _session_lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = _TrackedHTTPAdapter(
+                pool_connections=max(4, len(BINANCE_API_HOSTS)),
+                pool_maxsize=BINANCE_POOL_MAXSIZE,
+                max_retries=0,  # 重試自己做，才能處理 Retry-After 與 jitter
+            )
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session = s
+    return _session
+
+
+def close_http_session() -> None:
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+@dataclass
+class BinanceResponse:
+    """讀完 body 的結果（status / headers / bytes），介面跟 requests.Response 常用的部分一樣。"""
+
+    status_code: int
+    url: str
+    reason: str = ""
+    headers: CaseInsensitiveDict = field(default_factory=CaseInsensitiveDict)
+    content: bytes = b""
+    request: Any = None  # 給 requests.HTTPError(response=...) 用
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def raise_for_status(self) -> None:
+        if 400 <= self.status_code < 600:
+            kind = "Client" if self.status_code < 500 else "Server"
+            raise requests.HTTPError(f"{self.status_code} {kind} Error: {self.reason} for url: {self.url}", response=self)
+
+    def __repr__(self) -> str:
+        return f"<BinanceResponse [{self.status_code}]>"
+
+
+def _retry_after_sec(r: BinanceResponse) -> Optional[float]:
+    v = (r.headers.get("Retry-After") or "").strip()
+    if not v:
+        return None
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(v).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def _backoff_sec(attempt: int) -> float:
+    # full jitter: uniform(0, min(cap, base * 2^attempt))
+    cap = min(BINANCE_BACKOFF_MAX_SEC, BINANCE_BACKOFF_BASE_SEC * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+# ----------------------------
+# Request Weight Limiter
+# ----------------------------
+# Binance 以 IP 計算 request weight（預設每分鐘 6000），超過會 429，再犯會 418（封 IP）。
+# - token bucket：容量 = BINANCE_WEIGHT_LIMIT_PER_MIN * BINANCE_WEIGHT_SAFETY，每秒補 容量/60
+# - 每個 endpoint 有自己的 weight（_ENDPOINT_WEIGHTS）
+# - 每個 response 讀 X-MBX-USED-WEIGHT-1M 校正（其他程式也在用同一個 IP 時才不會高估剩餘額度）
+# - 429 / 418 照 Retry-After 暫停整個 limiter，所有呼叫者一起排隊等，而不是各自重試
+# - 額度不夠時 acquire() 會阻塞排隊；預估要等超過 BINANCE_WEIGHT_MAX_WAIT_SEC 才丟 BinanceRateLimited
+# ----------------------------
+
+_ENDPOINT_WEIGHTS = {
+    "/api/v3/klines": 2,
+    "/api/v3/exchangeInfo": 20,
+    "/api/v3/ticker/price": 2,
+    "/api/v3/ping": 1,
+    "/api/v3/time": 1,
+}
+_DEFAULT_WEIGHT = 2
+_USED_WEIGHT_HEADER = "X-MBX-USED-WEIGHT-1M"
+
+
+class BinanceRateLimited(RuntimeError):
+    pass
+
+
+def endpoint_weight(path: str) -> int:
+    return _ENDPOINT_WEIGHTS.get(urlparse(path).path, _DEFAULT_WEIGHT)
+
+
+class WeightLimiter:
+    def __init__(
+        self,
+        limit_per_min: int = BINANCE_WEIGHT_LIMIT_PER_MIN,
+        safety: float = BINANCE_WEIGHT_SAFETY,
+        max_wait_sec: float = BINANCE_WEIGHT_MAX_WAIT_SEC,
+    ):
+        self.limit_per_min = int(limit_per_min)
+        self.capacity = max(1.0, self.limit_per_min * safety)
+        self.rate = self.capacity / 60.0
+        self.max_wait_sec = max_wait_sec
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self._waiting = 0
+        self.stats = {
+            "acquired_weight": 0,
+            "waits": 0,
+            "wait_sec_total": 0.0,
+            "rejected": 0,
+            "rate_limited": 0,
+            "used_weight_1m": None,
+        }
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, weight: int) -> float:
+        """拿 weight 個 token，不夠就排隊等；回傳等了幾秒。"""
+        weight = min(float(weight), self.capacity)
+        start = time.monotonic()
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now >= self._paused_until and self._tokens >= weight:
+                        self._tokens -= weight
+                        break
+                    wait = max(self._paused_until - now, (weight - self._tokens) / self.rate)
+                    if now + wait - start > self.max_wait_sec:
+                        self.stats["rejected"] += 1
+                        raise BinanceRateLimited(f"Binance weight budget exhausted, need to wait {wait:.1f}s")
+                    self._cond.wait(wait)
+            finally:
+                self._waiting -= 1
+
+            waited = time.monotonic() - start
+            self.stats["acquired_weight"] += int(weight)
+            if waited > 0.001:
+                self.stats["waits"] += 1
+                self.stats["wait_sec_total"] += waited
+            return waited
+
+    def try_acquire(self, weight: int) -> bool:
+        """不排隊：額度夠（且沒被暫停）就拿走回 True，否則什麼都不做回 False。"""
+        weight = min(float(weight), self.capacity)
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until or self._tokens < weight:
+                return False
+            self._tokens -= weight
+            self.stats["acquired_weight"] += int(weight)
+            return True
+
+    def observe(self, r: BinanceResponse) -> None:
+        """用 Binance 回報的已用 weight 校正 bucket（只往下修，不會因此多給額度）。"""
+        v = r.headers.get(_USED_WEIGHT_HEADER)
+        if v is None:
+            return
+        try:
+            used = int(v)
+        except ValueError:
+            return
+        with self._cond:
+            self.stats["used_weight_1m"] = used
+            self._refill(time.monotonic())
+            # header 是對 Binance 真正上限算的：真正剩下的是 limit_per_min - used，不做比例換算
+            # （capacity < limit_per_min 時按比例縮會把 used 算小、反而多給額度）；再夾在 bucket 容量內
+            remaining = max(0.0, min(self.capacity, self.limit_per_min - used))
+            self._tokens = min(self._tokens, remaining)
+
+    def pause(self, sec: float) -> None:
+        """被 429 / 418 時暫停所有呼叫者 sec 秒。"""
+        with self._cond:
+            self.stats["rate_limited"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + sec)
+            self._tokens = 0.0
+            self._cond.notify_all()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                "limit_per_min": self.limit_per_min,
+                "capacity": round(self.capacity, 1),
+                "available": round(self._tokens, 1),
+                "queued": self._waiting,
+                "paused_sec": round(max(0.0, self._paused_until - now), 2),
+                **self.stats,
+                "wait_sec_total": round(self.stats["wait_sec_total"], 3),
+            }
+
+
+_weight_limiter = WeightLimiter()
+
+
+def binance_weight_stats() -> Dict[str, Any]:
+    return _weight_limiter.metrics()
+
+
+# ----------------------------
+# Hosts & Hedged Requests
+# ----------------------------
+# 同一套 API 有多個 host（api.binance.com、api1~api4）：
+# - 每個 host 記最近 _LATENCY_WINDOW 次的延遲；primary = p50 最低的 host（沒樣本時照設定順序）
+# - primary 超過 hedge delay（primary 的 p95，夾在 BINANCE_HEDGE_MIN/MAX_DELAY_MS 之間）還沒回 →
+#   同一個 request 再送到 mirror，先回成功的贏
+# - 輸的那個設 cancel flag：body 用 stream=True 分段讀，看到 flag 就 close，連線還給連線池
+# - hedge 也會打到同一個 IP 的 weight 額度 → mirror 送出前用 try_acquire 拿額度，
+#   不夠就不 hedge（繼續等 primary），不會為了 hedge 排隊或讓整個 request 失敗
+# ----------------------------
+
+_LATENCY_WINDOW = 200
+_MIN_LATENCY_SAMPLES = 20
+_READ_CHUNK = 64 * 1024
+
+
+class _HedgeCancelled(Exception):
+    pass
+
+
+class HostStats:
+    def __init__(self, window: int = _LATENCY_WINDOW):
+        self._lat: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "errors": 0, "wins": 0, "cancelled": 0}
+
+    def record(self, sec: float, *, error: bool = False, cancelled: bool = False) -> None:
+        with self._lock:
+            self._lat.append(sec)
+            self.counts["requests"] += 1
+            if error:
+                self.counts["errors"] += 1
+            if cancelled:
+                self.counts["cancelled"] += 1
+
+    def win(self) -> None:
+        with self._lock:
+            self.counts["wins"] += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._lat) < _MIN_LATENCY_SAMPLES:
+                return None
+            return float(np.percentile(np.fromiter(self._lat, dtype=np.float64), q))
+
+    def metrics(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            **self.counts,
+            "p50_ms": None if p50 is None else round(p50 * 1000, 1),
+            "p95_ms": None if p95 is None else round(p95 * 1000, 1),
+        }
+
+
+_hosts: List[str] = list(BINANCE_API_HOSTS)
+_host_stats: Dict[str, HostStats] = {h: HostStats() for h in _hosts}
+_hedge_counts = {"hedged": 0, "hedge_wins": 0, "hedge_skipped": 0}
+_hedge_counts_lock = threading.Lock()
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+_hedge_pool_lock = threading.Lock()
+
+
+def configure_binance_hosts(hosts: List[str]) -> None:
+    """換一組 host（例如本地 stand-in server），延遲統計重新開始。"""
+    global _hosts, _host_stats
+    hosts = [h.strip().rstrip("/") for h in hosts if h.strip()]
+    if not hosts:
+        raise ValueError("at least one Binance host is required")
+    _hosts = hosts
+    _host_stats = {h: HostStats() for h in hosts}
+
+
+def _count_hedge(name: str) -> None:
+    with _hedge_counts_lock:
+        _hedge_counts[name] += 1
+
+
+def binance_host_stats() -> Dict[str, Any]:
+    with _hedge_counts_lock:
+        counts = dict(_hedge_counts)
+    return {**counts, "hosts": {h: st.metrics() for h, st in _host_stats.items()}}
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    if _hedge_pool is not None:
+        return _hedge_pool
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=4 * BINANCE_POOL_MAXSIZE, thread_name_prefix="binance-hedge")
+    return _hedge_pool
+
+
+def _pick_hosts() -> Tuple[str, Optional[str]]:
+    """(primary, mirror)；只有一個 host 時 mirror 為 None。"""
+    hosts, stats = _hosts, _host_stats
+    if len(hosts) == 1:
+        return hosts[0], None
+
+    def rank(i_h: Tuple[int, str]) -> Tuple[float, int]:
+        i, h = i_h
+        p50 = stats[h].percentile(50)
+        return (p50 if p50 is not None else (0.0 if i == 0 else BINANCE_HEDGE_DEFAULT_DELAY_MS / 1000), i)
+
+    ranked = [h for _, h in sorted(enumerate(hosts), key=rank)]
+    return ranked[0], ranked[1]
+
+
+def _hedge_delay_sec(host: str) -> float:
+    p95 = _host_stats[host].percentile(95)
+    delay = p95 if p95 is not None else BINANCE_HEDGE_DEFAULT_DELAY_MS / 1000
+    return min(max(delay, BINANCE_HEDGE_MIN_DELAY_MS / 1000), BINANCE_HEDGE_MAX_DELAY_MS / 1000)
+
+
+def _send(
+    host: str,
+    path: str,
+    params: Dict[str, Any],
+    timeout: Tuple[float, float],
+    attempt: Optional[_Attempt] = None,
+) -> BinanceResponse:
+    """
+    打一個 host 並讀完 body。attempt 被 cancel 時（不管是在等 header 還是讀 body）
+    會直接中斷那條連線，這裡丟 _HedgeCancelled。
+    """
+    stats = _host_stats.get(host) or HostStats()
+    t0 = time.monotonic()
+    _attempt_local.attempt = attempt
+    try:
+        with get_http_session().get(host + path, params=params, timeout=timeout, stream=True) as r:
+            if attempt is not None:
+                attempt.attach_response(r)
+            body = bytearray()
+            for chunk in r.iter_content(_READ_CHUNK):
+                if attempt is not None and attempt.is_set():
+                    raise _HedgeCancelled()
+                body += chunk
+            if attempt is not None and attempt.is_set():
+                raise _HedgeCancelled()
+            resp = BinanceResponse(
+                status_code=r.status_code,
+                url=r.url,
+                reason=r.reason or "",
+                headers=CaseInsensitiveDict(r.headers),
+                content=bytes(body),
+            )
+    except _HedgeCancelled:
+        stats.record(time.monotonic() - t0, cancelled=True)
+        raise
+    except Exception:
+        if attempt is not None and attempt.is_set():
+            # 被取消時 socket 被 shutdown → requests 丟連線錯誤，算取消不算錯誤
+            stats.record(time.monotonic() - t0, cancelled=True)
+            raise _HedgeCancelled()
+        stats.record(time.monotonic() - t0, error=True)
+        raise
+    finally:
+        _attempt_local.attempt = None
+    stats.record(time.monotonic() - t0)
+    return resp
+
+
+def _is_final(r: BinanceResponse) -> bool:
+    return r.status_code not in _RETRY_STATUS
+
+
+def _hedged_send(path: str, params: Dict[str, Any], timeout: Tuple[float, float], weight: int) -> BinanceResponse:
+    """
+    送一次 request（呼叫前 primary 的 weight 已經 acquire 過）：primary 太慢就 hedge 到 mirror，先成功的贏。
+    兩邊都失敗時回傳最後一個 response（給 _http_get 判斷要不要重試），都沒有 response 就丟最後的例外。
+    """
+    primary, mirror = _pick_hosts()
+    if mirror is None or not BINANCE_HEDGE_ENABLED:
+        r = _send(primary, path, params, timeout)
+        _host_stats[primary].win()
+        return r
+
+    results: "queue.Queue[Tuple[str, Optional[BinanceResponse], Optional[BaseException]]]" = queue.Queue()
+    attempts: Dict[str, _Attempt] = {}
+
+    def run(host: str) -> None:
+        try:
+            results.put((host, _send(host, path, params, timeout, attempts[host]), None))
+        except BaseException as e:
+            results.put((host, None, e))
+
+    pool = _get_hedge_pool()
+    attempts[primary] = _Attempt()
+    pool.submit(run, primary)
+    pending = 1
+    hedged = False
+    fallback: Optional[BinanceResponse] = None
+    error: Optional[BaseException] = None
+
+    try:
+        while pending:
+            try:
+                host, r, err = results.get(timeout=None if hedged else _hedge_delay_sec(primary))
+            except queue.Empty:
+                host, r, err = None, None, None
+            else:
+                pending -= 1
+                if r is not None and (_is_final(r) or r.status_code in _RATE_LIMIT_STATUS):
+                    # 成功就採用；被限流是整個 IP 的事，換 host 也沒用 → 直接交給 _http_get 處理
+                    _host_stats[host].win()
+                    if host != primary:
+                        _count_hedge("hedge_wins")
+                    return r
+                if r is not None:
+                    fallback = r
+                elif err is not None and not isinstance(err, _HedgeCancelled):
+                    error = err
+
+            # primary 逾時未回、或很快就失敗 → 改送 mirror（只 hedge 一次）
+            if not hedged:
+                hedged = True
+                if _weight_limiter.try_acquire(weight):
+                    _count_hedge("hedged")
+                    attempts[mirror] = _Attempt()
+                    pool.submit(run, mirror)
+                    pending += 1
+                else:
+                    # 額度不夠：不 hedge，繼續等 primary（primary 已失敗就照常交給 _http_get 重試）
+                    _count_hedge("hedge_skipped")
+    finally:
+        # 輸的那邊（或還在跑的）立刻中斷連線：就算還在等 header 也不會佔著連線 / thread 到 timeout
+        for attempt in attempts.values():
+            attempt.cancel()
+
+    if fallback is not None:
+        return fallback
+    assert error is not None
+    raise error
+
+
+def _http_get(path: str, params: Dict[str, Any]) -> BinanceResponse:
+    """
+    GET with pooled session + weight limiter + hedging + retry. 最後一次仍失敗就把 HTTPError / 連線錯誤往上丟。
+    path: 例如 "/api/v3/klines"（host 由 _pick_hosts 決定）
+    """
+    timeout = (BINANCE_CONNECT_TIMEOUT, BINANCE_READ_TIMEOUT)
+    weight = endpoint_weight(path)
+
+    for attempt in range(BINANCE_MAX_RETRIES + 1):
+        last = attempt >= BINANCE_MAX_RETRIES
+        _weight_limiter.acquire(weight)
+        try:
+            r = _hedged_send(path, params, timeout, weight)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if last:
+                raise
+            wait = _backoff_sec(attempt)
+            reason = f"{type(e).__name__}"
+        else:
+            _weight_limiter.observe(r)
+            if r.status_code not in _RETRY_STATUS or last:
+                r.raise_for_status()
+                return r
+
+            retry_after = _retry_after_sec(r)
+            if r.status_code in _RATE_LIMIT_STATUS:
+                # 限流是整個 IP 的事：暫停 limiter，讓所有呼叫者一起排隊
+                _weight_limiter.pause(retry_after if retry_after is not None else _backoff_sec(attempt))
+                if retry_after is not None and retry_after > BINANCE_WEIGHT_MAX_WAIT_SEC:
+                    # 要等太久（例如被封 IP），不如直接失敗
+                    r.raise_for_status()
+                wait = 0.0
+            else:
+                if retry_after is not None and retry_after > BINANCE_BACKOFF_MAX_SEC:
+                    # 要等太久（例如 503 維護中），不如直接失敗，不要卡住 worker 跟 LINE 回覆
+                    r.raise_for_status()
+                wait = retry_after if retry_after is not None else _backoff_sec(attempt)
+            reason = f"HTTP {r.status_code}"
+
+        print(f"[WARN] Binance request retry {attempt + 1}/{BINANCE_MAX_RETRIES} after {wait:.2f}s ({reason})")
+        time.sleep(wait)
+
+    raise RuntimeError("unreachable")  # pragma: no cover
+
+def _get_candles(
     symbol: str,
     interval: Literal[
         "1m",
@@ -54,10 +711,15 @@ def _get_klines(
         "1M",
     ],
     limit: int,
-) -> pd.DataFrame:
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+) -> CandleArray:
     """
     Fetch klines from Binance public spot endpoint (no API key needed).
 
+    start_time: 毫秒 timestamp，有給的話只抓這個時間（含）之後的 K 線
+    end_time  : 毫秒 timestamp，有給的話只抓 open_time <= end_time 的 K 線
+
     Response format:
     [
       [
@@ -79,41 +741,429 @@ def _get_klines(
     """
     symbol = symbol.upper().strip()
     params = {"symbol": symbol, "interval": interval, "limit": int(limit)}
+    if start_time is not None:
+        params["startTime"] = int(start_time)
+    if end_time is not None:
+        params["endTime"] = int(end_time)
     print(f"[INFO] Fetching klines from Binance: {params}")
-    r = requests.get(BINANCE_SPOT_KLINES_URL, params=params, timeout=30)
+    r = _http_get(BINANCE_KLINES_PATH, params)
     print(f"[INFO] Binance response status: {r}")
-    r.raise_for_status()
-    rows = r.json()
-
-    cols = [
-        "open_time",
-        "open",
-        "high",
-        "low",
-        "close",
-        "volume",
-        "close_time",
-        "quote_asset_volume",
-        "number_of_trades",
-        "taker_buy_base_asset_volume",
-        "taker_buy_quote_asset_volume",
-        "ignore",
-    ]
-    df = pd.DataFrame(rows, columns=cols)
+    try:
+        # 直接從 bytes 解析成 typed arrays（見 CandleArray.from_json_bytes）
+        return CandleArray.from_json_bytes(r.content)
+    except ValueError:
+        return CandleArray.from_rows(r.json())
+
+
+def _get_klines(
+    symbol: str,
+    interval: str,
+    limit: int,
+    start_time: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    DataFrame 版本（舊介面）：open_time / close_time 為 UTC datetime，其餘欄位為數值。
+    """
+    return _get_candles(symbol, interval, limit, start_time=start_time).to_dataframe()  # type: ignore[arg-type]
+
+
+# ----------------------------
+# Kline Cache
+# ----------------------------
+# key = (symbol, interval)
+# - 已收盤的 K 線不會再變，抓過就永久保留
+# - 只有最後一根（未收盤）會變動：
+#     * 還在同一個 interval 內 → 最多每 KLINE_OPEN_TAIL_REFRESH_SEC 秒刷新一次
+#     * 跨過 interval 邊界（最後一根的 close_time 已過）→ 立即刷新
+# - 刷新時用 startTime 只抓「上次抓取時尚未收盤」之後的 K 線，再併回快取
+# ----------------------------
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _fetch_latest(symbol: str, interval: str, limit: int, now: int) -> CandleArray:
+    """
+    最新 limit 根：有本地 KlineStore 時已收盤的從 disk 讀、只補抓缺的；
+    沒有的話超過單頁上限才走分頁抓。
+    """
+    if interval not in INTERVAL_MS or (get_kline_store() is None and limit <= BINANCE_KLINES_MAX_LIMIT):
+        return _get_candles(symbol, interval, limit)  # type: ignore[arg-type]
+    start = candle_open_ms(now, interval) - (limit - 1) * INTERVAL_MS[interval]
+    return get_klines_history(symbol, interval, start, now).tail(limit)
+
+
+class _KlineCacheEntry:
+    __slots__ = ("candles", "fetched_at_ms")
+
+    def __init__(self, candles: CandleArray, fetched_at_ms: int):
+        self.candles = candles
+        self.fetched_at_ms = fetched_at_ms
+
+    @property
+    def boundary_ms(self) -> int:
+        """最後一根 K 線收盤的時間點（過了就代表有新的 K 線）。"""
+        return int(self.candles.close_time[-1]) + 1
+
+    @property
+    def tail_start_ms(self) -> int:
+        """上次抓取時還沒收盤的第一根 K 線 open_time。"""
+        i = int(np.searchsorted(self.candles.close_time, self.fetched_at_ms, side="left"))
+        if i >= len(self.candles):
+            return self.boundary_ms
+        return int(self.candles.open_time[i])
+
+
+class KlineCache:
+    def __init__(
+        self,
+        open_tail_refresh_sec: float = KLINE_OPEN_TAIL_REFRESH_SEC,
+        shared_backend: Optional[Callable[[], CacheBackend]] = get_cache_backend,
+    ):
+        self.open_tail_refresh_ms = int(open_tail_refresh_sec * 1000)
+        self._shared_backend = shared_backend
+        self._entries: Dict[Tuple[str, str], _KlineCacheEntry] = {}
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        # 不同 key 的 get() 會同時跑（各自只拿自己的 key lock），計數另外用一把 lock
+        self._stats_lock = threading.Lock()
+        self.stats = {"hit": 0, "shared_hit": 0, "tail_refresh": 0, "full_fetch": 0}
+
+    def _count(self, name: str) -> None:
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def stats_snapshot(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _shared(self) -> Optional[CacheBackend]:
+        """跨 worker 共用的 backend；InProcessCache 跟 self._entries 重複，不用。"""
+        if self._shared_backend is None:
+            return None
+        backend = self._shared_backend()
+        return backend if backend.shared else None
+
+    def clear(self) -> None:
+        with self._locks_guard:
+            self._entries.clear()
+        shared = self._shared()
+        if shared is not None:
+            shared.clear("klines")
+
+    def _is_fresh(self, entry: Optional[_KlineCacheEntry], limit: int, now: int) -> bool:
+        return (
+            entry is not None
+            and len(entry.candles) >= limit
+            and now < entry.boundary_ms
+            and now - entry.fetched_at_ms < self.open_tail_refresh_ms
+        )
+
+    def get(self, symbol: str, interval: str, limit: int) -> CandleArray:
+        """回傳最後 limit 根（唯讀 view，不複製）。"""
+        symbol = symbol.upper().strip()
+        key = (symbol, interval)
+
+        # 同一個 key 同時只讓一個 thread 打 Binance，其他人等它填好快取
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if self._is_fresh(entry, limit, _now_ms()):
+                self._count("hit")
+            else:
+                shared = self._shared()
+                if shared is None:
+                    entry = self._refresh(entry, symbol, interval, limit, _now_ms())
+                else:
+                    entry = self._refresh_shared(shared, entry, symbol, interval, limit)
+
+            self._entries[key] = entry
+            return entry.candles.tail(limit)
+
+    def _refresh_shared(
+        self, shared: CacheBackend, entry: Optional[_KlineCacheEntry], symbol: str, interval: str, limit: int
+    ) -> _KlineCacheEntry:
+        """多個 worker 共用：先看別的 worker 是否剛抓過，沒有才由拿到 lock 的這個 worker 去抓。"""
+        skey = f"{symbol}:{interval}"
+        with shared.lock("klines", skey):
+            other = shared.get("klines", skey)
+            now = _now_ms()
+            if self._is_fresh(other, limit, now):
+                self._count("shared_hit")
+                return other
+            # 從兩份裡比較新的那份接著刷新
+            if other is not None and (entry is None or other.fetched_at_ms > entry.fetched_at_ms):
+                entry = other
+            entry = self._refresh(entry, symbol, interval, limit, now)
+            shared.put("klines", skey, entry)
+            return entry
+
+    def _refresh(
+        self, entry: Optional[_KlineCacheEntry], symbol: str, interval: str, limit: int, now: int
+    ) -> _KlineCacheEntry:
+        if entry is None or len(entry.candles) < limit:
+            return self._full_fetch(symbol, interval, limit, now)
+        return self._refresh_tail(entry, symbol, interval, limit, now)
+
+    def _full_fetch(self, symbol: str, interval: str, limit: int, now: int) -> _KlineCacheEntry:
+        self._count("full_fetch")
+        return _KlineCacheEntry(_fetch_latest(symbol, interval, limit, now), now)
+
+    def _refresh_tail(
+        self, entry: _KlineCacheEntry, symbol: str, interval: str, limit: int, now: int
+    ) -> _KlineCacheEntry:
+        start = entry.tail_start_ms
+        if get_kline_store() is not None and interval in INTERVAL_MS:
+            # 經過 KlineStore：新收盤的 K 線順便落地
+            tail = get_klines_history(symbol, interval, start, now)
+        else:
+            tail = _get_candles(symbol, interval, BINANCE_KLINES_MAX_LIMIT, start_time=start)  # type: ignore[arg-type]
+
+        # 閒置太久（中間超過一頁 K 線）接不起來 → 直接整段重抓
+        if len(tail) == 0 or int(tail.close_time[-1]) < now:
+            return self._full_fetch(symbol, interval, limit, now)
+
+        self._count("tail_refresh")
+        n_closed = int(np.searchsorted(entry.candles.open_time, start, side="left"))
+        candles = CandleArray.concat([entry.candles[:n_closed], tail])
+        return _KlineCacheEntry(candles, now)
+
+
+_kline_cache = KlineCache()
+
+
+def get_candles(symbol: str, interval: str, limit: int) -> CandleArray:
+    """
+    取 K 線的統一入口（columnar，hot path 用）：預設走 KlineCache，
+    KLINE_CACHE_ENABLED=false 時直接打 Binance。
+    """
+    if not KLINE_CACHE_ENABLED:
+        return _fetch_latest(symbol, interval, limit, _now_ms())
+    return _kline_cache.get(symbol, interval, limit)
+
+
+def get_klines(symbol: str, interval: str, limit: int) -> pd.DataFrame:
+    """get_candles 的 DataFrame 版本。"""
+    return get_candles(symbol, interval, limit).to_dataframe()
+
+
+def clear_kline_cache() -> None:
+    _kline_cache.clear()
+
+
+def kline_cache_stats() -> Dict[str, int]:
+    return _kline_cache.stats_snapshot()
+
+
+# ----------------------------
+# Persistent Store
+# ----------------------------
+
+_kline_store: Optional[KlineStore] = None
+_kline_store_lock = threading.Lock()
+_kline_store_failed = False
+
+
+def get_kline_store() -> Optional[KlineStore]:
+    """KLINE_STORE_ENABLED 時 lazy 開啟本地 KlineStore；開不起來（例如唯讀檔案系統）就退回純網路。"""
+    global _kline_store, _kline_store_failed
+    if not KLINE_STORE_ENABLED or _kline_store_failed:
+        return None
+    if _kline_store is not None:
+        return _kline_store
+    with _kline_store_lock:
+        if _kline_store is None and not _kline_store_failed:
+            try:
+                _kline_store = KlineStore(KLINE_STORE_PATH)
+            except Exception as e:
+                _kline_store_failed = True
+                print("[WARN] Kline store disabled:", repr(e))
+    return _kline_store
 
-    # types
-    df["open_time"] = pd.to_datetime(df["open_time"], unit="ms", utc=True)
-    df["close_time"] = pd.to_datetime(df["close_time"], unit="ms", utc=True)
 
-    for c in ["open", "high", "low", "close", "volume"]:
-        df[c] = pd.to_numeric(df[c], errors="coerce")
+def kline_store_stats() -> Dict[str, int]:
+    store = get_kline_store()
+    return dict(store.stats) if store is not None else {}
 
-    return df
+
+# ----------------------------
+# Concurrent Fetch
+# ----------------------------
+
+_fetch_pool: Optional[ThreadPoolExecutor] = None
+_fetch_pool_lock = threading.Lock()
+
+
+def _get_fetch_pool() -> ThreadPoolExecutor:
+    global _fetch_pool
+    if _fetch_pool is not None:
+        return _fetch_pool
+    with _fetch_pool_lock:
+        if _fetch_pool is None:
+            _fetch_pool = ThreadPoolExecutor(
+                max_workers=BINANCE_FETCH_WORKERS,
+                thread_name_prefix="binance-fetch",
+            )
+    return _fetch_pool
+
+
+def fetch_klines_multi(symbol: str, intervals: Dict[str, int]) -> Dict[str, CandleArray]:
+    """
+    同時抓同一個 symbol 的多個 interval，全部回來才 return。
+    總耗時 ≈ 最慢的那個請求，而不是全部相加。
+
+    intervals: {"1d": 220, "1w": 220}
+    return:    {"1d": candles_daily, "1w": candles_weekly}
+    任一 interval 失敗就把該 exception 往上丟。
+    """
+    if len(intervals) == 1:
+        (interval, limit), = intervals.items()
+        return {interval: get_candles(symbol, interval, limit)}
+
+    pool = _get_fetch_pool()
+    futures = {
+        interval: pool.submit(get_candles, symbol, interval, limit)
+        for interval, limit in intervals.items()
+    }
+    return {interval: fut.result() for interval, fut in futures.items()}
+
+
+def fetch_klines_resampled(
+    symbol: str, intervals: Dict[str, int], base_interval: str = "1d"
+) -> Dict[str, CandleArray]:
+    """
+    只抓一個 base interval，其餘 interval 在本地 resample 出來（見 resample.py）。
+    base 超過一頁（BINANCE_KLINES_MAX_LIMIT 根）時會走 get_klines_history 分頁抓。
+
+    intervals: {"1d": 220, "1w": 220}
+    """
+    base = get_candles(symbol, base_interval, required_base_limit(intervals, base_interval))
+    return derive_intervals(base, intervals, base_interval)
+
+
+# ----------------------------
+# Deep History (paginated)
+# ----------------------------
+# Binance 單次最多回 1000 根，長歷史要用 startTime / endTime 切頁：
+# - (start, end) 依 interval 切成每頁 1000 根的區間，並行抓取（最多 BINANCE_HISTORY_WORKERS 個同時在途）
+# - 每頁都經過 _http_get 的 WeightLimiter，額度不夠時自動排隊
+# - 合併後依 open_time 去重、排序，回傳一段連續的 CandleArray
+# 1M（月線）長度不固定 → 改用逐頁接續（上一頁最後 close_time + 1 當下一頁 startTime）
+# ----------------------------
+
+_history_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _get_history_pool() -> ThreadPoolExecutor:
+    # 與 _fetch_pool 分開，避免 fetch_klines_multi 的 task 裡再等分頁 task 而互相卡住
+    global _history_pool
+    if _history_pool is not None:
+        return _history_pool
+    with _fetch_pool_lock:
+        if _history_pool is None:
+            _history_pool = ThreadPoolExecutor(
+                max_workers=max(1, BINANCE_HISTORY_WORKERS),
+                thread_name_prefix="binance-history",
+            )
+    return _history_pool
+
+
+def history_pages(interval: str, start_ms: int, end_ms: int) -> List[Tuple[int, int]]:
+    """把 [start_ms, end_ms] 切成每頁最多 BINANCE_KLINES_MAX_LIMIT 根的 (startTime, endTime)。"""
+    step = INTERVAL_MS[interval]
+    span = step * BINANCE_KLINES_MAX_LIMIT
+    first = candle_open_ms(start_ms, interval)
+    if first < start_ms:
+        first += step
+    pages = []
+    s = first
+    while s <= end_ms:
+        e = min(s + span - 1, end_ms)
+        pages.append((s, e))
+        s += span
+    return pages
+
+
+def _history_sequential(symbol: str, interval: str, start_ms: int, end_ms: int) -> CandleArray:
+    parts: List[CandleArray] = []
+    cursor = start_ms
+    while cursor <= end_ms:
+        page = _get_candles(symbol, interval, BINANCE_KLINES_MAX_LIMIT, start_time=cursor, end_time=end_ms)  # type: ignore[arg-type]
+        if len(page) == 0:
+            break
+        parts.append(page)
+        cursor = int(page.close_time[-1]) + 1
+        if len(page) < BINANCE_KLINES_MAX_LIMIT:
+            break
+    return CandleArray.concat(parts)
+
+
+def _fetch_history(symbol: str, interval: str, start_ms: int, end_ms: int) -> CandleArray:
+    """直接從 Binance 抓 [start_ms, end_ms] 之間（open_time）的所有 K 線。"""
+    if end_ms < start_ms:
+        return CandleArray.empty()
+
+    if interval not in INTERVAL_MS:
+        merged = _history_sequential(symbol, interval, start_ms, end_ms)
+    else:
+        pages = history_pages(interval, start_ms, end_ms)
+        if len(pages) == 1:
+            s, e = pages[0]
+            merged = _get_candles(symbol, interval, BINANCE_KLINES_MAX_LIMIT, start_time=s, end_time=e)  # type: ignore[arg-type]
+        else:
+            pool = _get_history_pool()
+            futures = [
+                pool.submit(_get_candles, symbol, interval, BINANCE_KLINES_MAX_LIMIT, start_time=s, end_time=e)
+                for s, e in pages
+            ]
+            merged = CandleArray.concat([f.result() for f in futures])
+
+    # 頁與頁邊界可能重疊（或 Binance 多回一根）→ 排序去重後再裁切範圍
+    merged = merged.sorted()
+    lo = int(np.searchsorted(merged.open_time, start_ms, side="left"))
+    hi = int(np.searchsorted(merged.open_time, end_ms, side="right"))
+    return merged[lo:hi]
+
+
+def get_klines_history(
+    symbol: str,
+    interval: str,
+    start_ms: int,
+    end_ms: Optional[int] = None,
+) -> CandleArray:
+    """
+    抓 [start_ms, end_ms] 之間（open_time）的所有 K 線，不受單次 1000 根上限限制。
+    end_ms 預設為現在。有 KlineStore 時已收盤的從本地讀，只向 Binance 補抓缺的區間。
+    """
+    symbol = symbol.upper().strip()
+    now = _now_ms()
+    end_ms = now if end_ms is None else int(end_ms)
+    start_ms = int(start_ms)
+
+    store = get_kline_store()
+    if store is None or interval not in INTERVAL_MS:
+        return _fetch_history(symbol, interval, start_ms, end_ms)
+    return store.load_range(symbol, interval, start_ms, end_ms, now, _fetch_history)
+
+
+def get_exchange_info() -> Dict[str, Any]:
+    """
+    GET /api/v3/exchangeInfo（全部交易對，weight 20）。
+    回傳很大（數 MB），不要每個訊息都打：由 symbol_index 定期刷新並存 snapshot。
+    """
+    print("[INFO] Fetching exchangeInfo from Binance")
+    return _http_get(BINANCE_EXCHANGE_INFO_PATH, {}).json()
 
 
 def get_daily_klines(symbol: str, limit: int = 200) -> pd.DataFrame:
-    return _get_klines(symbol, "1d", limit)
+    return get_klines(symbol, "1d", limit)
 
 
 def get_weekly_klines(symbol: str, limit: int = 200) -> pd.DataFrame:
-    return _get_klines(symbol, "1w", limit)
+    return get_klines(symbol, "1w", limit)
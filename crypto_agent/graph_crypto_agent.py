@@ -16,19 +16,37 @@ Nodes:
 from __future__ import annotations
 
 import datetime as dt
+import hashlib
 import json
 import re
-from typing import Any, Dict, List, Optional, TypedDict
+import threading
+import time
+from typing import Any, Dict, List, Optional, TypedDict, Union
 
 import pandas as pd
 
 from langgraph.graph import StateGraph, START, END
 
-from config import SYMBOL
-from data_binance import get_daily_klines, get_weekly_klines
-from indicators import compute_weekly_regime, analyze_daily_volume_price
-from llm_client import chat_json, chat_text
+from cache_backend import get_cache_backend
+from candles import CandleArray
+from candle_encoding import ENCODINGS, encode_candles, fmt_number, price_decimals
+from config import (
+    ANALYSIS_CACHE_TTL_SEC,
+    KLINE_BASE_INTERVAL,
+    LLM_ANALYST_MAX_TOKENS,
+    LLM_MANAGER_MAX_TOKENS,
+    MARKET_ANALYST_CACHE_TTL_SEC,
+    PROMPT_CANDLE_ENCODING,
+    SYMBOL,
+)
+from data_binance import fetch_klines_multi, fetch_klines_resampled
+from kline_stream import stream_klines
+from indicators import daily_volume_price_incremental, weekly_regime_incremental
+from llm_client import chat_json, chat_text, estimate_tokens, last_llm_usage
 from observability import SpanCtx, GenCtx, safe_preview
+from resample import candle_open_ms
+from singleflight import SingleFlight
+from symbol_index import get_symbol_index
 from line_formatter import build_prompt_for_llm, format_line_message
 
 # ----------------------------
@@ -84,11 +102,10 @@ INTENT_LABELS = {
 
 class AnalystResult(TypedDict, total=False):
     ok: bool
-    focus: str
+    decision: str  # buy / hold / sell
     summary: str
-    decision: str
     notes: List[str]
-    missing: List[str]
+    error: str
 
 
 class AgentState(TypedDict, total=False):
@@ -102,6 +119,8 @@ class AgentState(TypedDict, total=False):
     weekly_regime: str
     daily_pattern: Dict[str, Any]
     daily_candles: List[Dict[str, Any]]
+    candle_epoch: int  # 最後一根已收盤日線的 open_time（ms），市場分析師快取的 key
+    market_closed: Dict[str, Any]  # 只用已收盤 K 線算的週線 / 日線數值（週線 / 日線分析師用）
 
     # multi-analyst results
     analyst_weekly: AnalystResult
@@ -119,7 +138,11 @@ class AgentState(TypedDict, total=False):
 # Helpers
 # ----------------------------
 
-def _serialize_candles(df: pd.DataFrame, n: int) -> List[Dict[str, Any]]:
+def _serialize_candles(df: Union[pd.DataFrame, CandleArray], n: int) -> List[Dict[str, Any]]:
+    if isinstance(df, CandleArray):
+        # columnar：zero-copy tail + 向量化轉 dict
+        return df.sorted().to_records(n)
+
     df2 = df.sort_values("close_time").tail(n).copy()
     df2["date"] = df2["close_time"].dt.strftime("%Y-%m-%d")
     out: List[Dict[str, Any]] = []
@@ -255,13 +278,28 @@ def _clean_for_line(text: str) -> str:
 # Prompt Schemas
 # ----------------------------
 
-BASE_PROMPT_TEMPLATE = """
-[使用者提問]
-{user_text}
+# Prompt 排列順序（prefix-cache friendly）：
+#   [市場 context：已收盤 K 線] → [市場 context：週線 / 日線數值] → [使用者 context] → [角色指示]
+# Ollama / llama.cpp 會重用「跟上一個 prompt 相同的前綴」的 KV cache，CPU 上 prompt eval 佔大部分延遲。
+# 共用、byte-stable 的部分放最前面：三位分析師、同一根日線內不同使用者之間，已收盤 K 線那段都一樣；
+# 會變的部分越晚出現越好。
+# 週線 / 日線分析師的結果跨使用者快取，所以它們的 prompt 只看已收盤 K 線（MARKET_CLOSED_TEMPLATE），
+# 同一根日線內整段 byte-identical；盤中變動（MARKET_LIVE_TEMPLATE）只給風險控管分析師與投資經理。
 
+# 同一根日線內不會變（只含已收盤的 K 線）
+MARKET_STATIC_TEMPLATE = """
 [交易標的]
 {symbol}
 
+[日線 candles（近 {n_closed} 根已收盤，舊→新）]
+{closed_candles}
+""".strip()
+
+# 未收盤那根與由它算出的數值，盤中會隨價格變動
+MARKET_LIVE_TEMPLATE = """
+[最新一根日線（可能尚未收盤）]
+{latest_candle}
+
 [週線資訊]
 - regime: {weekly_regime}
 - close: {close}
@@ -271,68 +309,109 @@ BASE_PROMPT_TEMPLATE = """
 [日線概況]
 - close_dir: {close_dir}
 - vol_ratio: {vol_ratio}
+""".strip()
 
-[日線 candles (近 35 天)]
-{daily_candles}
+# 只用已收盤 K 線算的數值：同一根日線內不會變，週線 / 日線分析師用這段
+MARKET_CLOSED_TEMPLATE = """
+[週線資訊（已收盤週線）]
+- regime: {weekly_regime}
+- close: {close}
+- sma50: {sma50}
+- sma100: {sma100}
+
+[日線概況（最近一根已收盤日線）]
+- close_dir: {close_dir}
+- vol_ratio: {vol_ratio}
+""".strip()
+
+# 使用者 context：只有風險控管分析師與投資經理會看到
+USER_PROMPT_TEMPLATE = """
+[使用者提問]
+{user_text}
 
 {special_instructions}
 """.strip()
 
 
-ANALYST_TEMPLATES = {
-    "weekly": """
-你是{role}。
-•	「所有文字請用繁體中文，禁止英文單字」
-•	「notes 必須是陣列（list of strings），每個元素 20 字以內」
-•	可以提到技術指標與關鍵價格位，但不要提到「分析師」「根據使用者輸入資料」等字眼
-請依週線資訊做判斷，請回傳嚴格 JSON：
-{{
-  "ok": true/false,
-  "focus": "weekly",
-  "decision": "...(buy/hold/sell)...",
-  "summary": "...",
-  "confidence": "...(high/medium/low)...",
-  "key_levels": {{"support":"...", "resistance":"..."}},
-  "notes": [],
-  "missing": []
-}}
-""".strip(),
-    "daily": """
-你是{role}。
-•	「所有文字請用繁體中文，禁止英文單字」
-•	「notes 必須是陣列（list of strings），每個元素 20 字以內」
-•	可以提到技術指標與關鍵價格位，但不要提到「分析師」「根據使用者輸入資料」等字眼
-請依日線量價與 candles 做判斷，只回傳 JSON：
-{{
-  "ok": true/false,
-  "focus": "daily",
-  "decision": "...",
-  "summary": "...",
-  "confidence": "...(high/medium/low)...",
-  "key_levels": {{"support":"...", "resistance":"..."}},
-  "notes": [],
-  "missing": []
-}}
-""".strip(),
-    "risk": """
-你是{role}。
+# 分析師輸出只要下游（investment_manager_node）真的會用到的欄位：ok / decision / summary / notes。
+# 欄位越少、長度有上限，decode 越快；回來後再用 validate_analyst_result 檢查 + 正規化。
+ANALYST_SUMMARY_MAX_CHARS = 60
+ANALYST_NOTES_MAX = 3
+ANALYST_NOTE_MAX_CHARS = 20
+
+_ANALYST_TEMPLATE = """
+你是{{role}}。
 •	「所有文字請用繁體中文，禁止英文單字」
-•	「notes 必須是陣列（list of strings），每個元素 20 字以內」
+•	「summary {summary_max} 字以內；notes 是陣列（list of strings），最多 {notes_max} 個、每個 {note_max} 字以內」
 •	可以提到技術指標與關鍵價格位，但不要提到「分析師」「根據使用者輸入資料」等字眼
-請結合使用者提問與市場資訊提出風險控管 + 倉位 plan，只回傳 JSON：
-{{
-  "ok": true/false,
-  "focus": "risk",
-  "decision": "...",
-  "summary": "...",
-  "confidence": "...(high/medium/low)...",
-  "key_levels": {{"support":"...", "resistance":"..."}},
-  "notes": [],
-  "missing": []
-}}
-""".strip(),
+{{task}}，只回傳 JSON（不要其他欄位）：
+{{{{"ok": true, "decision": "buy|hold|sell", "summary": "...", "notes": ["..."]}}}}
+""".strip().format(
+    summary_max=ANALYST_SUMMARY_MAX_CHARS,
+    notes_max=ANALYST_NOTES_MAX,
+    note_max=ANALYST_NOTE_MAX_CHARS,
+)
+
+ANALYST_TEMPLATES = {
+    "weekly": _ANALYST_TEMPLATE.replace("{task}", "請依週線資訊做判斷"),
+    "daily": _ANALYST_TEMPLATE.replace("{task}", "請依日線量價與 candles 做判斷"),
+    "risk": _ANALYST_TEMPLATE.replace("{task}", "請結合使用者提問與市場資訊提出風險控管 + 倉位 plan"),
 }
 
+_DECISION_ALIASES = {
+    "buy": "buy", "買": "buy", "買入": "buy", "買進": "buy", "做多": "buy",
+    "hold": "hold", "持有": "hold", "觀望": "hold", "續抱": "hold",
+    "sell": "sell", "賣": "sell", "賣出": "sell", "減倉": "sell",
+}
+
+
+_OK_STRINGS = {"true": True, "yes": True, "1": True, "false": False, "no": False, "0": False}
+
+
+def _coerce_ok(value: Any) -> Optional[bool]:
+    """ok 欄位嚴格轉 bool：true/false（含字串 "true"/"false"、1/0）；其他值回 None（視為格式錯誤）。"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        return _OK_STRINGS.get(value.strip().lower())
+    return None
+
+
+def validate_analyst_result(raw: Any) -> AnalystResult:
+    """
+    把 chat_json 的回傳整理成固定格式：只留 ok / decision / summary / notes。
+    - JSON 解析失敗（被 max_tokens 截斷也是）、ok 不是 bool（或 "true"/"false"）、
+      decision 不是 buy/hold/sell → ok=False + error
+    - decision 轉小寫（中文同義詞也接受）
+    - summary 截到 ANALYST_SUMMARY_MAX_CHARS 字、notes 最多 ANALYST_NOTES_MAX 條、每條 ANALYST_NOTE_MAX_CHARS 字
+    """
+    if not isinstance(raw, dict) or "raw" in raw:
+        return {"ok": False, "error": "invalid_json"}
+
+    ok = _coerce_ok(raw.get("ok", True))
+    decision = _DECISION_ALIASES.get(str(raw.get("decision", "")).strip().lower())
+    notes = raw.get("notes", [])
+    if isinstance(notes, str):
+        notes = [notes]
+    elif not isinstance(notes, list):
+        notes = []
+    notes = [str(n).strip()[:ANALYST_NOTE_MAX_CHARS] for n in notes if str(n).strip()][:ANALYST_NOTES_MAX]
+    result: AnalystResult = {
+        "ok": ok is True and decision is not None,
+        "decision": decision or "",
+        "summary": str(raw.get("summary", "") or "").strip()[:ANALYST_SUMMARY_MAX_CHARS],
+        "notes": notes,
+    }
+    if ok is None:
+        result["error"] = f"invalid ok: {str(raw.get('ok'))[:20]}"
+    elif ok and decision is None:
+        result["error"] = f"invalid decision: {str(raw.get('decision'))[:20]}"
+    return result
+
+
+# 跟分析師 prompt 一樣：固定規則 → 同一根日線內共用的週線 / 日線觀點 → 個人化的提問 / 策略 / 風控 → 輸出格式
 MANAGER_LLM_TEMPLATE = """\
 你是一位資深加密貨幣現貨投資經理，請用「給一般投資人看的繁體中文」輸出結論。
 
@@ -345,15 +424,6 @@ MANAGER_LLM_TEMPLATE = """\
 - 除了 BUY/HOLD/SELL 之外，禁止任何英文單字（包含 bullish、signal、volatility 等）
 - 禁止使用「總結」「最終策略判斷」「主要共識」這類報告腔標題字眼
 
-使用者原始提問：
-{user_text}
-
-推斷的行為意圖（自然語言）：
-{intent_label}
-
-最終策略（不可更改）：
-{final_decision}  （只會是 BUY / HOLD / SELL）
-
 市場觀點素材（供你整理，不要照抄）：
 
 週線觀點：
@@ -366,6 +436,15 @@ MANAGER_LLM_TEMPLATE = """\
 重點: {daily_summary}
 補充: {daily_notes}
 
+使用者原始提問：
+{user_text}
+
+推斷的行為意圖（自然語言）：
+{intent_label}
+
+最終策略（不可更改）：
+{final_decision}  （只會是 BUY / HOLD / SELL）
+
 風險控管觀點：
 決策: {risk_decision}
 重點: {risk_summary}
@@ -389,12 +468,35 @@ def fetch_and_analyze(state: AgentState) -> AgentState:
     intent = state.get("intent") or _parse_intent(user_text)
 
     with SpanCtx("fetch_and_analyze", {"symbol": symbol, "user_text": user_text, "intent": intent, "ts": ts}) as span:
-        df_daily = get_daily_klines(symbol, limit=220)
-        df_weekly = get_weekly_klines(symbol, limit=220)
-
-        regime, dfw = compute_weekly_regime(df_weekly)
-        daily_pattern = analyze_daily_volume_price(df_daily)
-        daily_candles = _serialize_candles(df_daily, 35)
+        intervals = {"1d": 220, "1w": 220}
+        # 串流 buffer warm 時直接讀記憶體，沒有 network I/O
+        klines = stream_klines(symbol, intervals, KLINE_BASE_INTERVAL)
+        if klines is not None:
+            span.update(metadata={"kline_source": "stream"})
+        elif KLINE_BASE_INTERVAL:
+            # 只抓 base interval，週線在本地 resample
+            klines = fetch_klines_resampled(symbol, intervals, KLINE_BASE_INTERVAL)
+        else:
+            # 日線 / 週線兩個請求互不相依 → 並行抓
+            klines = fetch_klines_multi(symbol, intervals)
+        candles_daily = klines["1d"]
+        candles_weekly = klines["1w"]
+
+        # 增量指標：只有新收盤 / 未收盤那根需要計算，不重算整段歷史
+        regime, weekly_row = weekly_regime_incremental(symbol, candles_weekly)
+        daily_pattern = daily_volume_price_incremental(symbol, candles_daily)
+        daily_candles = _serialize_candles(candles_daily, 35)
+
+        # 只看已收盤 K 線的版本（狀態已經同步過，這裡只是讀 committed 的值，不重算）
+        now_ms = int(time.time() * 1000)
+        daily_closed = candles_daily[: int(candles_daily.closed_mask(now_ms).sum())]
+        weekly_closed = candles_weekly[: int(candles_weekly.closed_mask(now_ms).sum())]
+        closed_regime, closed_weekly_row = weekly_regime_incremental(symbol, weekly_closed)
+        market_closed = {
+            "weekly_regime": closed_regime,
+            "weekly_row": closed_weekly_row,
+            "daily_pattern": daily_volume_price_incremental(symbol, daily_closed),
+        }
 
         out = {
             "symbol": symbol,
@@ -402,13 +504,11 @@ def fetch_and_analyze(state: AgentState) -> AgentState:
             "ts": ts,
             "intent": intent,
             "weekly_regime": regime,
-            "weekly_row": {
-                "close": dfw.iloc[-1]["close"],
-                "sma50": dfw.iloc[-1]["sma50"],
-                "sma100": dfw.iloc[-1]["sma100"],
-            },
+            "weekly_row": weekly_row,
             "daily_pattern": daily_pattern,
             "daily_candles": daily_candles,
+            "market_closed": market_closed,
+            "candle_epoch": int(daily_closed.open_time[-1]) if len(daily_closed) else 0,
         }
 
         span.update(output={"weekly_regime": regime, "daily_pattern": daily_pattern})
@@ -426,16 +526,20 @@ def _run_analyst(prompt: str, name: str) -> AnalystResult:
     with SpanCtx(name, {"prompt_preview": safe_preview(prompt, 1200)}) as span:
         try:
             # generation span
-            with GenCtx(f"{name}.llm", {"prompt_preview": safe_preview(prompt, 2000)}) as gen:
-                raw = chat_json(prompt, temperature=0)
-                # attach raw to gen span
-                gen.update(output={"raw_preview": safe_preview(raw, 1200)})
-
-            # if raw is dict-like or str
-            result = raw if isinstance(raw, dict) else {}
+            with GenCtx(
+                f"{name}.llm",
+                {"prompt_preview": safe_preview(prompt, 2000)},
+                metadata={"prompt_tokens_est": estimate_tokens(prompt), "candle_encoding": CANDLE_ENCODING},
+            ) as gen:
+                raw = chat_json(prompt, temperature=0, max_tokens=LLM_ANALYST_MAX_TOKENS or None)
+                # attach raw + 輸出 token 數 to gen span
+                gen.update(output={"raw_preview": safe_preview(raw, 1200)}, metadata={"usage": last_llm_usage()})
+
+            # 只留 ok / decision / summary / notes，格式不對就 ok=False
+            result = validate_analyst_result(raw)
 
             # attach result to span
-            span.update(output={"result_preview": safe_preview(raw, 1200)})
+            span.update(output={"result_preview": safe_preview(result, 1200)})
         except Exception as e:
             # if error, log to span metadata
             span.update(
@@ -447,49 +551,169 @@ def _run_analyst(prompt: str, name: str) -> AnalystResult:
     return result
 
 
-def multi_analyst_node(state: AgentState) -> AgentState:
-    symbol = state["symbol"]
-    user_text = state["user_text"]
-    weekly_regime = state["weekly_regime"]
-    weekly_row = state["weekly_row"]
-    daily_pattern = state["daily_pattern"]
-    daily_candles = state["daily_candles"]
+if PROMPT_CANDLE_ENCODING not in ENCODINGS:
+    print(f"[WARN] Unknown PROMPT_CANDLE_ENCODING={PROMPT_CANDLE_ENCODING!r}, using compact")
+CANDLE_ENCODING = PROMPT_CANDLE_ENCODING if PROMPT_CANDLE_ENCODING in ENCODINGS else "compact"
+
+
+def _price_precision(symbol: str, rows: List[Dict[str, Any]]) -> int:
+    """交易對 tickSize 的小數位數；索引裡沒有就依價格量級決定。"""
+    info = get_symbol_index().info(symbol)
+    precision = info.price_precision if info is not None else None
+    return price_decimals(rows, precision)
 
-    intent = state.get("intent", "general_advice")
-    intent_label = INTENT_LABELS.get(intent, intent)
 
-    base_ctx = BASE_PROMPT_TEMPLATE.format(
-        user_text=user_text,
-        symbol=symbol,
-        weekly_regime=weekly_regime,
-        close=weekly_row["close"],
-        sma50=weekly_row["sma50"],
-        sma100=weekly_row["sma100"],
+def _build_market_ctx(state: AgentState, live: bool = True) -> str:
+    """
+    市場資料 context（不含使用者提問 / intent）：已收盤 K 線在前（同一根日線內 byte-stable），
+    最新那根與週線數值在後。K 線格式依 PROMPT_CANDLE_ENCODING（見 candle_encoding.py）。
+    live=False：不放未收盤那根，數值改用只看已收盤 K 線的版本（整段同一根日線內不會變）。
+    """
+    candles = state["daily_candles"]
+    closed, latest = candles[:-1], candles[-1:]
+
+    # 小數位數只看已收盤的部分決定，盤中價格變動不會改到前面那段
+    precision = _price_precision(state["symbol"], closed or candles)
+
+    def num(v: Any, decimals: int = precision) -> Any:
+        # json 模式維持原本的全精度輸出
+        if CANDLE_ENCODING == "json" or not isinstance(v, (int, float)):
+            return v
+        return fmt_number(float(v), decimals)
+
+    static = MARKET_STATIC_TEMPLATE.format(
+        symbol=state["symbol"],
+        n_closed=len(closed),
+        closed_candles=encode_candles(closed, CANDLE_ENCODING, precision),
+    )
+    if not live:
+        closed_state = state["market_closed"]
+        weekly_row, daily_pattern = closed_state["weekly_row"], closed_state["daily_pattern"]
+        summary = MARKET_CLOSED_TEMPLATE.format(
+            weekly_regime=closed_state["weekly_regime"],
+            close=num(weekly_row["close"]),
+            sma50=num(weekly_row["sma50"]),
+            sma100=num(weekly_row["sma100"]),
+            close_dir=daily_pattern.get("close_dir"),
+            vol_ratio=num(daily_pattern.get("vol_ratio"), 3),
+        )
+        return f"{static}\n\n{summary}"
+
+    weekly_row, daily_pattern = state["weekly_row"], state["daily_pattern"]
+    summary = MARKET_LIVE_TEMPLATE.format(
+        # 單獨一根不需要摘要：features 模式也用 compact
+        latest_candle=encode_candles(latest, "json" if CANDLE_ENCODING == "json" else "compact", precision),
+        weekly_regime=state["weekly_regime"],
+        close=num(weekly_row["close"]),
+        sma50=num(weekly_row["sma50"]),
+        sma100=num(weekly_row["sma100"]),
         close_dir=daily_pattern.get("close_dir"),
-        vol_ratio=daily_pattern.get("vol_ratio"),
-        daily_candles=json.dumps(daily_candles, ensure_ascii=False),
-        special_instructions=f"使用者意圖: {intent_label}。請特別根據此意圖給出判斷重點。"
+        vol_ratio=num(daily_pattern.get("vol_ratio"), 3),
     )
+    return f"{static}\n\n{summary}"
 
-    analysts = {}
 
-    analysts["analyst_weekly"] = _run_analyst(
-        ANALYST_TEMPLATES["weekly"].format(role="週線趨勢分析師") + "\n\n" + base_ctx,
-        "analyst_weekly",
-    )
+def _build_user_ctx(state: AgentState) -> str:
+    """使用者提問 + intent 指示（個人化的部分）。"""
+    intent = state.get("intent", "general_advice")
+    intent_label = INTENT_LABELS.get(intent, intent)
 
-    analysts["analyst_daily"] = _run_analyst(
-        ANALYST_TEMPLATES["daily"].format(role="日線量價分析師") + "\n\n" + base_ctx,
-        "analyst_daily",
+    return USER_PROMPT_TEMPLATE.format(
+        user_text=state["user_text"],
+        special_instructions=f"使用者意圖: {intent_label}。請特別根據此意圖給出判斷重點。",
     )
 
-    analysts["analyst_risk"] = _run_analyst(
-        ANALYST_TEMPLATES["risk"].format(role="風險控管分析師") + "\n\n" + base_ctx,
-        "analyst_risk",
-    )
 
-    state.update(analysts)
-    return state
+ANALYST_ROLES = {
+    "weekly": "週線趨勢分析師",
+    "daily": "日線量價分析師",
+    "risk": "風險控管分析師",
+}
+
+
+# 只看已收盤市場資料的分析師：結果依 (symbol, 日線 epoch, prompt) 快取，所有 intent / 使用者共用
+MARKET_ANALYSTS = ("weekly", "daily")
+
+_market_analyst_stats = {"hit": 0, "computed": 0}
+_market_analyst_stats_lock = threading.Lock()
+
+
+def market_analyst_stats() -> Dict[str, int]:
+    with _market_analyst_stats_lock:
+        return dict(_market_analyst_stats)
+
+
+def _count_market_analyst(name: str) -> None:
+    with _market_analyst_stats_lock:
+        _market_analyst_stats[name] += 1
+
+
+def _cached_market_analyst(kind: str, state: AgentState, prompt: str) -> AnalystResult:
+    """
+    同一個 (symbol, kind, candle epoch) 只跑一次 LLM；其他請求（不同 intent / 不同 worker）等結果直接用。
+    prompt 只含已收盤 K 線（build_analyst_prompt），key 再帶上 prompt 的 hash：
+    輸入只要有任何不同（例如資料源補上缺的 K 線）就不會拿到別人的結果。
+    失敗的結果（ok=False + error）不快取，下一個請求會重試。
+    """
+    name = f"analyst_{kind}"
+    epoch = state.get("candle_epoch")
+    if MARKET_ANALYST_CACHE_TTL_SEC <= 0 or not epoch:
+        return _run_analyst(prompt, name)
+
+    backend = get_cache_backend()
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+    key = f"{state['symbol']}:{kind}:{epoch}:{digest}"
+    result = backend.get("analyst", key)
+    if result is None:
+        with backend.lock("analyst", key):
+            result = backend.get("analyst", key)
+            if result is None:
+                result = _run_analyst(prompt, name)
+                _count_market_analyst("computed")
+                if "error" not in result:
+                    backend.put("analyst", key, result, ttl_sec=MARKET_ANALYST_CACHE_TTL_SEC)
+                return result
+    _count_market_analyst("hit")
+    return result
+
+
+def assemble_prompt(*sections: str) -> str:
+    """依序接起各段（共用的放前面、角色指示放最後），空段略過。"""
+    return "\n\n".join(sec for sec in sections if sec)
+
+
+def build_analyst_prompt(kind: str, state: AgentState) -> str:
+    """市場 context →（風險控管才有）使用者 context → 角色指示。週線 / 日線分析師只看已收盤的市場 context。"""
+    role = "[你的任務]\n" + ANALYST_TEMPLATES[kind].format(role=ANALYST_ROLES[kind])
+    if kind in MARKET_ANALYSTS:
+        return assemble_prompt(_build_market_ctx(state, live=False), role)
+    return assemble_prompt(_build_market_ctx(state), _build_user_ctx(state), role)
+
+
+def _make_analyst_node(kind: str):
+    """
+    產生單一分析師節點。三個分析師節點由 fetch_and_analyze fan-out 並行執行，
+    所以每個節點只回傳自己的 state key（analyst_weekly / analyst_daily / analyst_risk），
+    避免並行寫入同一個 key。同時在跑的 LLM 呼叫數由 llm_client 依 backend 限制。
+
+    週線 / 日線分析師只拿已收盤的市場 context（跟 intent、盤中價格無關，可以跨使用者共用）；
+    風險控管分析師另外加上使用者提問與 intent。prompt 排列見 build_analyst_prompt。
+    """
+    name = f"analyst_{kind}"
+
+    def analyst_node(state: AgentState) -> AgentState:
+        prompt = build_analyst_prompt(kind, state)
+        if kind in MARKET_ANALYSTS:
+            return {name: _cached_market_analyst(kind, state, prompt)}
+        return {name: _run_analyst(prompt, name)}
+
+    analyst_node.__name__ = f"{name}_node"
+    return analyst_node
+
+
+analyst_weekly_node = _make_analyst_node("weekly")
+analyst_daily_node = _make_analyst_node("daily")
+analyst_risk_node = _make_analyst_node("risk")
 
 
 def investment_manager_node(state: AgentState) -> AgentState:
@@ -577,8 +801,8 @@ def investment_manager_node(state: AgentState) -> AgentState:
 
         # 呼叫 LLM summary，並把回傳當作 summary_text
         with GenCtx("investment_manager.llm", {"prompt_preview": safe_preview(prompt, 2000)}) as gen:
-            raw = chat_text(prompt, temperature=0)
-            gen.update(output={"raw_preview": safe_preview(raw, 1200)})
+            raw = chat_text(prompt, temperature=0, max_tokens=LLM_MANAGER_MAX_TOKENS or None)
+            gen.update(output={"raw_preview": safe_preview(raw, 1200)}, metadata={"usage": last_llm_usage()})
 
             def _parse_manager_sections(text: str) -> tuple[str, list[str]]:
                 lines = [ln.strip() for ln in (text or "").splitlines() if ln.strip()]
@@ -640,31 +864,70 @@ def build_graph():
     builder = StateGraph(AgentState)
 
     builder.add_node("fetch_and_analyze", fetch_and_analyze)
-    builder.add_node("multi_analyst", multi_analyst_node)
+    builder.add_node("analyst_weekly", analyst_weekly_node)
+    builder.add_node("analyst_daily", analyst_daily_node)
+    builder.add_node("analyst_risk", analyst_risk_node)
     builder.add_node("investment_manager", investment_manager_node)
     builder.add_node("format_message", format_message_node)
 
     builder.add_edge(START, "fetch_and_analyze")
-    builder.add_edge("fetch_and_analyze", "multi_analyst")
-    builder.add_edge("multi_analyst", "investment_manager")
+
+    # fan-out：三位分析師並行
+    analyst_nodes = ["analyst_weekly", "analyst_daily", "analyst_risk"]
+    for node in analyst_nodes:
+        builder.add_edge("fetch_and_analyze", node)
+
+    # join：三位都完成才進投資經理
+    builder.add_edge(analyst_nodes, "investment_manager")
     builder.add_edge("investment_manager", "format_message")
     builder.add_edge("format_message", END)
 
     return builder.compile()
 
 
-def run_with_graph(symbol: str, user_text: str | None = None) -> str:
-    symbol = symbol.upper()
-    user_text = user_text or f"{symbol} 投資建議"
-    ts = dt.datetime.now().isoformat()
-    intent = _parse_intent(user_text)
+# ----------------------------
+# Compiled Graph Cache
+# ----------------------------
+# Graph 拓樸固定，compile 一次就好；之後每個請求直接重用（compiled graph 可多 thread 共用）。
+# 之後若有不同的 graph 變體，在 GRAPH_BUILDERS 註冊即可，各自 compile 一次。
+# ----------------------------
+
+GRAPH_BUILDERS = {
+    "default": build_graph,
+}
+
+_compiled_graphs: Dict[str, Any] = {}
+_compiled_graphs_lock = threading.Lock()
+
+
+def get_graph(variant: str = "default"):
+    graph = _compiled_graphs.get(variant)
+    if graph is not None:
+        return graph
+    with _compiled_graphs_lock:
+        graph = _compiled_graphs.get(variant)
+        if graph is None:
+            if variant not in GRAPH_BUILDERS:
+                raise ValueError(f"unknown graph variant: {variant}")
+            graph = _compiled_graphs[variant] = GRAPH_BUILDERS[variant]()
+    return graph
+
+
+# 同一根日線內、同 symbol + intent 的並行請求共用一次 graph 執行
+_analysis_flight = SingleFlight()
+
+
+def analysis_flight_stats() -> Dict[str, int]:
+    return _analysis_flight.stats()
+
 
+def _invoke_graph(symbol: str, user_text: str, intent: str, ts: str) -> str:
     with SpanCtx(
         "crypto_agent.run",
         {"symbol": symbol, "intent": intent, "ts": ts},
     ) as root:
 
-        graph = build_graph()
+        graph = get_graph()
         final_state: AgentState = graph.invoke(
             {
                 "symbol": symbol,
@@ -676,3 +939,35 @@ def run_with_graph(symbol: str, user_text: str | None = None) -> str:
         root.update(output={"final_message": final_state.get("message", "")})
 
     return final_state["message"]
+
+
+def _cached_invoke_graph(symbol: str, user_text: str, intent: str, ts: str, epoch: int) -> str:
+    """
+    結果放進 cache backend（ANALYSIS_CACHE_TTL_SEC 秒）：
+    SHARED_CACHE_BACKEND=sqlite 時，同機其他 worker 的同一個問題也只跑一次 graph。
+    """
+    if ANALYSIS_CACHE_TTL_SEC <= 0:
+        return _invoke_graph(symbol, user_text, intent, ts)
+    return get_cache_backend().get_or_compute(
+        "analysis",
+        f"{symbol}:{intent}:{epoch}",
+        lambda: _invoke_graph(symbol, user_text, intent, ts),
+        ttl_sec=ANALYSIS_CACHE_TTL_SEC,
+    )
+
+
+def run_analysis(symbol: str, intent: str, user_text: str | None = None) -> str:
+    """不經過 analysis cache / single-flight，直接跑一次完整 graph（precompute 排程用）。"""
+    symbol = symbol.upper()
+    user_text = user_text or f"{symbol} 投資建議"
+    return _invoke_graph(symbol, user_text, intent, dt.datetime.now().isoformat())
+
+
+def run_with_graph(symbol: str, user_text: str | None = None) -> str:
+    symbol = symbol.upper()
+    user_text = user_text or f"{symbol} 投資建議"
+    ts = dt.datetime.now().isoformat()
+    intent = _parse_intent(user_text)
+
+    epoch = candle_open_ms(int(time.time() * 1000), "1d")
+    return _analysis_flight.do((symbol, intent, epoch), _cached_invoke_graph, symbol, user_text, intent, ts, epoch)
@@ -1,13 +1,36 @@
 from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple, Union
+
+import numpy as np
 import pandas as pd
 
-def compute_weekly_regime(df_weekly: pd.DataFrame):
+from candles import CandleArray
+
+
+def _classify_regime(sma50: Any, sma100: Any) -> str:
+    if pd.isna(sma50) or pd.isna(sma100):
+        return "unknown"
+    if sma50 > sma100:
+        return "bull"
+    if sma50 < sma100:
+        return "bear"
+    return "sideways"
+
+
+def compute_weekly_regime(df_weekly: Union[pd.DataFrame, CandleArray]):
     """
     Weekly regime by SMA50/SMA100 (weekly).
     Returns:
       regime: str
       df: df with sma50/sma100 columns
     """
+    if isinstance(df_weekly, CandleArray):
+        df_weekly = df_weekly.to_dataframe()
     df = df_weekly.copy()
     if "close" not in df.columns:
         raise ValueError("weekly df must contain 'close'")
@@ -17,23 +40,13 @@ def compute_weekly_regime(df_weekly: pd.DataFrame):
     df["sma100"] = df["close"].rolling(100).mean()
 
     last = df.iloc[-1]
-    sma50 = last["sma50"]
-    sma100 = last["sma100"]
-
-    if pd.isna(sma50) or pd.isna(sma100):
-        regime = "unknown"
-    elif sma50 > sma100:
-        regime = "bull"
-    elif sma50 < sma100:
-        regime = "bear"
-    else:
-        regime = "sideways"
+    regime = _classify_regime(last["sma50"], last["sma100"])
 
     return regime, df
 
 
 # Backward-compatible helper: some modules previously imported this name.
-def classify_weekly_regime(df_weekly: pd.DataFrame) -> dict:
+def classify_weekly_regime(df_weekly: Union[pd.DataFrame, CandleArray]) -> dict:
     regime, df = compute_weekly_regime(df_weekly)
     if len(df) == 0:
         return {"regime": "unknown", "close": None, "sma50": None, "sma100": None}
@@ -47,12 +60,14 @@ def classify_weekly_regime(df_weekly: pd.DataFrame) -> dict:
     }
 
 
-def analyze_daily_volume_price(df_daily: pd.DataFrame):
+def analyze_daily_volume_price(df_daily: Union[pd.DataFrame, CandleArray]):
     """
     Simple daily pattern features:
       - close up/down vs prev day
       - volume vs 20d avg ratio
     """
+    if isinstance(df_daily, CandleArray):
+        df_daily = df_daily.to_dataframe()
     df = df_daily.sort_values("close_time").reset_index(drop=True)
 
     if len(df) < 2:
@@ -61,15 +76,16 @@ def analyze_daily_volume_price(df_daily: pd.DataFrame):
     last = df.iloc[-1]
     prev = df.iloc[-2]
 
-    close_last = float(last["close"])
-    close_prev = float(prev["close"])
-    close_change = close_last - close_prev
-    close_dir = "up" if close_change > 0 else "down" if close_change < 0 else "flat"
-
     # volume ratio vs 20d mean
     df["vol20"] = df["volume"].rolling(20).mean()
     vol20 = float(df.iloc[-1]["vol20"]) if pd.notna(df.iloc[-1]["vol20"]) else None
-    vol_last = float(last["volume"])
+
+    return _daily_pattern(float(last["close"]), float(prev["close"]), float(last["volume"]), vol20)
+
+
+def _daily_pattern(close_last: float, close_prev: float, vol_last: float, vol20: Optional[float]) -> dict:
+    close_change = close_last - close_prev
+    close_dir = "up" if close_change > 0 else "down" if close_change < 0 else "flat"
 
     if vol20 and vol20 > 0:
         vol_ratio = vol_last / vol20
@@ -86,3 +102,247 @@ def analyze_daily_volume_price(df_daily: pd.DataFrame):
         "vol20": vol20,
         "vol_ratio": vol_ratio,
     }
+
+
+# ----------------------------
+# Incremental Indicators
+# ----------------------------
+# 每次請求都對整段歷史重算 rolling，其實只有最後一根 K 線變了。
+# RollingMean 保留視窗內的 running sum，新 K 線收盤時 O(1) 更新；
+# 未收盤那根只用 peek() 試算，不寫進狀態。
+#
+# 演算法照抄 pandas 的 roll_mean（Kahan 補償加總、加/減各自一個 compensation、
+# 視窗內全相同值直接回傳該值、全正/全負時的符號修正）。
+#
+# 數值誤差：pandas 的 compensation 是從「傳進去那段序列的第一根」一路累積下來的，
+# 所以同一根 K 線的 SMA 會因為 DataFrame 從哪一根開始而差最後幾個 bit，不可能跟任意切法都逐位元相同。
+# 這裡保證的是：與 pandas 對同一段資料做 rolling().mean() 的相對誤差 <= 1e-12（測試就是檢查這個）。
+# running sum 跨 K 線保留（每根 O(1)）；為了不讓誤差一直累積，每 push window 根
+# 用視窗內的值重新加總一次（rebase，O(window)，攤提下來每根仍是 O(1)）。
+# ----------------------------
+
+class RollingMean:
+    __slots__ = (
+        "window",
+        "_values",
+        "_nobs",
+        "_sum",
+        "_neg_ct",
+        "_comp_add",
+        "_comp_remove",
+        "_same_ct",
+        "_prev",
+        "_started",
+        "_since_rebase",
+    )
+
+    def __init__(self, window: int):
+        self.window = int(window)
+        self._values: Deque[float] = deque()
+        self._nobs = 0
+        self._sum = 0.0
+        self._neg_ct = 0
+        self._comp_add = 0.0
+        self._comp_remove = 0.0
+        self._same_ct = 0
+        self._prev = math.nan
+        self._started = False
+        self._since_rebase = 0
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def _state(self) -> Tuple[int, float, int, float, float, int, float]:
+        return (self._nobs, self._sum, self._neg_ct, self._comp_add, self._comp_remove, self._same_ct, self._prev)
+
+    def _advance(self, state: Tuple[int, float, int, float, float, int, float], value: float):
+        nobs, sum_x, neg_ct, comp_add, comp_remove, same_ct, prev = state
+        if not self._started:
+            prev = value
+
+        # remove（視窗滿了才會擠掉最舊的一根）
+        if len(self._values) >= self.window:
+            old = self._values[0]
+            if old == old:
+                nobs -= 1
+                y = -old - comp_remove
+                t = sum_x + y
+                comp_remove = t - sum_x - y
+                sum_x = t
+                if math.copysign(1.0, old) < 0:
+                    neg_ct -= 1
+
+        # add
+        if value == value:
+            nobs += 1
+            y = value - comp_add
+            t = sum_x + y
+            comp_add = t - sum_x - y
+            sum_x = t
+            if math.copysign(1.0, value) < 0:
+                neg_ct += 1
+            if value == prev:
+                same_ct += 1
+            else:
+                same_ct = 1
+            prev = value
+
+        return (nobs, sum_x, neg_ct, comp_add, comp_remove, same_ct, prev)
+
+    def _mean(self, state: Tuple[int, float, int, float, float, int, float]) -> float:
+        nobs, sum_x, neg_ct, _, _, same_ct, prev = state
+        if nobs < self.window or nobs == 0:
+            return math.nan
+        result = sum_x / nobs
+        if same_ct >= nobs:
+            result = prev
+        elif neg_ct == 0 and result < 0:
+            result = 0.0
+        elif neg_ct == nobs and result > 0:
+            result = 0.0
+        return result
+
+    def push(self, value: float) -> float:
+        """commit 一根已收盤的值（O(1)），回傳包含它的視窗平均。"""
+        value = float(value)
+        state = self._advance(self._state(), value)
+        (self._nobs, self._sum, self._neg_ct, self._comp_add, self._comp_remove, self._same_ct, self._prev) = state
+        self._started = True
+        if len(self._values) >= self.window:
+            self._values.popleft()
+        self._values.append(value)
+        self._since_rebase += 1
+        if self._since_rebase >= self.window:
+            self.rebase()
+        return self.value()
+
+    def rebase(self) -> None:
+        """用視窗內的值從頭重算 running sum，丟掉之前累積的 compensation 誤差。"""
+        values = list(self._values)
+        state = (0, 0.0, 0, 0.0, 0.0, 0, math.nan)
+        self._values.clear()
+        self._started = False
+        for v in values:
+            state = self._advance(state, v)
+            self._started = True
+            self._values.append(v)
+        (self._nobs, self._sum, self._neg_ct, self._comp_add, self._comp_remove, self._same_ct, self._prev) = state
+        self._since_rebase = 0
+
+    def peek(self, value: float) -> float:
+        """假設下一根是 value 時的視窗平均（例如未收盤 K 線），不改變狀態。"""
+        return self._mean(self._advance(self._state(), float(value)))
+
+    def value(self) -> float:
+        return self._mean(self._state())
+
+
+Candles = Union[pd.DataFrame, CandleArray]
+
+
+def _as_candles(df: Candles) -> CandleArray:
+    if isinstance(df, CandleArray):
+        return df.sorted()
+    return CandleArray.from_dataframe(df).sorted()
+
+
+class IncrementalIndicators:
+    """
+    單一 (symbol, interval) 的增量指標狀態。
+
+    specs: {"sma50": ("close", 50), ...} → 輸出名稱: (欄位, 視窗)
+    """
+
+    def __init__(self, specs: Dict[str, Tuple[str, int]]):
+        self.specs = dict(specs)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._means = {name: RollingMean(w) for name, (_, w) in self.specs.items()}
+        self.first_open_ms: Optional[int] = None
+        self.last_closed_open_ms: Optional[int] = None
+
+    def sync(self, df: Candles, now_ms: Optional[int] = None) -> Dict[str, Optional[float]]:
+        """
+        用最新的 K 線更新狀態，回傳最後一根（可能未收盤）的指標值。
+        - 第一次、或 K 線跟狀態接不起來（中間有斷層、歷史被改）→ 用全部已收盤 K 線重建
+        - 之後只 push 新收盤的 K 線，O(1)/根
+        """
+        c = _as_candles(df)
+        if len(c) == 0:
+            return {name: None for name in self.specs}
+
+        now_ms = int(time.time() * 1000) if now_ms is None else int(now_ms)
+        open_time = c.open_time
+
+        with self._lock:
+            last_closed = self.last_closed_open_ms
+            start = 0
+            if last_closed is not None and open_time[0] <= last_closed:
+                i = int(np.searchsorted(open_time, last_closed))
+                if i < len(c) and open_time[i] == last_closed:
+                    start = i + 1
+            if start == 0:
+                self._reset()
+                self.first_open_ms = int(open_time[0])
+
+            # 新的已收盤 K 線：open_time 已排序，close_time 也是遞增
+            end = int(np.searchsorted(c.close_time, now_ms, side="left"))
+            for name, (col, _) in self.specs.items():
+                rm = self._means[name]
+                for v in getattr(c, col)[start:end].tolist():
+                    rm.push(v)
+            if end > start:
+                self.last_closed_open_ms = int(open_time[end - 1])
+
+            out: Dict[str, Optional[float]] = {}
+            last_is_open = int(c.close_time[-1]) >= now_ms
+            for name, (col, _) in self.specs.items():
+                rm = self._means[name]
+                v = rm.peek(float(getattr(c, col)[-1])) if last_is_open else rm.value()
+                out[name] = None if math.isnan(v) else v
+            return out
+
+
+_STATE_SPECS = {
+    "1w": {"sma50": ("close", 50), "sma100": ("close", 100)},
+    "1d": {"vol20": ("volume", 20)},
+}
+
+_states: Dict[Tuple[str, str], IncrementalIndicators] = {}
+_states_lock = threading.Lock()
+
+
+def get_indicator_state(symbol: str, interval: str) -> IncrementalIndicators:
+    key = (symbol.upper(), interval)
+    with _states_lock:
+        st = _states.get(key)
+        if st is None:
+            st = _states[key] = IncrementalIndicators(_STATE_SPECS[interval])
+        return st
+
+
+def weekly_regime_incremental(symbol: str, df_weekly: Candles) -> Tuple[str, Dict[str, Optional[float]]]:
+    """
+    compute_weekly_regime 的增量版：回傳 (regime, {"close", "sma50", "sma100"})。
+    """
+    c = _as_candles(df_weekly)
+    if len(c) == 0:
+        return "unknown", {"close": None, "sma50": None, "sma100": None}
+
+    values = get_indicator_state(symbol, "1w").sync(c)
+    row = {"close": float(c.close[-1]), "sma50": values["sma50"], "sma100": values["sma100"]}
+    return _classify_regime(row["sma50"], row["sma100"]), row
+
+
+def daily_volume_price_incremental(symbol: str, df_daily: Candles) -> dict:
+    """
+    analyze_daily_volume_price 的增量版，輸出格式相同。
+    """
+    c = _as_candles(df_daily)
+    if len(c) < 2:
+        return {"ok": False, "reason": "not enough daily candles (need >=2)"}
+
+    values = get_indicator_state(symbol, "1d").sync(c)
+    return _daily_pattern(float(c.close[-1]), float(c.close[-2]), float(c.volume[-1]), values["vol20"])
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from candles import INT_COLUMNS, KLINE_COLUMNS, CandleArray
+from resample import INTERVAL_MS, candle_open_ms
+
+"""
+KlineStore：已收盤 K 線的本地持久化（SQLite），重啟後不必重新從 Binance 拉歷史。
+
+- 只存「已收盤」的 K 線；未收盤那根每次都從 Binance 拿
+- kline_meta 記錄每個 (symbol, interval) 已同步的連續區間 [lo_ms, hi_ms)：
+    * 要的範圍比 lo 早 → 只補抓 [start, lo) 這段（head backfill）
+    * 要的範圍比 hi 晚 → 只補抓 [hi, end] 這段（增量更新）
+  區間永遠保持連續，Binance 本身缺的 K 線（維護停機、上市前）也不會一直重抓
+- 讀取：PRIMARY KEY (symbol, interval, open_time) 的 WITHOUT ROWID 表 → 範圍查詢直接走 B-tree，
+  搭配 mmap_size 讓 SQLite 以 memory-mapping 讀檔；read_columns() 只 SELECT 需要的欄位
+- 每個 thread 各自一條 connection，WAL 模式讓讀寫不互卡
+"""
+
+# fetch(symbol, interval, start_ms, end_ms) -> open_time 落在 [start_ms, end_ms] 的 K 線
+FetchRange = Callable[[str, str, int, int], CandleArray]
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS klines (
+    symbol   TEXT    NOT NULL,
+    interval TEXT    NOT NULL,
+    {", ".join(f"{c} {'INTEGER' if c in INT_COLUMNS else 'REAL'} NOT NULL" for c in KLINE_COLUMNS)},
+    PRIMARY KEY (symbol, interval, open_time)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS kline_meta (
+    symbol   TEXT    NOT NULL,
+    interval TEXT    NOT NULL,
+    lo_ms    INTEGER NOT NULL,
+    hi_ms    INTEGER NOT NULL,
+    PRIMARY KEY (symbol, interval)
+);
+"""
+
+_INSERT_SQL = (
+    f"INSERT OR REPLACE INTO klines (symbol, interval, {', '.join(KLINE_COLUMNS)}) "
+    f"VALUES (?, ?, {', '.join('?' * len(KLINE_COLUMNS))})"
+)
+
+_MMAP_SIZE = 256 * 1024 * 1024
+
+
+class KlineStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        # read / write 不在 key lock 裡（不同 key 也會同時改），計數另外用一把 lock
+        self._stats_lock = threading.Lock()
+        self.stats = {"read": 0, "fetch_head": 0, "fetch_tail": 0, "rows_written": 0}
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={_MMAP_SIZE}")
+            self._local.conn = conn
+        return conn
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def stats_snapshot(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self.stats)
+
+    # ---- metadata ----
+
+    def coverage(self, symbol: str, interval: str) -> Optional[Tuple[int, int]]:
+        """已同步的連續區間 (lo_ms, hi_ms)；沒有資料回傳 None。"""
+        row = self._conn().execute(
+            "SELECT lo_ms, hi_ms FROM kline_meta WHERE symbol = ? AND interval = ?",
+            (symbol, interval),
+        ).fetchone()
+        return (int(row[0]), int(row[1])) if row else None
+
+    def last_closed_open_ms(self, symbol: str, interval: str) -> Optional[int]:
+        row = self._conn().execute(
+            "SELECT MAX(open_time) FROM klines WHERE symbol = ? AND interval = ?",
+            (symbol, interval),
+        ).fetchone()
+        return None if row is None or row[0] is None else int(row[0])
+
+    # ---- read / write ----
+
+    def read_columns(
+        self,
+        symbol: str,
+        interval: str,
+        start_ms: int,
+        end_ms: int,
+        columns: Sequence[str] = KLINE_COLUMNS,
+    ) -> Dict[str, np.ndarray]:
+        """open_time 落在 [start_ms, end_ms] 的 K 線，只讀 columns 指定的欄位。"""
+        unknown = set(columns) - set(KLINE_COLUMNS)
+        if unknown:
+            raise ValueError(f"unknown candle columns: {sorted(unknown)}")
+        self._count("read")
+        rows = self._conn().execute(
+            f"SELECT {', '.join(columns)} FROM klines "
+            "WHERE symbol = ? AND interval = ? AND open_time BETWEEN ? AND ? ORDER BY open_time",
+            (symbol, interval, int(start_ms), int(end_ms)),
+        ).fetchall()
+        m = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns))
+        return {
+            c: m[:, i].astype(np.int64) if c in INT_COLUMNS else np.ascontiguousarray(m[:, i])
+            for i, c in enumerate(columns)
+        }
+
+    def read(self, symbol: str, interval: str, start_ms: int, end_ms: int) -> CandleArray:
+        return CandleArray(**self.read_columns(symbol, interval, start_ms, end_ms))
+
+    def write(self, symbol: str, interval: str, candles: CandleArray) -> int:
+        """寫入（已收盤的）K 線，同一根重複寫入以新的為準。"""
+        if len(candles) == 0:
+            return 0
+        cols = [getattr(candles, c).tolist() for c in KLINE_COLUMNS]
+        rows = [(symbol, interval, *r) for r in zip(*cols)]
+        with self._conn() as conn:
+            conn.executemany(_INSERT_SQL, rows)
+        self._count("rows_written", len(rows))
+        return len(rows)
+
+    def _set_coverage(self, symbol: str, interval: str, lo_ms: int, hi_ms: int) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO kline_meta (symbol, interval, lo_ms, hi_ms) VALUES (?, ?, ?, ?)",
+                (symbol, interval, int(lo_ms), int(hi_ms)),
+            )
+
+    def clear(self, symbol: Optional[str] = None) -> None:
+        with self._conn() as conn:
+            if symbol is None:
+                conn.execute("DELETE FROM klines")
+                conn.execute("DELETE FROM kline_meta")
+            else:
+                conn.execute("DELETE FROM klines WHERE symbol = ?", (symbol,))
+                conn.execute("DELETE FROM kline_meta WHERE symbol = ?", (symbol,))
+
+    # ---- incremental sync ----
+
+    def load_range(
+        self,
+        symbol: str,
+        interval: str,
+        start_ms: int,
+        end_ms: int,
+        now_ms: int,
+        fetch: FetchRange,
+    ) -> CandleArray:
+        """
+        回傳 open_time 落在 [start_ms, end_ms] 的 K 線：
+        已收盤的從本地讀，缺的區間才呼叫 fetch 補抓；未收盤那根（若在範圍內）直接用 fetch 的結果。
+        """
+        if interval not in INTERVAL_MS:
+            raise ValueError(f"unsupported store interval: {interval}")
+        step = INTERVAL_MS[interval]
+        # 已收盤區間的上界 = 目前這根（未收盤）K 線的 open_time
+        closed_hi = candle_open_ms(now_ms, interval)
+        start = candle_open_ms(start_ms, interval)
+        if start < start_ms:
+            start += step
+        end = int(end_ms)
+        if end < start:
+            return CandleArray.empty()
+
+        with self._key_lock((symbol, interval)):
+            cov = self.coverage(symbol, interval)
+            fetched = []
+            if cov is None:
+                fetched.append(fetch(symbol, interval, start, end))
+                lo, hi = start, start
+            else:
+                lo, hi = cov
+                if start < lo:
+                    self._count("fetch_head")
+                    fetched.append(fetch(symbol, interval, start, lo - 1))
+                    lo = start
+            if end >= hi:
+                if cov is not None:
+                    self._count("fetch_tail")
+                    fetched.append(fetch(symbol, interval, hi, end))
+                hi = max(hi, min(candle_open_ms(end, interval) + step, closed_hi))
+
+            new = CandleArray.concat(fetched).sorted()
+            n_closed = int(np.searchsorted(new.open_time, closed_hi, side="left"))
+            if n_closed:
+                self.write(symbol, interval, new[:n_closed])
+            self._set_coverage(symbol, interval, lo, hi)
+
+        stored = self.read(symbol, interval, start, min(end, closed_hi - 1))
+        return CandleArray.concat([stored, new[n_closed:]])
@@ -0,0 +1,448 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from candles import INT_COLUMNS, KLINE_COLUMNS, CandleArray
+from config import (
+    KLINE_BASE_INTERVAL,
+    KLINE_STREAM_BUFFER,
+    KLINE_STREAM_ENABLED,
+    KLINE_STREAM_INTERVALS,
+    KLINE_STREAM_STALE_SEC,
+    KLINE_STREAM_SYMBOLS,
+    KLINE_STREAM_URL,
+)
+from data_binance import get_candles, get_klines_history
+from resample import INTERVAL_MS, derive_intervals, required_base_limit
+
+try:
+    import websockets
+except Exception:  # pragma: no cover
+    websockets = None
+
+"""
+K 線 websocket 串流：把訂閱的 (symbol, interval) 最近 N 根 K 線放在記憶體 ring buffer，
+fetch_and_analyze 在 buffer warm 時直接讀，不再每個訊息都打 Binance REST。
+
+- 訊息格式同 Binance combined stream（wss://stream.binance.com:9443/stream?streams=btcusdt@kline_1d）：
+    {"stream": "btcusdt@kline_1d", "data": {"e": "kline", "s": "BTCUSDT", "k": {"t": ..., "o": "...", ...}}}
+  本地 stand-in 只要送一樣格式即可（handle_message 也可以直接餵）
+- 每個 (symbol, interval) 一個 CandleRing（固定大小，NumPy columnar）
+    * 同一根（open_time 相同）→ 覆寫最後一根
+    * 新的一根 → append；跟上一根之間缺 K 線 = gap → 用 REST 補抓
+- 連線建立 / 重連時先用 REST 把 buffer 補齊（空的就 seed，有資料就從最後一根接著抓）
+- REST 補抓會 block（重試、等 weight 額度），丟給單一 repair thread 依序做，
+  event loop 繼續讀訊息 / 回 ping，不會因為補抓太久被斷線
+- 斷線自動重連（full-jitter backoff）
+- warm = 已 seed、沒有待補的 gap（含排隊中的補抓）、連線中且最近 KLINE_STREAM_STALE_SEC 秒內有收到訊息；
+  不 warm 或沒訂閱的 symbol → 回傳 None，呼叫端走 REST
+"""
+
+# Binance kline event 欄位 → KLINE_COLUMNS
+_EVENT_FIELDS = {
+    "open_time": "t",
+    "open": "o",
+    "high": "h",
+    "low": "l",
+    "close": "c",
+    "volume": "v",
+    "close_time": "T",
+    "quote_asset_volume": "q",
+    "number_of_trades": "n",
+    "taker_buy_base_asset_volume": "V",
+    "taker_buy_quote_asset_volume": "Q",
+}
+
+_RECONNECT_BASE_SEC = 1.0
+_RECONNECT_MAX_SEC = 30.0
+_RESYNC_RETRY_SEC = 5.0
+
+StreamKey = Tuple[str, str]
+
+
+def stream_name(symbol: str, interval: str) -> str:
+    return f"{symbol.lower()}@kline_{interval}"
+
+
+class CandleRing:
+    """固定容量的 K 線 ring buffer（依 open_time 排序，最舊的會被擠掉）。"""
+
+    def __init__(self, interval: str, capacity: int):
+        self.interval = interval
+        self.step = INTERVAL_MS[interval]
+        self.capacity = max(1, int(capacity))
+        self._cols = {
+            c: np.zeros(self.capacity, dtype=np.int64 if c in INT_COLUMNS else np.float64)
+            for c in KLINE_COLUMNS
+        }
+        self._start = 0
+        self._len = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _last_idx(self) -> int:
+        return (self._start + self._len - 1) % self.capacity
+
+    def last_open_ms(self) -> Optional[int]:
+        with self._lock:
+            return int(self._cols["open_time"][self._last_idx()]) if self._len else None
+
+    def _append(self, row: Dict[str, Any]) -> None:
+        if self._len < self.capacity:
+            i = (self._start + self._len) % self.capacity
+            self._len += 1
+        else:
+            i = self._start
+            self._start = (self._start + 1) % self.capacity
+        for c in KLINE_COLUMNS:
+            self._cols[c][i] = row[c]
+
+    def upsert(self, row: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+        """寫入一根 K 線；跟上一根之間有缺口時回傳缺的 open_time 範圍 (start_ms, end_ms)。"""
+        t = int(row["open_time"])
+        with self._lock:
+            if self._len == 0:
+                self._append(row)
+                return None
+            last = int(self._cols["open_time"][self._last_idx()])
+            if t == last:
+                i = self._last_idx()
+                for c in KLINE_COLUMNS:
+                    self._cols[c][i] = row[c]
+                return None
+            if t < last:
+                # 過期 / 亂序的訊息
+                return None
+            self._append(row)
+            return (last + self.step, t - 1) if t - last > self.step else None
+
+    def _snapshot_locked(self, n: Optional[int] = None) -> CandleArray:
+        n = self._len if n is None else min(int(n), self._len)
+        idx = (self._start + np.arange(self._len - n, self._len)) % self.capacity
+        return CandleArray(**{c: self._cols[c][idx] for c in KLINE_COLUMNS})
+
+    def snapshot(self, n: Optional[int] = None) -> CandleArray:
+        """最後 n 根（複製出來的唯讀 CandleArray，之後 ring 再更新也不影響）。"""
+        with self._lock:
+            return self._snapshot_locked(n)
+
+    def merge(self, candles: CandleArray) -> None:
+        """把 REST 抓回來的 K 線併進來；同一根以剛抓的 REST 資料為準。"""
+        with self._lock:
+            merged = CandleArray.concat([self._snapshot_locked(), candles]).sorted().tail(self.capacity)
+            self._start = 0
+            self._len = len(merged)
+            for c in KLINE_COLUMNS:
+                self._cols[c][: self._len] = getattr(merged, c)
+
+
+def _parse_event(raw: Any) -> Optional[Tuple[StreamKey, Dict[str, Any]]]:
+    msg = json.loads(raw) if isinstance(raw, (str, bytes, bytearray)) else raw
+    if not isinstance(msg, dict):
+        return None
+    if "data" in msg:
+        msg = msg["data"]
+    if msg.get("e") != "kline" or "k" not in msg:
+        return None
+    k = msg["k"]
+    row = {c: (int if c in INT_COLUMNS else float)(k[f]) for c, f in _EVENT_FIELDS.items()}
+    return (str(k["s"]).upper(), str(k["i"])), row
+
+
+class KlineStreamIngestor:
+    def __init__(
+        self,
+        subscriptions: Iterable[StreamKey],
+        *,
+        capacity: int = KLINE_STREAM_BUFFER,
+        url: str = KLINE_STREAM_URL,
+        stale_sec: float = KLINE_STREAM_STALE_SEC,
+        seed: Callable[[str, str, int], CandleArray] = get_candles,
+        fetch_range: Callable[[str, str, int, int], CandleArray] = get_klines_history,
+    ):
+        self.subscriptions: List[StreamKey] = [(s.upper().strip(), i) for s, i in subscriptions]
+        self.capacity = int(capacity)
+        self.url = url
+        self.stale_ms = int(stale_sec * 1000)
+        self._seed = seed
+        self._fetch_range = fetch_range
+        self._rings: Dict[StreamKey, CandleRing] = {k: CandleRing(k[1], capacity) for k in self.subscriptions}
+        self._lock = threading.Lock()
+        self._synced: Set[StreamKey] = set()
+        self._last_msg_ms: Dict[StreamKey, int] = {}
+        self._last_resync_ms: Dict[StreamKey, int] = {}
+        # 排隊中 / 正在做的 REST 補抓數（> 0 就不算 warm）
+        self._repairs: Dict[StreamKey, int] = {}
+        self._repair_pool: Optional[ThreadPoolExecutor] = None
+        self.connected = False
+        self.stats = {
+            "messages": 0,
+            "ignored": 0,
+            "gaps": 0,
+            "backfills": 0,
+            "backfill_errors": 0,
+            "connects": 0,
+            "disconnects": 0,
+        }
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- buffer access ----
+
+    def is_warm(self, symbol: str, interval: str) -> bool:
+        key = (symbol.upper().strip(), interval)
+        if not self.connected or key not in self._synced or self._repairs.get(key):
+            return False
+        last = self._last_msg_ms.get(key)
+        return last is not None and time.time() * 1000 - last < self.stale_ms
+
+    def get(self, symbol: str, interval: str, limit: int) -> Optional[CandleArray]:
+        """buffer warm 時回傳最後 limit 根；否則 None（呼叫端改走 REST）。"""
+        key = (symbol.upper().strip(), interval)
+        ring = self._rings.get(key)
+        if ring is None or limit > ring.capacity or not self.is_warm(*key):
+            return None
+        return ring.snapshot(limit)
+
+    # ---- message handling ----
+
+    def handle_message(self, raw: Any) -> None:
+        """
+        處理一則串流訊息（str / bytes / 已 parse 的 dict）。
+        需要 REST 補抓時直接在呼叫端的 thread 做完才回來（直接餵資料 / 測試用；串流 loop 走 _ingest）。
+        """
+        job = self._ingest(raw)
+        if job is not None:
+            job()
+
+    def _ingest(self, raw: Any) -> Optional[Callable[[], Any]]:
+        """寫進 ring buffer；要用 REST 補抓時回傳補抓的 job（會 block，不能在 event loop 上跑）。"""
+        self.stats["messages"] += 1
+        parsed = _parse_event(raw)
+        ring = self._rings.get(parsed[0]) if parsed else None
+        if parsed is None or ring is None:
+            self.stats["ignored"] += 1
+            return
+        key, row = parsed
+        now = int(time.time() * 1000)
+        self._last_msg_ms[key] = now
+
+        if key not in self._synced:
+            # 還沒 seed 或上次補抓失敗 → 先寫進 buffer，隔一段時間再試著跟 REST 對齊
+            ring.upsert(row)
+            if not self._repairs.get(key) and now - self._last_resync_ms.get(key, 0) >= _RESYNC_RETRY_SEC * 1000:
+                self._last_resync_ms[key] = now
+                return self._repair_job(key, self.resync, key)
+            return None
+
+        gap = ring.upsert(row)
+        if gap is not None:
+            self.stats["gaps"] += 1
+            print(f"[WARN] Kline stream gap {key}: {gap[0]} ~ {gap[1]}, backfilling from REST")
+            return self._repair_job(key, self._backfill, key, *gap)
+        return None
+
+    def _repair_job(self, key: StreamKey, fn: Callable[..., bool], *args: Any) -> Callable[[], Any]:
+        """包成 job：排隊時就先記一筆，讓 is_warm 在補完之前回 False。"""
+        with self._lock:
+            self._repairs[key] = self._repairs.get(key, 0) + 1
+
+        def job() -> Any:
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._repairs[key] -= 1
+
+        return job
+
+    def _backfill(self, key: StreamKey, start_ms: int, end_ms: int) -> bool:
+        with self._lock:
+            self._synced.discard(key)
+        try:
+            candles = self._fetch_range(key[0], key[1], start_ms, end_ms)
+        except Exception as e:
+            self.stats["backfill_errors"] += 1
+            print(f"[WARN] Kline stream backfill failed {key}:", repr(e))
+            return False
+        self._rings[key].merge(candles)
+        self.stats["backfills"] += 1
+        with self._lock:
+            self._synced.add(key)
+        return True
+
+    def resync(self, key: StreamKey) -> bool:
+        """用 REST 把 buffer 對齊：空的就 seed 整段，有資料就從最後一根接著補。"""
+        self._last_resync_ms[key] = int(time.time() * 1000)
+        ring = self._rings[key]
+        last = ring.last_open_ms()
+        if last is None or len(ring) < ring.capacity // 2:
+            with self._lock:
+                self._synced.discard(key)
+            try:
+                ring.merge(self._seed(key[0], key[1], ring.capacity))
+            except Exception as e:
+                self.stats["backfill_errors"] += 1
+                print(f"[WARN] Kline stream seed failed {key}:", repr(e))
+                return False
+            self.stats["backfills"] += 1
+            with self._lock:
+                self._synced.add(key)
+            return True
+        return self._backfill(key, last, int(time.time() * 1000))
+
+    def resync_all(self) -> None:
+        for key in self.subscriptions:
+            self.resync(key)
+
+    # ---- websocket loop ----
+
+    @property
+    def stream_url(self) -> str:
+        names = "/".join(stream_name(s, i) for s, i in self.subscriptions)
+        return f"{self.url}?streams={names}"
+
+    async def _run(self) -> None:
+        attempt = 0
+        while not self._stop.is_set():
+            try:
+                async with websockets.connect(self.stream_url, ping_interval=20, ping_timeout=20) as ws:
+                    self.connected = True
+                    self.stats["connects"] += 1
+                    attempt = 0
+                    print(f"[INFO] Kline stream connected: {len(self.subscriptions)} streams")
+                    # 斷線期間漏掉的 K 線用 REST 補回來
+                    await asyncio.to_thread(self.resync_all)
+                    async for raw in ws:
+                        job = self._ingest(raw)
+                        if job is not None:
+                            self._repair_pool.submit(job)
+                        if self._stop.is_set():
+                            break
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print("[WARN] Kline stream disconnected:", repr(e))
+            finally:
+                if self.connected:
+                    self.stats["disconnects"] += 1
+                self.connected = False
+
+            if self._stop.is_set():
+                break
+            attempt += 1
+            delay = random.uniform(0, min(_RECONNECT_MAX_SEC, _RECONNECT_BASE_SEC * (2 ** attempt)))
+            await asyncio.sleep(delay)
+
+    def start(self) -> bool:
+        if websockets is None:
+            print("[WARN] Kline stream disabled: `websockets` is not installed")
+            return False
+        if self._thread is not None and self._thread.is_alive():
+            return True
+        self._stop.clear()
+        self._repair_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kline-repair")
+        self._loop = asyncio.new_event_loop()
+        self._task = self._loop.create_task(self._run())
+
+        def run() -> None:
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self._task)
+            finally:
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="kline-stream", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._task is not None and self._thread is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._task.cancel)
+            self._thread.join(timeout)
+        if self._repair_pool is not None:
+            self._repair_pool.shutdown(wait=False, cancel_futures=True)
+        self.connected = False
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            repairs = sum(self._repairs.values())
+        return {
+            "connected": self.connected,
+            "streams": len(self.subscriptions),
+            "warm": sum(self.is_warm(*k) for k in self.subscriptions),
+            "repairs_pending": repairs,
+            **self.stats,
+        }
+
+
+# ----------------------------
+# Module-level ingestor
+# ----------------------------
+
+_stream: Optional[KlineStreamIngestor] = None
+_stream_lock = threading.Lock()
+
+
+def default_subscriptions() -> List[StreamKey]:
+    return [(s, i) for s in KLINE_STREAM_SYMBOLS for i in KLINE_STREAM_INTERVALS]
+
+
+def start_kline_stream(subscriptions: Optional[Iterable[StreamKey]] = None) -> Optional[KlineStreamIngestor]:
+    """KLINE_STREAM_ENABLED 時啟動背景串流（重複呼叫只會有一個）。"""
+    global _stream
+    if not KLINE_STREAM_ENABLED:
+        return None
+    with _stream_lock:
+        if _stream is None:
+            _stream = KlineStreamIngestor(subscriptions or default_subscriptions())
+        if not _stream.start():
+            _stream = None
+    return _stream
+
+
+def stop_kline_stream() -> None:
+    global _stream
+    with _stream_lock:
+        if _stream is not None:
+            _stream.stop()
+            _stream = None
+
+
+def kline_stream_stats() -> Dict[str, Any]:
+    s = _stream
+    return s.metrics() if s is not None else {"connected": False}
+
+
+def stream_klines(symbol: str, intervals: Dict[str, int], base_interval: str = KLINE_BASE_INTERVAL) -> Optional[Dict[str, CandleArray]]:
+    """
+    從串流 buffer 取 K 線（格式同 fetch_klines_resampled / fetch_klines_multi）；
+    沒訂閱或 buffer 還沒 warm → None。
+    """
+    s = _stream
+    if s is None:
+        return None
+    if base_interval:
+        base = s.get(symbol, base_interval, required_base_limit(intervals, base_interval))
+        return None if base is None else derive_intervals(base, intervals, base_interval)
+
+    out: Dict[str, CandleArray] = {}
+    for interval, limit in intervals.items():
+        c = s.get(symbol, interval, limit)
+        if c is None:
+            return None
+        out[interval] = c
+    return out
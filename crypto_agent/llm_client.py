@@ -1,9 +1,17 @@
 from __future__ import annotations
 
+import copy
+import hashlib
 import json
+import math
 import os
 import re
-from typing import Any, Dict, Optional
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
 
 try:
     # openai>=1.0
@@ -12,13 +20,37 @@ except Exception:  # pragma: no cover
     OpenAI = None  # type: ignore
     import openai  # type: ignore
 
+try:
+    import httpx  # type: ignore
+except Exception:  # pragma: no cover
+    httpx = None  # type: ignore
+
+try:
+    # 選用：有裝才用精確的 token 數，沒有就用估算
+    import tiktoken  # type: ignore
+except Exception:  # pragma: no cover
+    tiktoken = None  # type: ignore
+
 from config import (
     LLM_BACKEND,
+    LLM_CACHE_DIR,
+    LLM_CACHE_DISK_MAX_ENTRIES,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_MAX_AGE_SEC,
+    LLM_CACHE_MEM_ENTRIES,
+    LLM_HTTP_CONNECT_TIMEOUT,
+    LLM_HTTP_KEEPALIVE_EXPIRY,
+    LLM_HTTP_MAX_CONNECTIONS,
+    LLM_HTTP_MAX_KEEPALIVE,
+    LLM_HTTP_READ_TIMEOUT,
     OLLAMA_BASE_URL,
+    OLLAMA_MAX_CONCURRENCY,
     OLLAMA_MODEL,
     OPENAI_API_KEY,
+    OPENAI_MAX_CONCURRENCY,
     OPENAI_MODEL,
 )
+from cache_backend import CacheBackend, get_cache_backend
 
 
 def _normalized_backend() -> str:
@@ -50,30 +82,163 @@ def _openai_api_key() -> str:
     return (os.getenv("OPENAI_API_KEY") or OPENAI_API_KEY or "").strip()
 
 
-def _get_client() -> Any:
-    backend = _normalized_backend()
+_BACKEND_LIMITS = {
+    "ollama": OLLAMA_MAX_CONCURRENCY,
+    "openai": OPENAI_MAX_CONCURRENCY,
+}
+_slots: Dict[str, threading.BoundedSemaphore] = {}
+_slots_lock = threading.Lock()
+
+
+def _llm_slot(backend: str) -> threading.BoundedSemaphore:
+    """
+    每個 backend 一個 semaphore，限制同時進行中的 LLM 呼叫數。
+    用法： with _llm_slot(backend): ...
+    """
+    with _slots_lock:
+        sem = _slots.get(backend)
+        if sem is None:
+            sem = _slots[backend] = threading.BoundedSemaphore(max(1, _BACKEND_LIMITS.get(backend, 1)))
+        return sem
+
+
+# ----------------------------
+# Client Registry
+# ----------------------------
+# env 只在第一次用到時解析一次（LLMSettings），每個 backend 的 client 也只建一次，
+# 之後所有 thread 共用同一個 client（openai>=1.0 的 client 是 thread-safe 的），
+# 底下的 httpx 連線池有調過上限與 keep-alive，不用每次呼叫都重新 handshake。
+# 改 env 後要生效：configure_llm_client(...) 或 reset_llm_clients()。
+# ----------------------------
+
+class LLMSettings:
+    __slots__ = ("backend", "model", "api_key", "base_url")
+
+    def __init__(self, backend: str, model: str, api_key: str, base_url: Optional[str]):
+        self.backend = backend
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url
+
+    @classmethod
+    def from_env(cls) -> "LLMSettings":
+        return cls.for_backend(_normalized_backend())
+
+    @classmethod
+    def for_backend(cls, backend: str) -> "LLMSettings":
+        if backend == "openai":
+            return cls("openai", _openai_model(), _openai_api_key(), None)
+        # OpenAI python client requires a non-empty api_key string for header construction.
+        # Ollama ignores it. (docs: "required but ignored")
+        return cls("ollama", _ollama_model(), "ollama", _ollama_v1_base_url())
+
+
+_settings: Optional[LLMSettings] = None
+_clients: Dict[str, Any] = {}
+_http_clients: Dict[str, Any] = {}
+_registry_lock = threading.Lock()
+
+
+def get_llm_settings() -> LLMSettings:
+    global _settings
+    if _settings is not None:
+        return _settings
+    with _registry_lock:
+        if _settings is None:
+            _settings = LLMSettings.from_env()
+    return _settings
+
+
+def _build_http_client() -> Any:
+    if httpx is None:
+        return None
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(LLM_HTTP_READ_TIMEOUT, connect=LLM_HTTP_CONNECT_TIMEOUT),
+    )
 
-    if backend == "openai":
-        api_key = _openai_api_key()
-        if not api_key:
+
+def _build_client(settings: LLMSettings) -> Any:
+    if settings.backend == "openai":
+        if not settings.api_key:
             raise RuntimeError(
                 "LLM_BACKEND=openai 但 OPENAI_API_KEY 是空的。請確認 .env 有被正確載入。"
             )
         if OpenAI is None:
             # legacy openai<1.0
-            openai.api_key = api_key
+            openai.api_key = settings.api_key
             return openai
-        return OpenAI(api_key=api_key)
-
-    # ollama via OpenAI-compat endpoint
-    base_url = _ollama_v1_base_url()
-    # OpenAI python client requires a non-empty api_key string for header construction.
-    # Ollama ignores it. (docs: "required but ignored")
-    if OpenAI is None:
-        openai.api_key = "ollama"
-        openai.api_base = base_url  # type: ignore[attr-defined]
+    elif OpenAI is None:
+        # ollama via OpenAI-compat endpoint (legacy openai<1.0)
+        openai.api_key = settings.api_key
+        openai.api_base = settings.base_url  # type: ignore[attr-defined]
         return openai
-    return OpenAI(api_key="ollama", base_url=base_url)
+
+    http_client = _build_http_client()
+    kwargs: Dict[str, Any] = {"api_key": settings.api_key}
+    if settings.base_url:
+        kwargs["base_url"] = settings.base_url
+    if http_client is not None:
+        kwargs["http_client"] = http_client
+        _http_clients[settings.backend] = http_client
+    return OpenAI(**kwargs)
+
+
+def _get_client() -> Any:
+    settings = get_llm_settings()
+    client = _clients.get(settings.backend)
+    if client is not None:
+        return client
+    with _registry_lock:
+        client = _clients.get(settings.backend)
+        if client is None:
+            client = _clients[settings.backend] = _build_client(settings)
+    return client
+
+
+def reset_llm_clients() -> None:
+    """關掉所有已建立的 client / 連線池，下次呼叫時重新讀 env 並重建。"""
+    global _settings
+    with _registry_lock:
+        for http_client in _http_clients.values():
+            try:
+                http_client.close()
+            except Exception:
+                pass
+        _http_clients.clear()
+        _clients.clear()
+        _settings = None
+
+
+def configure_llm_client(
+    *,
+    backend: Optional[str] = None,
+    model: Optional[str] = None,
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+) -> LLMSettings:
+    """
+    在程式裡覆寫 LLM 設定（沒給的欄位沿用 env），並重建 client。
+    """
+    global _settings
+    b = (backend or _normalized_backend()).strip().lower()
+    if b not in {"ollama", "openai"}:
+        raise ValueError(f"unsupported LLM backend: {b}")
+
+    reset_llm_clients()
+    current = LLMSettings.for_backend(b)
+    with _registry_lock:
+        _settings = LLMSettings(
+            backend=b,
+            model=model or current.model,
+            api_key=api_key or current.api_key,
+            base_url=base_url if base_url is not None else current.base_url,
+        )
+    return _settings
 
 
 def _extract_json(text: str) -> Dict[str, Any]:
@@ -108,70 +273,412 @@ def _extract_json(text: str) -> Dict[str, Any]:
     return {"ok": False, "error": "Failed to parse JSON", "raw": text[:2000]}
 
 
-def chat_text(prompt: str, *, temperature: float = 0.2) -> str:
-    backend = _normalized_backend()
-    client = _get_client()
+# ----------------------------
+# Response Cache (opt-in)
+# ----------------------------
+# key = sha256(kind, backend, model, temperature, prompt)
+# - 記憶體 LRU（LLM_CACHE_MEM_ENTRIES）+ 硬碟（LLM_CACHE_DIR，一個 key 一個 json 檔）
+# - SHARED_CACHE_BACKEND=sqlite 時第二層改用共用的 cache backend，並用它的 lock 讓
+#   多個 worker 問同一個 prompt 時只有一個真的去打 LLM
+# - 超過 LLM_CACHE_MAX_AGE_SEC 視為過期；硬碟超過 LLM_CACHE_DISK_MAX_ENTRIES 時刪最舊的
+# - 只快取 temperature == 0 的呼叫（同一個 prompt 結果才有意義可重用）
+# ----------------------------
+
+class ResponseCache:
+    def __init__(
+        self,
+        *,
+        mem_entries: int = LLM_CACHE_MEM_ENTRIES,
+        disk_dir: str = LLM_CACHE_DIR,
+        disk_max_entries: int = LLM_CACHE_DISK_MAX_ENTRIES,
+        max_age_sec: float = LLM_CACHE_MAX_AGE_SEC,
+        shared_backend: Optional[Callable[[], CacheBackend]] = get_cache_backend,
+    ):
+        self.mem_entries = mem_entries
+        self._shared_backend = shared_backend
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self.max_age_sec = max_age_sec
+        self._mem: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts_since_prune = 0
+        self.stats = {"hit_mem": 0, "hit_disk": 0, "miss": 0, "put": 0, "evict": 0}
+
+    @staticmethod
+    def make_key(kind: str, backend: str, model: str, temperature: float, prompt: str) -> str:
+        raw = json.dumps([kind, backend, model, float(temperature), prompt], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _shared(self) -> Optional[CacheBackend]:
+        """跨 worker 共用的 backend（InProcessCache 不算，記憶體那層已經有 LRU 了）。"""
+        if self._shared_backend is None:
+            return None
+        backend = self._shared_backend()
+        return backend if backend.shared else None
+
+    @contextmanager
+    def compute_lock(self, key: Optional[str]) -> Iterator[bool]:
+        """共用 backend 時跨 worker 鎖住同一個 key；yield 是否真的有拿到 lock。"""
+        shared = self._shared() if key is not None else None
+        if shared is None:
+            yield False
+            return
+        with shared.lock("llm", key) as acquired:
+            yield acquired
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _expired(self, created_at: float) -> bool:
+        return self.max_age_sec > 0 and time.time() - created_at > self.max_age_sec
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                if not self._expired(item[0]):
+                    self._mem.move_to_end(key)
+                    self.stats["hit_mem"] += 1
+                    return item[1]
+                del self._mem[key]
+                self.stats["evict"] += 1
+
+        shared = self._shared()
+        if shared is not None:
+            item = shared.get("llm", key)
+            if item is not None and not self._expired(item[0]):
+                self._remember(key, item[0], item[1])
+                with self._lock:
+                    self.stats["hit_disk"] += 1
+                return item[1]
+        elif self.disk_dir:
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    obj = json.load(f)
+                if not self._expired(obj["created_at"]):
+                    self._remember(key, obj["created_at"], obj["value"])
+                    with self._lock:
+                        self.stats["hit_disk"] += 1
+                    return obj["value"]
+                os.remove(path)
+                with self._lock:
+                    self.stats["evict"] += 1
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print("[WARN] LLM cache read failed:", repr(e))
+
+        with self._lock:
+            self.stats["miss"] += 1
+        return None
+
+    def _remember(self, key: str, created_at: float, value: Any) -> None:
+        with self._lock:
+            self._mem[key] = (created_at, value)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.mem_entries:
+                self._mem.popitem(last=False)
+                self.stats["evict"] += 1
+
+    def put(self, key: str, value: Any) -> None:
+        now = time.time()
+        self._remember(key, now, value)
+        with self._lock:
+            self.stats["put"] += 1
+            self._puts_since_prune += 1
+            prune = self._puts_since_prune >= 50
+            if prune:
+                self._puts_since_prune = 0
+
+        shared = self._shared()
+        if shared is not None:
+            shared.put("llm", key, (now, value), ttl_sec=self.max_age_sec or None)
+            return
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"created_at": now, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp, path)  # atomic，避免讀到寫一半的檔案
+        except Exception as e:
+            print("[WARN] LLM cache write failed:", repr(e))
+            return
+
+        if prune:
+            self.prune_disk()
+
+    def prune_disk(self) -> None:
+        """刪掉過期的檔案，並把數量壓回 disk_max_entries（先刪最舊的）。"""
+        if not self.disk_dir or not os.path.isdir(self.disk_dir):
+            return
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for n in names:
+                if n.endswith(".json"):
+                    p = os.path.join(root, n)
+                    try:
+                        files.append((os.path.getmtime(p), p))
+                    except OSError:
+                        pass
+        files.sort()
+        over = max(0, len(files) - self.disk_max_entries)
+        removed = 0
+        for i, (mtime, p) in enumerate(files):
+            if i < over or self._expired(mtime):
+                try:
+                    os.remove(p)
+                    removed += 1
+                except OSError:
+                    pass
+        with self._lock:
+            self.stats["evict"] += removed
+
+    def stats_snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            s = dict(self.stats)
+            s["mem_size"] = len(self._mem)
+        return s
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+        shared = self._shared()
+        if shared is not None:
+            shared.clear("llm")
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            shutil.rmtree(self.disk_dir, ignore_errors=True)
+
+
+_response_cache = ResponseCache()
+
+
+def llm_cache_stats() -> Dict[str, int]:
+    return _response_cache.stats_snapshot()
+
+
+def clear_llm_cache() -> None:
+    _response_cache.clear()
+
+
+_CJK_RE = re.compile(r"[\u3000-\u30ff\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_token_encoder: Any = None
+_token_encoder_lock = threading.Lock()
+
+
+def _get_token_encoder() -> Any:
+    global _token_encoder
+    if tiktoken is None:
+        return None
+    if _token_encoder is None:
+        with _token_encoder_lock:
+            if _token_encoder is None:
+                try:
+                    _token_encoder = tiktoken.encoding_for_model(_openai_model())
+                except Exception:
+                    _token_encoder = tiktoken.get_encoding("o200k_base")
+    return _token_encoder
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    prompt 的 token 數：有 tiktoken 就用 OpenAI 的 tokenizer 算；
+    否則估算（中日文每字約 1 token，其餘約 4 字元 1 token）。Ollama 模型的 tokenizer 不同，只當量級參考。
+    """
+    if not text:
+        return 0
+    enc = _get_token_encoder()
+    if enc is not None:
+        return len(enc.encode(text))
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
 
-    model = _openai_model() if backend == "openai" else _ollama_model()
 
-    if OpenAI is None:
-        # legacy openai<1.0
-        resp = client.ChatCompletion.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=temperature,
-        )
-        return resp["choices"][0]["message"]["content"]  # type: ignore[index]
+def _kind(kind: str, max_tokens: Optional[int]) -> str:
+    # 輸出上限不同，回應可能被截斷在不同位置 → 快取要分開
+    return f"{kind}:max{int(max_tokens)}" if max_tokens else kind
 
-    resp = client.chat.completions.create(
-        model=model,
-        messages=[{"role": "user", "content": prompt}],
-        temperature=temperature,
-    )
-    return (resp.choices[0].message.content or "").strip()
 
+def _cache_key(kind: str, backend: str, model: str, temperature: float, prompt: str) -> Optional[str]:
+    if not LLM_CACHE_ENABLED or temperature != 0:
+        return None
+    return ResponseCache.make_key(kind, backend, model, temperature, prompt)
 
-def chat_json(prompt: str, *, temperature: float = 0.2) -> Dict[str, Any]:
-    """
-    Ask the model to return a JSON object. We'll parse it defensively.
-    """
-    backend = _normalized_backend()
-    client = _get_client()
 
-    model = _openai_model() if backend == "openai" else _ollama_model()
+# ---- 輸出 token 統計（/metrics 與 Langfuse generation metadata 用） ----
 
-    json_prompt = (
-        "請你只輸出「單一 JSON object」，不要額外文字、不要 markdown。\n"
-        "如果資料不足，請用 ok=false 並說明 missing 欄位。\n\n"
-        f"{prompt}"
-    )
+_usage_lock = threading.Lock()
+_usage_stats: Dict[str, Dict[str, int]] = {}
+_last_usage = threading.local()
 
-    if OpenAI is None:
-        resp = client.ChatCompletion.create(
-            model=model,
-            messages=[{"role": "user", "content": json_prompt}],
-            temperature=temperature,
-        )
-        content = resp["choices"][0]["message"]["content"]  # type: ignore[index]
-        return _extract_json(content)
 
-    # OpenAI supports response_format json_object (Ollama docs say supported too),
-    # but for maximum compatibility we still do a defensive parse.
-    try:
-        resp = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": json_prompt}],
-            temperature=temperature,
-            response_format={"type": "json_object"} if backend == "openai" else None,
-        )
-        content = (resp.choices[0].message.content or "").strip()
-        return _extract_json(content)
-    except TypeError:
-        # Some backends may not accept response_format
-        resp = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": json_prompt}],
-            temperature=temperature,
+def _record_usage(kind: str, usage: Dict[str, Any]) -> None:
+    _last_usage.value = usage
+    with _usage_lock:
+        st = _usage_stats.setdefault(
+            kind, {"calls": 0, "cached": 0, "prompt_tokens": 0, "completion_tokens": 0, "max_completion_tokens": 0, "truncated": 0}
         )
+        if usage.get("cached"):
+            st["cached"] += 1
+            return
+        st["calls"] += 1
+        st["prompt_tokens"] += int(usage.get("prompt_tokens") or 0)
+        completion = int(usage.get("completion_tokens") or 0)
+        st["completion_tokens"] += completion
+        st["max_completion_tokens"] = max(st["max_completion_tokens"], completion)
+        if usage.get("finish_reason") == "length":
+            st["truncated"] += 1
+
+
+def last_llm_usage() -> Dict[str, Any]:
+    """這個 thread 上一次 chat_text / chat_json 的 token 用量（給呼叫端寫進 trace）。"""
+    return dict(getattr(_last_usage, "value", None) or {})
+
+
+def llm_usage_stats() -> Dict[str, Dict[str, Any]]:
+    with _usage_lock:
+        out: Dict[str, Dict[str, Any]] = {}
+        for kind, st in _usage_stats.items():
+            calls = st["calls"]
+            out[kind] = {**st, "avg_completion_tokens": round(st["completion_tokens"] / calls, 1) if calls else None}
+        return out
+
+
+def _usage_of(resp: Any, content: str) -> Dict[str, Any]:
+    """OpenAI / Ollama（OpenAI-compat）都會回 usage；沒有的話用 estimate_tokens 估算。"""
+    usage = getattr(resp, "usage", None)
+    if usage is None and isinstance(resp, dict):
+        usage = resp.get("usage")
+    get = (lambda k: usage.get(k)) if isinstance(usage, dict) else (lambda k: getattr(usage, k, None))
+    choice = resp["choices"][0] if isinstance(resp, dict) else resp.choices[0]
+    finish = choice.get("finish_reason") if isinstance(choice, dict) else getattr(choice, "finish_reason", None)
+    completion = get("completion_tokens") if usage is not None else None
+    return {
+        "prompt_tokens": get("prompt_tokens") if usage is not None else None,
+        "completion_tokens": completion if completion is not None else estimate_tokens(content),
+        "estimated": completion is None,
+        "finish_reason": finish,
+    }
+
+
+def _complete(
+    backend: str,
+    model: str,
+    prompt: str,
+    temperature: float,
+    json_mode: bool = False,
+    max_tokens: Optional[int] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """回傳 (content, usage)。max_tokens：輸出上限（Ollama 的 OpenAI-compat API 會轉成 num_predict）。"""
+    client = _get_client()
+    limit: Dict[str, Any] = {"max_tokens": int(max_tokens)} if max_tokens else {}
+    with _llm_slot(backend):
+        if OpenAI is None:
+            # legacy openai<1.0
+            resp = client.ChatCompletion.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=temperature,
+                **limit,
+            )
+            content = resp["choices"][0]["message"]["content"]  # type: ignore[index]
+            return content, _usage_of(resp, content)
+
+        if json_mode:
+            # OpenAI supports response_format json_object (Ollama docs say supported too),
+            # but for maximum compatibility we still do a defensive parse.
+            try:
+                resp = client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=temperature,
+                    response_format={"type": "json_object"} if backend == "openai" else None,
+                    **limit,
+                )
+            except TypeError:
+                # Some backends may not accept response_format
+                resp = client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=temperature,
+                    **limit,
+                )
+        else:
+            resp = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=temperature,
+                **limit,
+            )
         content = (resp.choices[0].message.content or "").strip()
-        return _extract_json(content)
+        return content, _usage_of(resp, content)
+
+
+def chat_text(prompt: str, *, temperature: float = 0.2, max_tokens: Optional[int] = None) -> str:
+    settings = get_llm_settings()
+    backend, model = settings.backend, settings.model
+
+    key = _cache_key(_kind("text", max_tokens), backend, model, temperature, prompt)
+    if key is not None:
+        cached = _response_cache.get(key)
+        if cached is not None:
+            _record_usage("text", {"cached": True})
+            return cached
+
+    with _response_cache.compute_lock(key) as locked:
+        if locked:
+            # 等 lock 的期間，別的 worker 可能已經問過同一個 prompt
+            cached = _response_cache.get(key)
+            if cached is not None:
+                _record_usage("text", {"cached": True})
+                return cached
+
+        content, usage = _complete(backend, model, prompt, temperature, max_tokens=max_tokens)
+        _record_usage("text", usage)
+        if key is not None and content:
+            _response_cache.put(key, content)
+    return content
+
+
+# chat_json 固定加在 prompt 最前面（每次都一樣，不影響 prefix cache）
+JSON_PROMPT_PREFIX = (
+    "請你只輸出「單一 JSON object」，不要額外文字、不要 markdown。\n"
+    "如果資料不足，請用 ok=false 並在 summary 說明缺少什麼。\n\n"
+)
+
+
+def chat_json(prompt: str, *, temperature: float = 0.2, max_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Ask the model to return a JSON object. We'll parse it defensively.
+    max_tokens：輸出上限；被截斷的 JSON 解析不了，會回 {"raw": ...}，呼叫端要處理。
+    """
+    settings = get_llm_settings()
+    backend, model = settings.backend, settings.model
+
+    key = _cache_key(_kind("json", max_tokens), backend, model, temperature, prompt)
+    if key is not None:
+        cached = _response_cache.get(key)
+        if cached is not None:
+            _record_usage("json", {"cached": True})
+            # 回傳副本，避免呼叫端改到快取裡的 dict
+            return copy.deepcopy(cached)
+
+    json_prompt = JSON_PROMPT_PREFIX + prompt
+
+    with _response_cache.compute_lock(key) as locked:
+        if locked:
+            cached = _response_cache.get(key)
+            if cached is not None:
+                _record_usage("json", {"cached": True})
+                return copy.deepcopy(cached)
+
+        content, usage = _complete(backend, model, json_prompt, temperature, json_mode=True, max_tokens=max_tokens)
+        _record_usage("json", usage)
+        result = _extract_json(content)
+        # 解析失敗的結果不要快取，下次重問還有機會成功
+        if key is not None and "raw" not in result:
+            _response_cache.put(key, result)
+    return result
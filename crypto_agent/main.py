@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import os
 import re
 
@@ -12,7 +13,15 @@ from dotenv import find_dotenv, load_dotenv
 load_dotenv(find_dotenv(usecwd=True))
 
 # load_dotenv 再 import 任何會讀 config 的東西
-from graph_crypto_agent import run_with_graph
+from config import ANALYSIS_QUEUE_MAX, ANALYSIS_WORKERS
+from graph_crypto_agent import analysis_flight_stats, get_graph, market_analyst_stats, run_with_graph
+from cache_backend import cache_backend_stats
+from data_binance import binance_host_stats, binance_weight_stats
+from llm_client import llm_usage_stats
+from kline_stream import kline_stream_stats, start_kline_stream, stop_kline_stream
+from precompute import format_precomputed, get_precomputed, precompute_stats, start_precompute, stop_precompute
+from symbol_index import resolve_symbol, start_symbol_index, stop_symbol_index, symbol_index_stats
+from worker_pool import AnalysisWorkerPool
 
 import certifi
 
@@ -25,6 +34,9 @@ print("[INFO] SSL_CERT_FILE =", os.getenv("SSL_CERT_FILE"))
 
 load_dotenv()
 
+# 啟動時先 compile LangGraph，之後每個請求直接重用
+get_graph()
+
 app = FastAPI()
 
 TRIGGER_PREFIXES = ("!", "！", "@", "？", "?")
@@ -59,52 +71,15 @@ def _has_common_token(text: str) -> bool:
     up = (text or "").upper()
     return any(re.search(rf"\b{tok}\b", up) for tok in COMMON_TOKENS)
 
-def _extract_symbol(text: str) -> str | None:
+def _extract_symbol(text: str) -> tuple[str | None, str | None]:
     """
-    從文字中抓幣種，回傳例如 'BTCUSDT'。
-    抓不到就回傳 None（不要硬預設，避免使用者聊別的也噴BTC分析）。
+    從文字中抓幣種 → (symbol, rejected)，symbol 例如 'BTCUSDT'。
+    幣種先在本地交易對索引驗證（含中文別名），不存在的不會送進 graph / Binance。
+    抓不到 symbol 就是 None（不要硬預設，避免使用者聊別的也噴BTC分析）；
+    rejected = 使用者打了像代號但幣安上沒有的 token（例如 "XYZ"）。
     """
     print(f"[DEBUG] _extract_symbol input: {text}")
-    t = (text or "").strip()
-
-    # 1) 先處理中文別名（可以再擴充）
-    zh_map = {
-        "比特幣": "BTC",
-        "大餅": "BTC",
-        "以太幣": "ETH",
-        "以太坊": "ETH",
-        "以太": "ETH",
-        "二餅": "ETH",
-        "狗狗幣": "DOGE",
-        "狗幣": "DOGE",
-        "柴犬幣": "SHIB",
-        "柴幣": "SHIB",
-        "幣安幣": "BNB",
-        "幣安": "BNB",
-        "艾達幣": "ADA",
-        "艾達": "ADA",
-    }
-    for k, v in zh_map.items():
-        if k in t:
-            return f"{v}USDT"
-
-    # 2) 英文代號
-    m = re.search(r"(?i)(?<![A-Za-z])([A-Za-z]{2,15})(?:USDT)?(?![A-Za-z])", t)
-    if not m:
-        return None
-
-    token = m.group(1).upper()
-
-    # 避免抓到非幣種單字
-    blacklist = {"USDT", "AI", "AGENT", "BUY", "SELL", "HOLD"}
-    if token in blacklist:
-        return None
-
-    # 如果使用者自己就打了 BTCUSDT 這種 pair，就直接用
-    if token.endswith("USDT"):
-        return token
-
-    return f"{token}USDT"
+    return resolve_symbol(text)
 
 
 def _looks_like_invest_question(text: str) -> bool:
@@ -149,6 +124,57 @@ LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN", "").strip()
 LINE_ENABLED = bool(LINE_CHANNEL_SECRET) and bool(LINE_CHANNEL_ACCESS_TOKEN)
 print(f"[INFO] LINE Bot integration enabled: {LINE_ENABLED}")
 
+# ---- 背景 worker pool（graph 分析不在 event loop 上跑） ----
+analysis_pool = AnalysisWorkerPool(max_workers=ANALYSIS_WORKERS, max_queue=ANALYSIS_QUEUE_MAX)
+
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "analysis_pool": analysis_pool.metrics(),
+        "analysis_singleflight": analysis_flight_stats(),
+        "market_analysts": market_analyst_stats(),
+        "llm_usage": llm_usage_stats(),
+        "kline_stream": kline_stream_stats(),
+        "shared_cache": cache_backend_stats(),
+        "binance_weight": binance_weight_stats(),
+        "binance_hosts": binance_host_stats(),
+        "symbol_index": symbol_index_stats(),
+        "precompute": precompute_stats(),
+    }
+
+
+@app.on_event("startup")
+def _start_symbol_index():
+    # 先載入交易對 snapshot，背景定期用 exchangeInfo 刷新
+    start_symbol_index()
+
+
+@app.on_event("startup")
+def _start_kline_stream():
+    # 背景訂閱 K 線串流；warm 之後 fetch_and_analyze 直接讀記憶體 buffer
+    start_kline_stream()
+
+
+@app.on_event("startup")
+def _start_precompute():
+    # watchlist × intents 在 K 線收盤 / 大波動後預先跑好，熱門問題直接回存好的結果
+    start_precompute()
+
+
+@app.on_event("shutdown")
+def _shutdown_pool():
+    stop_precompute()
+    stop_kline_stream()
+    stop_symbol_index()
+    analysis_pool.shutdown(wait=False)
+
+
+BUSY_REPLY = "目前詢問的人太多了，請稍後再問我一次 🙏"
+ERROR_REPLY = "分析時發生錯誤，請稍後再試一次。"
+UNKNOWN_SYMBOL_REPLY = "幣安上找不到 {token} 的交易對，請確認幣種代號（例如 BTC、ETH）。"
+
+
 if LINE_ENABLED:
     # line-bot-sdk v3
     from linebot.v3.webhook import WebhookParser
@@ -156,6 +182,7 @@ if LINE_ENABLED:
         ApiClient,
         Configuration,
         MessagingApi,
+        PushMessageRequest,
         ReplyMessageRequest,
         TextMessage,
     )
@@ -164,6 +191,112 @@ if LINE_ENABLED:
     configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
     parser = WebhookParser(LINE_CHANNEL_SECRET)
 
+    def _push_target(event) -> str | None:
+        """reply token 過期時改用 push API，回到原本的群組 / 聊天室 / 使用者。"""
+        src = getattr(event, "source", None)
+        for attr in ("group_id", "room_id", "user_id"):
+            v = getattr(src, attr, None)
+            if v:
+                return v
+        return None
+
+    def _send_text(reply_token: str, push_to: str | None, text: str) -> None:
+        with ApiClient(configuration) as api_client:
+            line_bot_api = MessagingApi(api_client)
+            try:
+                line_bot_api.reply_message(
+                    ReplyMessageRequest(
+                        reply_token=reply_token,
+                        messages=[TextMessage(text=text)],
+                    )
+                )
+                return
+            except Exception as e:
+                # 分析太久 reply token 可能已失效 → 改用 push
+                if not push_to:
+                    raise
+                print("[WARN] LINE reply failed, fallback to push:", repr(e))
+
+            line_bot_api.push_message(
+                PushMessageRequest(to=push_to, messages=[TextMessage(text=text)])
+            )
+
+    def _analyze_and_reply(reply_token: str, push_to: str | None, symbol: str, query: str) -> None:
+        """在 worker thread 裡跑：graph 分析 → reply（失敗則 push）。"""
+        try:
+            reply_text = run_with_graph(symbol, user_text=query)
+        except Exception as e:
+            print(f"[ERROR] run_with_graph failed for {symbol}:", repr(e))
+            reply_text = ERROR_REPLY
+        _send_text(reply_token, push_to, reply_text)
+
+    def _dispatch_event(event) -> None:
+        """
+        解析單一事件：
+        - 說明文字這類即時回覆直接送出
+        - 需要跑 graph 的丟進 analysis_pool，滿了就回忙碌訊息
+        """
+        text = (event.message.text or "").strip()
+        if not text:
+            return
+        print(f"[INFO] Received LINE message: {text}")
+        triggered, query = _strip_trigger(text)
+        print(f"[INFO] Triggered: {triggered}, Query: {query}")
+        # 沒有前綴：直接忽略，不回覆（避免干擾）
+        if not triggered:
+            return
+
+        reply_token = event.reply_token
+        push_to = _push_target(event)
+
+        # 有前綴但沒內容：回使用說明
+        if not query:
+            _send_text(
+                reply_token,
+                push_to,
+                "請用 ! 或 @ 開頭再問我，例如：\n"
+                "!BTC投資建議\n"
+                "!我想抄底 BTC\n"
+                "@我重倉 BTC 怕回撤\n"
+                "!BTC 想賣出 要不要先減倉\n"
+                "!ETH 做多可以嗎\n",
+            )
+            return
+
+        symbol, rejected = _extract_symbol(query)
+        print(f"[INFO] 抓到的幣種: {symbol}")
+
+        if symbol is None and rejected:
+            # 打了代號但幣安上沒有這個交易對：直接回覆，不打 Binance / LLM
+            _send_text(reply_token, push_to, UNKNOWN_SYMBOL_REPLY.format(token=rejected))
+            return
+
+        if symbol is None:
+            # 抓不到幣種：如果看起來在問投資，就先用 BTCUSDT；否則給引導
+            if not _looks_like_invest_question(query):
+                _send_text(
+                    reply_token,
+                    push_to,
+                    "我目前主要提供加密貨幣投資判斷。\n"
+                    "請在訊息中帶幣種，例如：\n"
+                    "!BTC投資建議\n"
+                    "!我想抄底 BTC\n"
+                    "@我重倉 BTC 怕回撤\n"
+                    "!BTC 想賣出 要不要先減倉\n"
+                    "!ETH 做多可以嗎\n",
+                )
+                return
+            symbol = "BTCUSDT"
+
+        # 有預先計算好的結果：直接回覆，不進 analysis_pool
+        report = get_precomputed(symbol, query)
+        if report is not None:
+            _send_text(reply_token, push_to, format_precomputed(report))
+            return
+
+        if not analysis_pool.submit(_analyze_and_reply, reply_token, push_to, symbol, query):
+            _send_text(reply_token, push_to, BUSY_REPLY)
+
     @app.post("/line/callback")
     async def line_callback(request: Request):
         signature = request.headers.get("X-Line-Signature", "")
@@ -175,78 +308,17 @@ if LINE_ENABLED:
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid signature")
 
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-
-            for event in events:
-                if not isinstance(event, MessageEvent):
-                    continue
-                if not isinstance(event.message, TextMessageContent):
-                    continue
-
-                text = (event.message.text or "").strip()
-                if not text:
-                    continue
-                print(f"[INFO] Received LINE message: {text}")
-                triggered, query = _strip_trigger(text)
-                print(f"[INFO] Triggered: {triggered}, Query: {query}")
-                # 沒有前綴：直接忽略，不回覆（避免干擾）
-                if not triggered:
-                    continue
-
-                # 有前綴但沒內容：回使用說明
-                if not query:
-                    reply_text = (
-                        "請用 ! 或 @ 開頭再問我，例如：\n"
-                        "!BTC投資建議\n"
-                        "!我想抄底 BTC\n"
-                        "@我重倉 BTC 怕回撤\n"
-                        "!BTC 想賣出 要不要先減倉\n"
-                        "!ETH 做多可以嗎\n"
-                    )
-                else:
-                    # 有前綴但不像幣圈問題：回使用說明（避免亂觸發 LLM）
-                    # if (not _is_crypto_question(query)) and (not _has_common_token(query)):
-                    #     reply_text = (
-                    #         "我只處理幣圈投資問題，請用例如：\n"
-                    #         "!BTC投資建議\n"
-                    #         "!我想抄底 BTC\n"
-                    #         "@我重倉 BTC 怕回撤\n"
-                    #         "!BTC 想賣出 要不要先減倉\n"
-                    #         "!ETH 做多可以嗎\n"
-                    #     )
-                    # else:
-                    #     symbol = _extract_symbol(query)
-                    #     reply_text = run_with_graph(symbol, user_text=query)
-                    
-                    symbol = _extract_symbol(query)
-                    print(f"[INFO] 抓到的幣種: {symbol}")
-                    # continue # for debug
-
-                    if symbol is None:
-                        # 抓不到幣種：如果看起來在問投資，就先用 BTCUSDT；否則給引導
-                        if _looks_like_invest_question(query):
-                            symbol = "BTCUSDT"
-                            reply_text = run_with_graph(symbol, user_text=query)
-                        else:
-                            reply_text = (
-                                "我目前主要提供加密貨幣投資判斷。\n"
-                                "請在訊息中帶幣種，例如：\n"
-                                "!BTC投資建議\n"
-                                "!我想抄底 BTC\n"
-                                "@我重倉 BTC 怕回撤\n"
-                                "!BTC 想賣出 要不要先減倉\n"
-                                "!ETH 做多可以嗎\n"
-                            )
-                    else:
-                        reply_text = run_with_graph(symbol, user_text=query)
-
-                line_bot_api.reply_message(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text=reply_text)],
-                    )
-                )
+        for event in events:
+            if not isinstance(event, MessageEvent):
+                continue
+            if not isinstance(event.message, TextMessageContent):
+                continue
+            # 即時回覆也是同步 HTTP 呼叫 → 丟到 thread，event loop 只負責 ack
+            try:
+                await asyncio.to_thread(_dispatch_event, event)
+            except Exception as e:
+                # 單一事件失敗只記 log：整批回 500 會讓 LINE 重送，前面已回過的事件會被回兩次
+                print("[ERROR] LINE event dispatch failed:", repr(e))
 
         return "OK"
 
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import datetime as dt
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from cache_backend import CacheBackend, get_cache_backend
+from config import (
+    PRECOMPUTE_CHECK_SEC,
+    PRECOMPUTE_CONCURRENCY,
+    PRECOMPUTE_DELAY_SEC,
+    PRECOMPUTE_ENABLED,
+    PRECOMPUTE_INTENTS,
+    PRECOMPUTE_INTERVAL,
+    PRECOMPUTE_MAX_AGE_SEC,
+    PRECOMPUTE_MOVE_PCT,
+    PRECOMPUTE_SYMBOLS,
+)
+from data_binance import get_candles
+from graph_crypto_agent import INTENT_LABELS, _parse_intent, run_analysis
+from resample import INTERVAL_MS, candle_open_ms
+
+"""
+預先計算：熱門交易對的答案只有在 K 線收盤（或盤中大波動）時才會變，
+所以由背景 scheduler 先把 watchlist × intents 的完整 graph 跑好存起來，
+LINE 收到訊息時直接回存好的結果（毫秒級），不進 analysis_pool、不打 Binance / LLM。
+
+- 觸發時機
+    * startup     ：啟動時，這根 K 線還沒有結果的先算
+    * candle_close：每個 PRECOMPUTE_INTERVAL 收盤後 PRECOMPUTE_DELAY_SEC 秒
+    * move        ：每 PRECOMPUTE_CHECK_SEC 秒看一次價格，相對上次計算時變動 >= PRECOMPUTE_MOVE_PCT %
+- 結果存在 cache backend（ns "precomputed"，key "SYMBOL:intent"），帶 freshness metadata：
+  epoch（哪根 K 線）、started_at / computed_at、trigger、計算時的價格
+- 同時最多 PRECOMPUTE_CONCURRENCY 個 graph 在跑；同一個 key 排隊中就不重複排
+- SHARED_CACHE_BACKEND=sqlite 時多個 worker 各自有 scheduler，但同一個 key 用 lock 排隊，
+  別的 worker 已經算過（started_at 在觸發時間之後）就跳過，不會重複花 LLM
+- get_precomputed()：同一根 K 線內、且沒超過 PRECOMPUTE_MAX_AGE_SEC 才算新鮮
+"""
+
+_NS = "precomputed"
+
+# 每個 intent 用一句會被 _parse_intent 判成同一個 intent 的問題去跑 graph
+INTENT_QUERIES: Dict[str, str] = {
+    "general_advice": "{symbol} 投資建議",
+    "bottom_fishing": "{symbol} 我想抄底",
+    "risk_averse": "{symbol} 怕回撤",
+    "take_profit": "{symbol} 想賣出",
+    "heavy_position": "{symbol} 想加倉",
+}
+
+TRIGGER_LABELS = {
+    "startup": "啟動時預先分析",
+    "candle_close": "K 線收盤後預先分析",
+    "move": "價格大幅波動後重新分析",
+}
+
+
+def _last_price(symbol: str, interval: str) -> Optional[float]:
+    """未收盤那根的 close（走 KlineCache，最多每 KLINE_OPEN_TAIL_REFRESH_SEC 秒打一次 Binance）。"""
+    candles = get_candles(symbol, interval, 1)
+    return float(candles.close[-1]) if len(candles) else None
+
+
+def format_precomputed(report: Dict[str, Any]) -> str:
+    """存好的分析 + 分析時間（讓使用者知道這不是剛剛才算的）。"""
+    at = dt.datetime.fromtimestamp(report["computed_at"]).strftime("%m/%d %H:%M")
+    label = TRIGGER_LABELS.get(report.get("trigger", ""), "預先分析")
+    return f"{report['message']}\n\n⏱ {label}｜{at}"
+
+
+class PrecomputeScheduler:
+    def __init__(
+        self,
+        symbols: List[str],
+        intents: List[str],
+        interval: str = PRECOMPUTE_INTERVAL,
+        concurrency: int = PRECOMPUTE_CONCURRENCY,
+        delay_sec: float = PRECOMPUTE_DELAY_SEC,
+        move_pct: float = PRECOMPUTE_MOVE_PCT,
+        check_sec: float = PRECOMPUTE_CHECK_SEC,
+        max_age_sec: float = PRECOMPUTE_MAX_AGE_SEC,
+        backend: Optional[CacheBackend] = None,
+    ):
+        if interval not in INTERVAL_MS:
+            raise ValueError(f"unsupported PRECOMPUTE_INTERVAL: {interval}")
+        self.symbols = [s.upper() for s in symbols]
+        self.intents = [i for i in intents if i in INTENT_QUERIES]
+        self.interval = interval
+        self.step_sec = INTERVAL_MS[interval] / 1000
+        self.delay_sec = delay_sec
+        self.move_pct = move_pct
+        self.check_sec = max(1.0, check_sec)
+        self.max_age_sec = max_age_sec
+        self._backend = backend
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="precompute")
+        self._lock = threading.Lock()
+        self._pending: Set[Tuple[str, str]] = set()
+        self._ref_price: Dict[str, float] = {}
+        self._halt = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {
+            "scheduled": 0, "computed": 0, "skipped": 0, "failed": 0,
+            "hit": 0, "miss": 0, "stale": 0, "moves": 0,
+        }
+        self.last_trigger: Dict[str, Any] = {}
+
+    @property
+    def backend(self) -> CacheBackend:
+        return self._backend or get_cache_backend()
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += n
+
+    def _epoch_ms(self, now: Optional[float] = None) -> int:
+        return candle_open_ms(int((time.time() if now is None else now) * 1000), self.interval)
+
+    # ---- lookup（LINE 訊息路徑） ----
+
+    def get(self, symbol: str, intent: str) -> Optional[Dict[str, Any]]:
+        symbol = symbol.upper()
+        if symbol not in self.symbols or intent not in self.intents:
+            return None
+        report = self.backend.get(_NS, f"{symbol}:{intent}")
+        if report is None:
+            self._count("miss")
+            return None
+        now = time.time()
+        if report["epoch"] != self._epoch_ms(now) or (
+            self.max_age_sec > 0 and now - report["computed_at"] > self.max_age_sec
+        ):
+            self._count("stale")
+            return None
+        self._count("hit")
+        return report
+
+    # ---- 排程 ----
+
+    def schedule(self, symbol: str, trigger: str, requested_at: float) -> int:
+        """
+        把 symbol 的所有 intent 排進去跑；requested_at 之後才開始算的結果就算數（用來跳過別人算好的）。
+        回傳實際新排入的數量。
+        """
+        n = 0
+        for intent in self.intents:
+            key = (symbol, intent)
+            with self._lock:
+                if key in self._pending:
+                    continue
+                self._pending.add(key)
+                self.stats["scheduled"] += 1
+            try:
+                self._executor.submit(self._run_job, symbol, intent, trigger, requested_at)
+            except RuntimeError:
+                # executor 已 shutdown
+                with self._lock:
+                    self._pending.discard(key)
+                break
+            n += 1
+        with self._lock:
+            self.last_trigger[symbol] = {"trigger": trigger, "at": round(time.time(), 3)}
+        return n
+
+    def _run_job(self, symbol: str, intent: str, trigger: str, requested_at: float) -> None:
+        key = f"{symbol}:{intent}"
+        try:
+            # 整個 graph 跑完之前都持有（lease 會自動續約），別的 worker 同一個 key 會等結果
+            with self.backend.lock(_NS, key):
+                existing = self.backend.get(_NS, key)
+                if existing is not None and existing["started_at"] >= requested_at:
+                    self._count("skipped")
+                    with self._lock:
+                        self._ref_price.setdefault(symbol, existing["price"])
+                    return
+
+                started = time.time()
+                price = _last_price(symbol, self.interval)
+                message = run_analysis(symbol, intent, INTENT_QUERIES[intent].format(symbol=symbol))
+                report = {
+                    "symbol": symbol,
+                    "intent": intent,
+                    "message": message,
+                    "epoch": self._epoch_ms(started),
+                    "interval": self.interval,
+                    "started_at": started,
+                    "computed_at": time.time(),
+                    "trigger": trigger,
+                    "price": price,
+                }
+                # 下一根收盤前都有效；多留一個週期給 stale 判斷
+                self.backend.put(_NS, key, report, ttl_sec=2 * self.step_sec)
+                self._count("computed")
+                if price is not None:
+                    with self._lock:
+                        self._ref_price[symbol] = price
+                print(f"[INFO] Precomputed {key} ({trigger}) in {report['computed_at'] - started:.1f}s")
+        except Exception as e:
+            self._count("failed")
+            print(f"[WARN] Precompute {key} failed:", repr(e))
+        finally:
+            with self._lock:
+                self._pending.discard((symbol, intent))
+
+    def _check_moves(self) -> None:
+        now = time.time()
+        for symbol in self.symbols:
+            with self._lock:
+                ref = self._ref_price.get(symbol)
+            if not ref:
+                continue
+            try:
+                price = _last_price(symbol, self.interval)
+            except Exception as e:
+                print(f"[WARN] Precompute price check failed for {symbol}:", repr(e))
+                continue
+            if price is None:
+                continue
+            move = abs(price / ref - 1.0) * 100
+            if move >= self.move_pct:
+                print(f"[INFO] {symbol} moved {move:.2f}% since last precompute, recomputing")
+                self._count("moves")
+                with self._lock:
+                    # 排進去之後以新價格為基準，避免每次檢查都再觸發
+                    self._ref_price[symbol] = price
+                self.schedule(symbol, "move", now)
+
+    def _loop(self) -> None:
+        epoch_sec = self._epoch_ms() / 1000
+        for symbol in self.symbols:
+            # 這根 K 線開盤之後算過的就不用再算
+            self.schedule(symbol, "startup", epoch_sec)
+
+        next_close = epoch_sec + self.step_sec
+        wait = min(self.check_sec, max(0.0, next_close + self.delay_sec - time.time()))
+        while not self._halt.wait(wait):
+            now = time.time()
+            if now >= next_close + self.delay_sec:
+                for symbol in self.symbols:
+                    self.schedule(symbol, "candle_close", next_close)
+                next_close = self._epoch_ms(now) / 1000 + self.step_sec
+            else:
+                self._check_moves()
+            wait = min(self.check_sec, max(0.5, next_close + self.delay_sec - time.time()))
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="precompute-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._halt.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "symbols": self.symbols,
+                "intents": self.intents,
+                "interval": self.interval,
+                "pending": len(self._pending),
+                **self.stats,
+                "ref_price": dict(self._ref_price),
+                "last_trigger": dict(self.last_trigger),
+            }
+
+
+# ----------------------------
+# Module-level scheduler
+# ----------------------------
+
+_scheduler: Optional[PrecomputeScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def start_precompute() -> Optional[PrecomputeScheduler]:
+    """PRECOMPUTE_ENABLED 時啟動背景 scheduler（重複呼叫只會有一個）。"""
+    global _scheduler
+    if not PRECOMPUTE_ENABLED or not PRECOMPUTE_SYMBOLS:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PrecomputeScheduler(PRECOMPUTE_SYMBOLS, PRECOMPUTE_INTENTS or list(INTENT_LABELS))
+            _scheduler.start()
+            print(f"[INFO] Precompute scheduler started: {_scheduler.symbols} × {_scheduler.intents}")
+    return _scheduler
+
+
+def stop_precompute() -> None:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.stop()
+            _scheduler = None
+
+
+def get_precomputed(symbol: str, user_text: str) -> Optional[Dict[str, Any]]:
+    """這個問題（symbol + 解析出的 intent）有新鮮的預先計算結果就回傳，否則 None。"""
+    s = _scheduler
+    if s is None:
+        return None
+    return s.get(symbol, _parse_intent(user_text))
+
+
+def precompute_stats() -> Dict[str, Any]:
+    s = _scheduler
+    return s.metrics() if s is not None else {"enabled": False}
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+from typing import Callable, Dict, Optional, Union, overload
+
+import numpy as np
+import pandas as pd
+
+from candles import KLINE_COLUMNS, CandleArray
+
+"""
+Timeframe resampling：用較細的 base interval（例如 1d、1h）在本地合成高週期 K 線，
+每個 symbol 只需要打一次 Binance。
+
+對齊規則（與 Binance 自己的 K 線一致）：
+    4h / 12h / 1d : 從 UTC 00:00 起算（epoch 對齊）
+    3d            : epoch 對齊（open_time % 3d == 0），有需要可用 origin_ms 覆寫
+    1w            : 週一 00:00 UTC 開盤（1970-01-05 是週一）
+    1M            : 月份長度不固定，不支援
+"""
+
+_MINUTE_MS = 60_000
+_HOUR_MS = 60 * _MINUTE_MS
+_DAY_MS = 24 * _HOUR_MS
+
+INTERVAL_MS: Dict[str, int] = {
+    "1m": _MINUTE_MS,
+    "3m": 3 * _MINUTE_MS,
+    "5m": 5 * _MINUTE_MS,
+    "15m": 15 * _MINUTE_MS,
+    "30m": 30 * _MINUTE_MS,
+    "1h": _HOUR_MS,
+    "2h": 2 * _HOUR_MS,
+    "4h": 4 * _HOUR_MS,
+    "6h": 6 * _HOUR_MS,
+    "8h": 8 * _HOUR_MS,
+    "12h": 12 * _HOUR_MS,
+    "1d": _DAY_MS,
+    "3d": 3 * _DAY_MS,
+    "1w": 7 * _DAY_MS,
+}
+
+# 1970-01-01 是週四，往後 4 天（1970-01-05）才是第一個週一 00:00 UTC
+_WEEK_ORIGIN_MS = 4 * _DAY_MS
+
+_SUM_COLS = [
+    "volume",
+    "quote_asset_volume",
+    "number_of_trades",
+    "taker_buy_base_asset_volume",
+    "taker_buy_quote_asset_volume",
+]
+
+_EPOCH = pd.Timestamp(0, unit="ms", tz="UTC")
+
+
+def _to_ms(s: pd.Series) -> np.ndarray:
+    """datetime64 (UTC) column → int64 毫秒（不受 pandas 時間解析度影響）"""
+    return ((s - _EPOCH) // pd.Timedelta(milliseconds=1)).to_numpy(dtype=np.int64)
+
+
+def _origin_ms(interval: str) -> int:
+    return _WEEK_ORIGIN_MS if interval == "1w" else 0
+
+
+def candle_open_ms(ts_ms: int, interval: str) -> int:
+    """ts_ms 所在那根 `interval` K 線的 open_time（毫秒），對齊規則同上。"""
+    step = INTERVAL_MS[interval]
+    origin = _origin_ms(interval)
+    return (int(ts_ms) - origin) // step * step + origin
+
+
+def _resample_columns(
+    t: np.ndarray,
+    col: Callable[[str], np.ndarray],
+    has_col: Callable[[str], bool],
+    interval: str,
+    drop_partial_head: bool,
+    origin_ms: Optional[int],
+) -> Optional[Dict[str, np.ndarray]]:
+    """
+    向量化核心：t 為排序好的 open_time（int64 毫秒），col(name) 取 float64 欄位。
+    base 與目標 interval 相同時回傳 None（呼叫端直接用原資料）。
+    """
+    step = INTERVAL_MS[interval]
+    origin = _origin_ms(interval) if origin_ms is None else int(origin_ms)
+
+    if len(t) > 1:
+        base_step = int(np.min(np.diff(t)))
+        if base_step <= 0 or step % base_step != 0:
+            raise ValueError(f"cannot resample base step {base_step}ms into {interval}")
+        if base_step == step:
+            return None
+
+    bucket = (t - origin) // step
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(t)]
+    bucket_open = bucket[starts] * step + origin
+
+    out = {
+        "open_time": bucket_open,
+        "open": col("open")[starts],
+        "high": np.maximum.reduceat(col("high"), starts),
+        "low": np.minimum.reduceat(col("low"), starts),
+        "close": col("close")[ends - 1],
+    }
+    for c in _SUM_COLS:
+        if has_col(c):
+            out[c] = np.add.reduceat(col(c), starts)
+    out["close_time"] = bucket_open + step - 1
+    if "number_of_trades" in out:
+        out["number_of_trades"] = out["number_of_trades"].astype(np.int64)
+
+    if drop_partial_head and t[0] != bucket_open[0]:
+        out = {k: v[1:] for k, v in out.items()}
+    return out
+
+
+@overload
+def resample_klines(df: pd.DataFrame, interval: str, *, drop_partial_head: bool = ..., origin_ms: Optional[int] = ...) -> pd.DataFrame: ...
+@overload
+def resample_klines(df: CandleArray, interval: str, *, drop_partial_head: bool = ..., origin_ms: Optional[int] = ...) -> CandleArray: ...
+
+
+def resample_klines(
+    df: Union[pd.DataFrame, CandleArray],
+    interval: str,
+    *,
+    drop_partial_head: bool = True,
+    origin_ms: Optional[int] = None,
+) -> Union[pd.DataFrame, CandleArray]:
+    """
+    把較細的 K 線合成為 `interval`（例如 1d → 1w、1h → 4h）。
+    輸入 DataFrame（欄位同 data_binance._get_klines）回傳 DataFrame；輸入 CandleArray 回傳 CandleArray。
+
+    - open = 區間第一根 open、close = 最後一根 close
+    - high / low = 區間最大 / 最小
+    - volume、quote_asset_volume、number_of_trades、taker_* = 區間加總
+    - close_time = 區間 open_time + interval - 1ms（Binance 慣例，未收盤那根也一樣）
+
+    drop_partial_head: base 資料的第一根沒有落在區間起點時（例如 limit 切到週三），
+                       第一根合成 K 線會跟 Binance 不一致 → 預設丟掉。
+    """
+    if interval not in INTERVAL_MS:
+        raise ValueError(f"unsupported resample interval: {interval}")
+
+    if isinstance(df, CandleArray):
+        if len(df) == 0:
+            return df
+        candles = df.sorted()
+        out = _resample_columns(
+            candles.open_time,
+            lambda name: getattr(candles, name).astype(np.float64, copy=False),
+            lambda name: True,
+            interval,
+            drop_partial_head,
+            origin_ms,
+        )
+        return candles if out is None else CandleArray(**out)
+
+    if len(df) == 0:
+        return df.copy()
+
+    if not df["open_time"].is_monotonic_increasing:
+        df = df.sort_values("open_time")
+
+    out = _resample_columns(
+        _to_ms(df["open_time"]),
+        lambda name: pd.to_numeric(df[name], errors="coerce").to_numpy(dtype=np.float64),
+        lambda name: name in df.columns,
+        interval,
+        drop_partial_head,
+        origin_ms,
+    )
+    if out is None:
+        return df.reset_index(drop=True).copy()
+
+    res = pd.DataFrame(out)
+    res["ignore"] = "0"
+    res["open_time"] = pd.to_datetime(res["open_time"], unit="ms", utc=True)
+    res["close_time"] = pd.to_datetime(res["close_time"], unit="ms", utc=True)
+
+    cols = [*KLINE_COLUMNS, "ignore"]
+    return res[[c for c in cols if c in res.columns]].reset_index(drop=True)
+
+
+def base_limit_for(interval: str, limit: int, base_interval: str) -> int:
+    """要合成 `limit` 根 `interval`，需要多少根 base K 線（多算一根給不完整的開頭）。"""
+    ratio = INTERVAL_MS[interval] // INTERVAL_MS[base_interval]
+    return (int(limit) + 1) * ratio
+
+
+def required_base_limit(intervals: Dict[str, int], base_interval: str) -> int:
+    """intervals = {"1d": 220, "1w": 220} 全部要從 base_interval 合成時，base 需要幾根。"""
+    for interval in intervals:
+        if interval not in INTERVAL_MS or INTERVAL_MS[interval] % INTERVAL_MS[base_interval] != 0:
+            raise ValueError(f"cannot derive {interval} from base interval {base_interval}")
+    return max(
+        base_limit_for(interval, limit, base_interval) if interval != base_interval else limit
+        for interval, limit in intervals.items()
+    )
+
+
+def derive_intervals(base: CandleArray, intervals: Dict[str, int], base_interval: str) -> Dict[str, CandleArray]:
+    """從同一段 base K 線合成每個 interval，各取最後 limit 根。"""
+    out: Dict[str, CandleArray] = {}
+    for interval, limit in intervals.items():
+        candles = base if interval == base_interval else resample_klines(base, interval)
+        out[interval] = candles.tail(limit)
+    return out
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+"""
+Single-flight：同一個 key 同時只跑一次，期間其他呼叫者直接等同一份結果。
+
+例：行情急動時群組裡一堆人同時問「!BTC投資建議」，
+    (symbol, intent, candle epoch) 相同的請求只會跑一次完整 graph。
+"""
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"leader": 0, "coalesced": 0, "error": 0}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+                self._stats["leader"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            return fut.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                self._stats["error"] += 1
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "inflight": len(self._inflight)}
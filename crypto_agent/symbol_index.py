@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import (
+    SYMBOL_DEFAULT_QUOTE,
+    SYMBOL_INDEX_ENABLED,
+    SYMBOL_INDEX_REFRESH_SEC,
+    SYMBOL_INDEX_SNAPSHOT_PATH,
+)
+from data_binance import get_exchange_info
+
+"""
+交易對索引：從 Binance exchangeInfo（或本地 snapshot）建出 symbol → SymbolInfo 的 dict，
+讓 LINE 訊息裡的幣種在送進 graph 之前就先驗證（O(1) 查表），不存在的直接擋掉，
+不會因為 "!hello" 這種訊息白打一次 Binance / LLM。
+
+- 只收 status == TRADING 的交易對
+- resolve("BTC") → BTCUSDT（SYMBOL_DEFAULT_QUOTE）；resolve("ETHBTC") → ETHBTC；不存在 → None
+- 中文別名（比特幣 / 大餅 / 二餅 ...）也在這裡解析
+- 背景 thread 每 SYMBOL_INDEX_REFRESH_SEC 秒刷新一次，成功就寫 snapshot；
+  重啟時先載入 snapshot，網路掛了也能驗證
+- 索引從沒載入成功過（沒 snapshot、Binance 也連不上）→ 退回舊行為：任何代號都當成 XXXUSDT
+"""
+
+# 中文別名 → base asset（長的先比對，「以太坊」不會被「以太」搶走）
+ZH_ALIASES: Dict[str, str] = {
+    "比特幣": "BTC",
+    "大餅": "BTC",
+    "以太幣": "ETH",
+    "以太坊": "ETH",
+    "以太": "ETH",
+    "二餅": "ETH",
+    "狗狗幣": "DOGE",
+    "狗幣": "DOGE",
+    "柴犬幣": "SHIB",
+    "柴幣": "SHIB",
+    "幣安幣": "BNB",
+    "幣安": "BNB",
+    "艾達幣": "ADA",
+    "艾達": "ADA",
+}
+_ZH_ALIASES_BY_LEN = sorted(ZH_ALIASES.items(), key=lambda kv: -len(kv[0]))
+
+# 常見的非幣種單字（有些剛好也是幣安上的代號，例如 AI）；這些不會被當成代號，也不會被回「找不到」
+TOKEN_BLACKLIST = {
+    "USDT", "AI", "AGENT", "BUY", "SELL", "HOLD",
+    "HI", "HELLO", "OK", "PLS", "PLEASE",
+    "MA", "EMA", "SMA", "RSI", "MACD", "KD",
+}
+
+# 英文 / 數字代號（1000PEPE 這類 base 也要抓得到）；前後不能接英數字
+_TOKEN_RE = re.compile(r"(?<![A-Za-z0-9])([A-Za-z0-9]{2,20})(?![A-Za-z0-9])")
+
+
+@dataclass(frozen=True)
+class SymbolInfo:
+    symbol: str
+    base: str
+    quote: str
+    tick_size: str = ""  # PRICE_FILTER.tickSize，例如 "0.01000000"
+    step_size: str = ""  # LOT_SIZE.stepSize
+
+    @property
+    def price_precision(self) -> Optional[int]:
+        """tickSize 的小數位數（0.01 → 2）；沒有 tickSize → None。"""
+        if not self.tick_size:
+            return None
+        d = Decimal(self.tick_size).normalize()
+        return max(0, -d.as_tuple().exponent)
+
+
+def _parse_exchange_info(payload: Dict[str, Any]) -> List[SymbolInfo]:
+    out: List[SymbolInfo] = []
+    for s in payload.get("symbols", []):
+        if s.get("status") != "TRADING":
+            continue
+        filters = {f.get("filterType"): f for f in s.get("filters", [])}
+        out.append(
+            SymbolInfo(
+                symbol=s["symbol"],
+                base=s["baseAsset"],
+                quote=s["quoteAsset"],
+                tick_size=filters.get("PRICE_FILTER", {}).get("tickSize", ""),
+                step_size=filters.get("LOT_SIZE", {}).get("stepSize", ""),
+            )
+        )
+    return out
+
+
+class SymbolIndex:
+    def __init__(self, default_quote: str = SYMBOL_DEFAULT_QUOTE):
+        self.default_quote = default_quote
+        self._symbols: Dict[str, SymbolInfo] = {}
+        self._by_base: Dict[str, Dict[str, str]] = {}
+        self.loaded_at = 0.0  # 這份資料是什麼時候從 Binance 抓的（epoch 秒）
+        self.source = ""
+        self.stats = {"resolved": 0, "rejected": 0, "refresh_ok": 0, "refresh_failed": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._symbols)
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    def load(self, infos: List[SymbolInfo], loaded_at: float, source: str) -> None:
+        """整份換掉（建好新的 dict 再一次指派，讀的人不需要拿 lock）。"""
+        symbols = {i.symbol: i for i in infos}
+        by_base: Dict[str, Dict[str, str]] = {}
+        for i in infos:
+            by_base.setdefault(i.base, {})[i.quote] = i.symbol
+        with self._lock:
+            self._symbols, self._by_base = symbols, by_base
+            self.loaded_at, self.source = loaded_at, source
+
+    def info(self, symbol: str) -> Optional[SymbolInfo]:
+        return self._symbols.get(symbol.upper())
+
+    def resolve(self, token: str) -> Optional[str]:
+        """
+        代號 → 交易對：完整交易對（BTCUSDT / ETHBTC）直接用；
+        只有 base（BTC）就配 default_quote；都不是 → None。
+        """
+        t = token.strip().upper()
+        if not t or t in TOKEN_BLACKLIST:
+            return None
+        if t in self._symbols:
+            return t
+        return self._by_base.get(t, {}).get(self.default_quote)
+
+    def resolve_text(self, text: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        從整段訊息找第一個有效的幣種 → (symbol, rejected)。
+        rejected：第一個看起來像代號、卻找不到交易對的 token（不分大小寫，"xyz" / "XYZ" 都算），
+        讓呼叫端回「找不到這個幣」，而不是默默改分析 BTC；TOKEN_BLACKLIST 裡的一般單字不算。
+        """
+        t = (text or "").strip()
+        for alias, base in _ZH_ALIASES_BY_LEN:
+            if alias in t:
+                sym = self.resolve(base) if self.ready else f"{base}{self.default_quote}"
+                if sym:
+                    self._count("resolved")
+                    return sym, None
+
+        rejected: Optional[str] = None
+        for m in _TOKEN_RE.finditer(t):
+            raw = m.group(1)
+            if raw.isdigit():
+                continue
+            token = raw.upper()
+            if not self.ready:
+                # 索引還沒載入：維持舊行為（第一個代號當 XXXUSDT）
+                if token in TOKEN_BLACKLIST:
+                    return None, None
+                return (token if token.endswith(self.default_quote) else f"{token}{self.default_quote}"), None
+            sym = self.resolve(token)
+            if sym:
+                self._count("resolved")
+                return sym, None
+            if rejected is None and token not in TOKEN_BLACKLIST:
+                rejected = token
+        if rejected is not None:
+            self._count("rejected")
+        return None, rejected
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "symbols": len(self._symbols),
+                "source": self.source,
+                "age_sec": round(time.time() - self.loaded_at, 1) if self.loaded_at else None,
+                **self.stats,
+            }
+
+    # ---- snapshot / refresh ----
+
+    def load_snapshot(self, path: str) -> bool:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            infos = [SymbolInfo(*row) for row in data["symbols"]]
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print("[WARN] Symbol index snapshot unreadable:", repr(e))
+            return False
+        self.load(infos, float(data.get("fetched_at", 0)), "snapshot")
+        print(f"[INFO] Symbol index loaded from snapshot: {len(infos)} symbols")
+        return True
+
+    def save_snapshot(self, path: str) -> None:
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        rows = [[i.symbol, i.base, i.quote, i.tick_size, i.step_size] for i in self._symbols.values()]
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fetched_at": self.loaded_at, "symbols": rows}, f, separators=(",", ":"))
+        os.replace(tmp, path)  # 其他 worker 不會讀到寫一半的檔案
+
+    def refresh(self, snapshot_path: str = "") -> bool:
+        """打一次 exchangeInfo；失敗就保留舊資料。"""
+        try:
+            infos = _parse_exchange_info(get_exchange_info())
+            if not infos:
+                raise ValueError("exchangeInfo returned no TRADING symbols")
+        except Exception as e:
+            self._count("refresh_failed")
+            print("[WARN] Symbol index refresh failed:", repr(e))
+            return False
+        self.load(infos, time.time(), "exchangeInfo")
+        self._count("refresh_ok")
+        print(f"[INFO] Symbol index refreshed: {len(infos)} symbols")
+        if snapshot_path:
+            try:
+                self.save_snapshot(snapshot_path)
+            except Exception as e:
+                print("[WARN] Symbol index snapshot write failed:", repr(e))
+        return True
+
+
+class _RefreshThread(threading.Thread):
+    # 失敗時多久再試（不等完整的 refresh 週期）
+    RETRY_SEC = 60.0
+
+    def __init__(self, index: SymbolIndex, refresh_sec: float, snapshot_path: str):
+        super().__init__(name="symbol-index-refresh", daemon=True)
+        self.index = index
+        self.refresh_sec = refresh_sec
+        self.snapshot_path = snapshot_path
+        self._halt = threading.Event()
+
+    def run(self) -> None:
+        # snapshot 還新鮮就等到期再刷新
+        age = time.time() - self.index.loaded_at if self.index.loaded_at else float("inf")
+        wait = max(0.0, self.refresh_sec - age)
+        while not self._halt.wait(wait):
+            ok = self.index.refresh(self.snapshot_path)
+            wait = self.refresh_sec if ok else min(self.RETRY_SEC, self.refresh_sec)
+
+    def stop(self) -> None:
+        self._halt.set()
+
+
+# ----------------------------
+# Module-level index
+# ----------------------------
+
+_index = SymbolIndex()
+_refresher: Optional[_RefreshThread] = None
+_refresher_lock = threading.Lock()
+
+
+def get_symbol_index() -> SymbolIndex:
+    return _index
+
+
+def start_symbol_index() -> SymbolIndex:
+    """載入 snapshot 並啟動背景刷新（重複呼叫只會有一個 thread）。SYMBOL_INDEX_ENABLED=false 時不做事。"""
+    global _refresher
+    if not SYMBOL_INDEX_ENABLED:
+        return _index
+    with _refresher_lock:
+        if _refresher is None:
+            if SYMBOL_INDEX_SNAPSHOT_PATH:
+                _index.load_snapshot(SYMBOL_INDEX_SNAPSHOT_PATH)
+            _refresher = _RefreshThread(_index, SYMBOL_INDEX_REFRESH_SEC, SYMBOL_INDEX_SNAPSHOT_PATH)
+            _refresher.start()
+    return _index
+
+
+def stop_symbol_index() -> None:
+    global _refresher
+    with _refresher_lock:
+        if _refresher is not None:
+            _refresher.stop()
+            _refresher = None
+
+
+def resolve_symbol(text: str) -> Tuple[Optional[str], Optional[str]]:
+    return _index.resolve_text(text)
+
+
+def symbol_index_stats() -> Dict[str, Any]:
+    return _index.metrics()
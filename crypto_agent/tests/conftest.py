@@ -0,0 +1,11 @@
+import os
+import sys
+
+# 模組都是平的（from config import ...），跟 main.py 一樣從 crypto_agent/ 底下 import
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 測試不要寫 SQLite、不要連 websocket
+os.environ.setdefault("KLINE_STORE_ENABLED", "false")
+os.environ.setdefault("KLINE_STREAM_ENABLED", "false")
+os.environ.setdefault("SYMBOL_INDEX_ENABLED", "false")
+os.environ.setdefault("PRECOMPUTE_ENABLED", "false")
@@ -0,0 +1,60 @@
+"""
+錄製 resample 測試用的 Binance 原生 K 線（需要網路，只有要更新 fixture 時才跑）。
+
+python tests/record_binance_fixtures.py [--symbol BTCUSDT]
+
+寫到 tests/fixtures/binance/{SYMBOL}_{interval}.json（Binance /api/v3/klines 原始 rows）：
+- 1d（base）+ 同一段時間的原生 1w / 3d
+- 1h（base）+ 同一段時間的原生 4h / 12h
+test_resample_binance.py 會用 base 在本地合成，再跟原生 K 線逐根比對。
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_binance as db  # noqa: E402
+from resample import INTERVAL_MS, candle_open_ms  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "binance")
+
+# base interval → (要比對的原生 interval, base 抓幾根)
+SETS = {
+    "1d": (("1w", "3d"), 400),
+    "1h": (("4h", "12h"), 600),
+}
+
+
+def _rows(symbol: str, interval: str, start_ms: int, end_ms: int):
+    r = db._http_get(
+        db.BINANCE_KLINES_PATH,
+        {"symbol": symbol, "interval": interval, "startTime": start_ms, "endTime": end_ms, "limit": 1000},
+    )
+    return r.json()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbol", default="BTCUSDT")
+    args = ap.parse_args()
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+
+    now = db._now_ms()
+    for base, (targets, n) in SETS.items():
+        # 只錄已收盤的：結束在最大 target 的上一根收盤
+        widest = max(targets, key=lambda i: INTERVAL_MS[i])
+        end = candle_open_ms(now, widest) - 1
+        start = end - n * INTERVAL_MS[base] + 1
+        for interval in (base, *targets):
+            rows = _rows(args.symbol, interval, start, end)
+            path = os.path.join(FIXTURE_DIR, f"{args.symbol}_{interval}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(rows, f, separators=(",", ":"))
+            print(f"[INFO] {path}: {len(rows)} rows")
+
+
+if __name__ == "__main__":
+    main()
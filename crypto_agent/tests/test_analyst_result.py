@@ -0,0 +1,43 @@
+import pytest
+
+from graph_crypto_agent import (
+    ANALYST_NOTE_MAX_CHARS,
+    ANALYST_NOTES_MAX,
+    ANALYST_SUMMARY_MAX_CHARS,
+    validate_analyst_result,
+)
+
+
+@pytest.mark.parametrize(
+    "ok, expected",
+    [(True, True), ("true", True), ("TRUE", True), (1, True), (False, False), ("false", False), ("False", False), (0, False)],
+)
+def test_ok_is_coerced_strictly(ok, expected):
+    r = validate_analyst_result({"ok": ok, "decision": "buy", "summary": "s"})
+    assert r["ok"] is expected
+    assert "error" not in r
+
+
+@pytest.mark.parametrize("ok", ["maybe", "", None, 2, [], {}])
+def test_unrecognized_ok_is_rejected(ok):
+    r = validate_analyst_result({"ok": ok, "decision": "buy"})
+    assert r["ok"] is False
+    assert r["error"].startswith("invalid ok")
+
+
+def test_missing_ok_defaults_to_true():
+    assert validate_analyst_result({"decision": "觀望"}) == {"ok": True, "decision": "hold", "summary": "", "notes": []}
+
+
+def test_invalid_decision_and_json():
+    assert validate_analyst_result({"ok": True, "decision": "moon"})["error"].startswith("invalid decision")
+    assert validate_analyst_result({"raw": "{\"ok\": tr"}) == {"ok": False, "error": "invalid_json"}
+    assert validate_analyst_result("not a dict")["ok"] is False
+
+
+def test_summary_and_notes_are_cut_to_limits():
+    r = validate_analyst_result({"decision": "SELL", "summary": "x" * 200, "notes": ["y" * 50] * 10 + [""]})
+    assert r["decision"] == "sell"
+    assert r["summary"] == "x" * ANALYST_SUMMARY_MAX_CHARS
+    assert r["notes"] == ["y" * ANALYST_NOTE_MAX_CHARS] * ANALYST_NOTES_MAX
+    assert validate_analyst_result({"decision": "buy", "notes": "單一字串"})["notes"] == ["單一字串"]
@@ -0,0 +1,156 @@
+import json
+import socket
+import time
+
+import pytest
+import requests
+
+import data_binance as db
+from binance_stub import start_stub_server
+
+KLINES = {"symbol": "BTCUSDT", "interval": "1d", "limit": 5}
+
+
+@pytest.fixture
+def hosts(monkeypatch):
+    """primary / mirror 各一個 stub；每個測試用新的 limiter 跟 hedge 計數。"""
+    primary, mirror = start_stub_server(), start_stub_server()
+    original = list(db._hosts)
+    db.configure_binance_hosts([primary.base_url, mirror.base_url])
+    monkeypatch.setattr(db, "_weight_limiter", db.WeightLimiter())
+    monkeypatch.setattr(db, "_hedge_counts", {"hedged": 0, "hedge_wins": 0, "hedge_skipped": 0})
+    monkeypatch.setattr(db, "BINANCE_HEDGE_DEFAULT_DELAY_MS", 100.0)
+    monkeypatch.setattr(db, "BINANCE_MAX_RETRIES", 0)
+    yield primary, mirror
+    db.configure_binance_hosts(original)
+    primary.shutdown()
+    mirror.shutdown()
+
+
+def _closed_port_url() -> str:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+def _wait_for(cond, timeout: float = 3.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return cond()
+
+
+def test_fast_primary_is_not_hedged(hosts):
+    primary, mirror = hosts
+    r = db._http_get(db.BINANCE_KLINES_PATH, KLINES)
+    assert len(r.json()) == 5
+    assert mirror.stats["requests"] == 0
+    assert db.binance_host_stats()["hedged"] == 0
+
+
+def test_slow_primary_hedges_and_cancels_loser(hosts):
+    primary, mirror = hosts
+    primary.delay_sec = 1.0
+    t0 = time.monotonic()
+    r = db._http_get(db.BINANCE_KLINES_PATH, KLINES)
+    assert time.monotonic() - t0 < 0.9
+    assert len(r.json()) == 5
+
+    stats = db.binance_host_stats()
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+    assert stats["hosts"][mirror.base_url]["wins"] == 1
+    # primary 的連線被中斷，不算成功也不算錯誤
+    assert _wait_for(lambda: db.binance_host_stats()["hosts"][primary.base_url]["cancelled"] == 1)
+    assert db.binance_host_stats()["hosts"][primary.base_url]["errors"] == 0
+
+
+def test_loser_waiting_for_headers_is_aborted_promptly(hosts):
+    primary, mirror = hosts
+    # primary 連 header 都還沒送：以前要等到 delay / read timeout 才會放掉
+    primary.delay_sec = 3.0
+    r = db._http_get(db.BINANCE_KLINES_PATH, KLINES)
+    assert isinstance(r, db.BinanceResponse) and isinstance(r.content, bytes)
+    t_won = time.monotonic()
+    assert _wait_for(lambda: db.binance_host_stats()["hosts"][primary.base_url]["cancelled"] == 1, timeout=1.0)
+    assert time.monotonic() - t_won < 1.0
+    assert db.binance_host_stats()["hosts"][primary.base_url]["errors"] == 0
+
+
+def test_response_result_object_matches_requests_interface(hosts):
+    primary, mirror = hosts
+    r = db._http_get(db.BINANCE_KLINES_PATH, KLINES)
+    assert r.ok and r.headers.get("content-type", "").startswith("application/json")
+    assert r.json() == json.loads(r.content)
+    bad = db.BinanceResponse(status_code=418, url="http://x/api", reason="Teapot")
+    with pytest.raises(requests.HTTPError) as e:
+        bad.raise_for_status()
+    assert e.value.response is bad and "418 Client Error" in str(e.value)
+
+
+def test_rate_limited_response_is_not_hedged(hosts, monkeypatch):
+    primary, mirror = hosts
+    monkeypatch.setattr(db, "BINANCE_MAX_RETRIES", 1)
+    primary.fail_status = 429
+    primary.fail_retry_after = 3600
+    with pytest.raises(requests.HTTPError) as e:
+        db._http_get(db.BINANCE_KLINES_PATH, KLINES)
+    assert e.value.response.status_code == 429
+    assert mirror.stats["requests"] == 0
+    assert db.binance_host_stats()["hedged"] == 0
+    assert db.binance_weight_stats()["rate_limited"] == 1
+
+
+def test_failed_primary_falls_back_to_mirror(hosts):
+    primary, mirror = hosts
+    primary.fail_status = 503
+    r = db._http_get(db.BINANCE_KLINES_PATH, KLINES)
+    assert r.status_code == 200
+    assert mirror.stats["requests"] == 1
+    assert db.binance_host_stats()["hedge_wins"] == 1
+
+
+def test_both_failing_returns_last_response(hosts):
+    primary, mirror = hosts
+    primary.fail_status = mirror.fail_status = 503
+    r = db._hedged_send(db.BINANCE_KLINES_PATH, KLINES, (1, 1), 2)
+    assert r.status_code == 503
+    with pytest.raises(requests.HTTPError):
+        db._http_get(db.BINANCE_KLINES_PATH, KLINES)
+
+
+def test_connection_errors_propagate(hosts):
+    primary, mirror = hosts
+    db.configure_binance_hosts([_closed_port_url(), mirror.base_url])
+    r = db._http_get(db.BINANCE_KLINES_PATH, KLINES)
+    assert r.status_code == 200
+
+    db.configure_binance_hosts([_closed_port_url(), _closed_port_url()])
+    with pytest.raises(requests.ConnectionError):
+        db._http_get(db.BINANCE_KLINES_PATH, KLINES)
+
+
+def test_hedge_skipped_when_weight_budget_is_short(hosts, monkeypatch):
+    primary, mirror = hosts
+    primary.delay_sec = 0.4
+    # 只夠 primary 一次（klines weight = 2）
+    monkeypatch.setattr(db, "_weight_limiter", db.WeightLimiter(limit_per_min=3, safety=1.0))
+    r = db._http_get(db.BINANCE_KLINES_PATH, KLINES)
+    assert r.status_code == 200
+    assert mirror.stats["requests"] == 0
+    stats = db.binance_host_stats()
+    assert stats["hedge_skipped"] == 1 and stats["hedged"] == 0
+    assert stats["hosts"][primary.base_url]["wins"] == 1
+
+
+def test_retry_after_above_backoff_cap_fails_fast(hosts, monkeypatch):
+    primary, mirror = hosts
+    monkeypatch.setattr(db, "BINANCE_MAX_RETRIES", 3)
+    primary.fail_status = mirror.fail_status = 503
+    primary.fail_retry_after = mirror.fail_retry_after = 600
+    t0 = time.monotonic()
+    with pytest.raises(requests.HTTPError):
+        db._http_get(db.BINANCE_KLINES_PATH, KLINES)
+    assert time.monotonic() - t0 < 2
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from cache_backend import InProcessCache, SqliteCache
+
+
+def _run_concurrently(*fns):
+    start = threading.Barrier(len(fns))
+    results = [None] * len(fns)
+
+    def run(i, fn):
+        start.wait()
+        results[i] = fn()
+
+    threads = [threading.Thread(target=run, args=(i, fn)) for i, fn in enumerate(fns)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    return results
+
+
+def test_two_sqlite_workers_compute_once_even_past_lease(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    # 兩個 SqliteCache 模擬兩個 worker（各自的 in-process lock，只靠 SQLite lease 排隊）
+    a, b = SqliteCache(path), SqliteCache(path)
+    calls = []
+
+    def compute():
+        calls.append(threading.get_ident())
+        time.sleep(1.0)  # 比 lease 久很多：靠續約撐住
+        return {"value": 42}
+
+    results = _run_concurrently(
+        lambda: a.get_or_compute("t", "k", compute, lease_sec=0.3),
+        lambda: b.get_or_compute("t", "k", compute, lease_sec=0.3),
+    )
+    assert results == [{"value": 42}, {"value": 42}]
+    assert len(calls) == 1
+    assert a.metrics()["lease_renewed"] + b.metrics()["lease_renewed"] >= 2
+    assert a.metrics()["lock_timeout"] == b.metrics()["lock_timeout"] == 0
+
+
+def test_expired_lease_of_dead_holder_is_taken_over(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    a, b = SqliteCache(path), SqliteCache(path)
+    # 持有者「掛掉」：拿了 lease 但沒有續約也沒有釋放
+    assert a._try_lock("t", "k", 0.2, 0.0)
+    t0 = time.monotonic()
+    with b.lock("t", "k", lease_sec=0.2, wait_sec=5) as acquired:
+        assert acquired
+    assert time.monotonic() - t0 < 2
+
+
+def test_waiter_gives_up_after_wait_sec(tmp_path):
+    cache = InProcessCache()
+    with cache.lock("t", "k"):
+        out = _run_concurrently(lambda: _lock_result(cache, wait_sec=0.2))
+    assert out == [False]
+    assert cache.metrics()["lock_timeout"] == 1
+
+
+def _lock_result(cache, wait_sec):
+    with cache.lock("t", "k", wait_sec=wait_sec) as acquired:
+        return acquired
+
+
+def test_inprocess_compute_once():
+    cache = InProcessCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return "v"
+
+    assert _run_concurrently(*[lambda: cache.get_or_compute("t", "k", compute)] * 4) == ["v"] * 4
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_key_locks_are_pruned(tmp_path, backend):
+    cache = InProcessCache() if backend == "memory" else SqliteCache(str(tmp_path / "s.sqlite3"))
+    inproc = cache if backend == "memory" else cache._inproc
+    for i in range(500):
+        cache.get_or_compute("t", f"k{i}", lambda: i)
+    assert inproc._key_locks == {}
+
+    # 有人持有 / 等待時保留，全部離開後刪掉
+    with cache.lock("t", "held"):
+        assert len(inproc._key_locks) == 1
+        _run_concurrently(lambda: _lock_result(cache, wait_sec=0.1))
+        assert len(inproc._key_locks) == 1
+    assert inproc._key_locks == {}
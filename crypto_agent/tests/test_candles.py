@@ -0,0 +1,96 @@
+import json
+
+import numpy as np
+import pytest
+
+from binance_stub import STUB_FIRST_OPEN_MS, stub_kline
+from candles import KLINE_COLUMNS, CandleArray
+from resample import INTERVAL_MS
+
+HOUR = INTERVAL_MS["1h"]
+
+
+def _rows(n, first=STUB_FIRST_OPEN_MS):
+    return [stub_kline(first + i * HOUR, "1h") for i in range(n)]
+
+
+def _assert_equal(a, b):
+    assert len(a) == len(b)
+    for c in KLINE_COLUMNS:
+        x, y = getattr(a, c), getattr(b, c)
+        assert x.dtype == y.dtype, c
+        np.testing.assert_array_equal(x, y, err_msg=c)
+
+
+@pytest.mark.parametrize("separators", [(",", ":"), (", ", ": ")])
+def test_from_json_bytes_matches_from_rows(separators):
+    rows = _rows(300)
+    # 實際 Binance 的數字精度（8 位小數字串）+ 大數值
+    rows[5][1] = "0.00000001"
+    rows[6][5] = "123456789.12345678"
+    payload = json.dumps(rows, separators=separators).encode()
+    _assert_equal(CandleArray.from_json_bytes(payload), CandleArray.from_rows(json.loads(payload)))
+
+
+def test_from_json_bytes_single_row_and_pretty_printed():
+    rows = _rows(1)
+    _assert_equal(CandleArray.from_json_bytes(json.dumps(rows).encode()), CandleArray.from_rows(rows))
+    pretty = json.dumps(_rows(3), indent=2).encode()
+    _assert_equal(CandleArray.from_json_bytes(pretty), CandleArray.from_rows(_rows(3)))
+
+
+@pytest.mark.parametrize("payload", [b"[]", b"[ ]", b" [ ]\n"])
+def test_empty_payload(payload):
+    c = CandleArray.from_json_bytes(payload)
+    assert len(c) == 0
+    _assert_equal(c, CandleArray.from_rows([]))
+    assert len(c.sorted()) == 0
+
+
+@pytest.mark.parametrize("payload", [b"", b'{"code":-1121,"msg":"Invalid symbol."}', b"[1,2,3]"])
+def test_unexpected_payload_raises_value_error(payload):
+    with pytest.raises(ValueError):
+        CandleArray.from_json_bytes(payload)
+
+
+def test_duplicate_open_time_rows_keep_last_after_sorted():
+    rows = _rows(10)
+    newer = list(rows[3])
+    newer[4] = "99999.00000000"  # 同一根的較新版本（例如未收盤那根更新）
+    payload = json.dumps(rows[5:] + rows[:5] + [newer, rows[8]]).encode()
+
+    parsed = CandleArray.from_json_bytes(payload)
+    _assert_equal(parsed, CandleArray.from_rows(json.loads(payload)))
+
+    got = parsed.sorted()
+    expected_rows = rows[:3] + [newer] + rows[4:]
+    _assert_equal(got, CandleArray.from_rows(expected_rows))
+    assert got.is_sorted() and float(got.close[3]) == 99999.0
+
+
+def test_sorted_returns_self_when_already_sorted():
+    c = CandleArray.from_rows(_rows(20))
+    assert c.sorted() is c
+
+
+def test_concat_matches_from_rows_and_skips_empty_parts():
+    rows = _rows(30)
+    a, b = CandleArray.from_rows(rows[:12]), CandleArray.from_json_bytes(json.dumps(rows[12:]).encode())
+    _assert_equal(CandleArray.concat([a, CandleArray.empty(), b]), CandleArray.from_rows(rows))
+
+    # 只有一段非空時不複製
+    assert CandleArray.concat([CandleArray.empty(), a]) is a
+    assert len(CandleArray.concat([])) == 0
+
+    # 頁與頁重疊：concat 後 sorted() 去重
+    overlapped = CandleArray.concat([CandleArray.from_rows(rows[:20]), CandleArray.from_rows(rows[15:])])
+    assert len(overlapped) == 35
+    _assert_equal(overlapped.sorted(), CandleArray.from_rows(rows))
+
+
+def test_columns_are_read_only():
+    c = CandleArray.from_json_bytes(json.dumps(_rows(5)).encode())
+    with pytest.raises(ValueError):
+        c.close[0] = 1.0
+    with pytest.raises(AttributeError):
+        c.close = np.zeros(5)
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import data_binance as db
+from binance_stub import STUB_FIRST_OPEN_MS, start_stub_server
+from resample import INTERVAL_MS
+
+HOUR = INTERVAL_MS["1h"]
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = start_stub_server()
+    original = list(db._hosts)
+    db.configure_binance_hosts([server.base_url])
+    monkeypatch.setattr(db, "_weight_limiter", db.WeightLimiter())
+    yield server
+    db.configure_binance_hosts(original)
+    server.shutdown()
+
+
+def _assert_contiguous(c, step):
+    t = c.open_time
+    assert len(t) > 0
+    assert np.all(np.diff(t) == step), "rows must be sorted, unique and gap-free"
+    assert np.all(c.close_time == t + step - 1)
+
+
+def test_history_pages_cover_range_without_overlap():
+    start = STUB_FIRST_OPEN_MS + 30 * 60 * 1000  # 不在 K 線邊界上
+    end = start + 2500 * HOUR
+    pages = db.history_pages("1h", start, end)
+    assert len(pages) == 3
+    assert pages[0][0] == STUB_FIRST_OPEN_MS + HOUR
+    assert pages[-1][1] == end
+    for (s, e), (s2, _) in zip(pages, pages[1:]):
+        assert e - s + 1 == db.BINANCE_KLINES_MAX_LIMIT * HOUR
+        assert s2 == e + 1
+
+
+def test_multi_page_fetch_is_sorted_unique_contiguous(stub):
+    # 起點、終點都在 K 線中間；最後一頁只有 500 多根
+    start = STUB_FIRST_OPEN_MS + 30 * 60 * 1000
+    end = STUB_FIRST_OPEN_MS + 2567 * HOUR + 15 * 60 * 1000
+    c = db.get_klines_history("BTCUSDT", "1h", start, end)
+
+    _assert_contiguous(c, HOUR)
+    assert c.open_time[0] == STUB_FIRST_OPEN_MS + HOUR
+    assert c.open_time[-1] == STUB_FIRST_OPEN_MS + 2567 * HOUR
+    assert len(c) == 2567
+    assert stub.stats["requests"] == len(db.history_pages("1h", start, end)) == 3
+
+
+def test_overlapping_pages_are_deduplicated(stub, monkeypatch):
+    pages = db.history_pages
+
+    def overlapping(interval, start_ms, end_ms):
+        # 每頁往前多抓 10 根，模擬頁邊界重疊
+        return [(max(start_ms, s - 10 * HOUR), e) for s, e in pages(interval, start_ms, end_ms)]
+
+    monkeypatch.setattr(db, "history_pages", overlapping)
+    start = STUB_FIRST_OPEN_MS
+    end = STUB_FIRST_OPEN_MS + 2199 * HOUR
+    c = db.get_klines_history("BTCUSDT", "1h", start, end)
+    _assert_contiguous(c, HOUR)
+    assert len(c) == 2200
+
+
+def test_history_up_to_now_ends_with_partial_page(stub):
+    now = db._now_ms()
+    start = now - 1234 * HOUR
+    c = db.get_klines_history("ETHUSDT", "1h", start)
+    _assert_contiguous(c, HOUR)
+    assert c.open_time[0] >= start
+    # 最後一根是還沒收盤的這一根
+    assert c.open_time[-1] <= now < c.close_time[-1] + 1
+    assert len(c) in (1234, 1235)
+
+
+def test_empty_and_single_page_ranges(stub):
+    assert len(db.get_klines_history("BTCUSDT", "1h", STUB_FIRST_OPEN_MS + HOUR, STUB_FIRST_OPEN_MS)) == 0
+    c = db.get_klines_history("BTCUSDT", "1h", STUB_FIRST_OPEN_MS, STUB_FIRST_OPEN_MS + 9 * HOUR)
+    _assert_contiguous(c, HOUR)
+    assert len(c) == 10
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from candles import CandleArray
+from indicators import (
+    IncrementalIndicators,
+    RollingMean,
+    analyze_daily_volume_price,
+    compute_weekly_regime,
+)
+
+WEEK_MS = 7 * 24 * 3600 * 1000
+DAY_MS = 24 * 3600 * 1000
+# 跟 pandas 對整段序列 rolling().mean() 比的容許誤差（見 indicators.py 的說明）
+RTOL = 1e-12
+
+
+def _candles(n: int, step_ms: int, seed: int = 7) -> CandleArray:
+    rng = np.random.default_rng(seed)
+    close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.03, n)))
+    volume = rng.uniform(50, 5000, n) * 1.1
+    opens = 1502668800000 + np.arange(n, dtype=np.int64) * step_ms
+    rows = [
+        [int(t), o, o * 1.01, o * 0.99, c, v, int(t) + step_ms - 1, v * c, 100, v / 2, v * c / 2, "0"]
+        for t, o, c, v in zip(opens, np.r_[close[0], close[:-1]], close, volume)
+    ]
+    return CandleArray.from_rows(rows)
+
+
+def _assert_close(actual, expected):
+    if expected is None or np.isnan(expected):
+        assert actual is None
+    else:
+        assert actual == pytest.approx(expected, rel=RTOL)
+
+
+@pytest.mark.parametrize("window", [20, 50, 100])
+def test_rolling_mean_matches_pandas_within_tolerance(window):
+    # 大數值 + 小波動：最容易出現捨入誤差的情況
+    values = 60000 + np.cumsum(np.random.default_rng(window).normal(0, 30, 3000))
+    expected = pd.Series(values).rolling(window).mean().to_numpy()
+    rm = RollingMean(window)
+    got = np.array([rm.push(v) for v in values])
+    np.testing.assert_array_equal(np.isnan(got), np.isnan(expected))
+    ok = ~np.isnan(expected)
+    np.testing.assert_allclose(got[ok], expected[ok], rtol=RTOL, atol=0)
+
+
+def test_rolling_mean_push_is_amortized_constant(monkeypatch):
+    rm = RollingMean(50)
+    calls = []
+    original = RollingMean.rebase
+    monkeypatch.setattr(RollingMean, "rebase", lambda self: (calls.append(1), original(self)))
+    for v in range(500):
+        rm.push(float(v))
+    # 每 window 根才重新加總一次
+    assert len(calls) == 500 // 50
+
+
+def test_rolling_mean_peek_does_not_change_state():
+    rm = RollingMean(3)
+    for v in (1.0, 2.0, 3.0):
+        rm.push(v)
+    assert rm.peek(9.0) == pytest.approx((2 + 3 + 9) / 3)
+    assert rm.value() == pytest.approx(2.0)
+
+
+def test_rolling_mean_constant_and_sign_edge_cases():
+    rm = RollingMean(4)
+    for _ in range(6):
+        rm.push(0.1)
+    assert rm.value() == 0.1
+    rm = RollingMean(2)
+    assert np.isnan(rm.push(1.0))
+    assert rm.push(-1.0) == 0.0
+
+
+def test_weekly_sliding_window_matches_pandas():
+    c = _candles(400, WEEK_MS)
+    state = IncrementalIndicators({"sma50": ("close", 50), "sma100": ("close", 100)})
+    for end in range(220, 400):
+        window = c[end - 220 : end]
+        # 最後一根剛收盤
+        got = state.sync(window, now_ms=int(window.close_time[-1]) + 1)
+        _, df = compute_weekly_regime(window)
+        _assert_close(got["sma50"], df["sma50"].iloc[-1])
+        _assert_close(got["sma100"], df["sma100"].iloc[-1])
+
+
+def test_weekly_open_candle_matches_pandas():
+    c = _candles(260, WEEK_MS, seed=3)
+    state = IncrementalIndicators({"sma50": ("close", 50), "sma100": ("close", 100)})
+    for end in range(200, 260):
+        window = c[:end]
+        # 最後一根還沒收盤：只試算，不寫進狀態
+        got = state.sync(window, now_ms=int(window.open_time[-1]) + 1)
+        _, df = compute_weekly_regime(window)
+        _assert_close(got["sma50"], df["sma50"].iloc[-1])
+        _assert_close(got["sma100"], df["sma100"].iloc[-1])
+
+
+def test_daily_vol20_matches_pandas_and_rebuilds_after_gap():
+    c = _candles(300, DAY_MS, seed=11)
+    state = IncrementalIndicators({"vol20": ("volume", 20)})
+    for end in list(range(100, 200)) + list(range(250, 300)):
+        window = c[end - 60 : end]
+        got = state.sync(window, now_ms=int(window.close_time[-1]) + 1)
+        expected = analyze_daily_volume_price(window)["vol20"]
+        _assert_close(got["vol20"], expected)
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+import data_binance as db
+from binance_stub import stub_klines
+from candles import CandleArray
+from resample import INTERVAL_MS, candle_open_ms
+
+HOUR = INTERVAL_MS["1h"]
+T0 = candle_open_ms(1700000000000, "1h") + 10 * 60 * 1000  # 某根 1h K 線開盤後 10 分鐘
+
+
+class FakeBinance:
+    """假時鐘 + 用 stub 資料回應 _get_candles，記錄每次呼叫的參數。"""
+
+    def __init__(self):
+        self.now = T0
+        self.calls = []
+
+    def get_candles(self, symbol, interval, limit, start_time=None, end_time=None):
+        self.calls.append({"limit": limit, "start_time": start_time})
+        rows = stub_klines(interval, limit=limit, start_ms=start_time, end_ms=end_time, now_ms=self.now)
+        return CandleArray.from_rows(rows)
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    f = FakeBinance()
+    monkeypatch.setattr(db, "_now_ms", lambda: f.now)
+    monkeypatch.setattr(db, "_get_candles", f.get_candles)
+    monkeypatch.setattr(db, "get_kline_store", lambda: None)
+    return f
+
+
+@pytest.fixture
+def cache():
+    return db.KlineCache(open_tail_refresh_sec=30, shared_backend=None)
+
+
+def _assert_contiguous(c, step):
+    assert np.all(np.diff(c.open_time) == step)
+
+
+def test_hit_within_same_candle(fake, cache):
+    first = cache.get("btcusdt", "1h", 50)
+    fake.now += 10 * 1000
+    second = cache.get("BTCUSDT", "1h", 50)
+
+    assert len(fake.calls) == 1
+    assert cache.stats_snapshot() == {"hit": 1, "shared_hit": 0, "tail_refresh": 0, "full_fetch": 1}
+    np.testing.assert_array_equal(first.open_time, second.open_time)
+    # 比快取少的 limit 也是 hit
+    assert len(cache.get("BTCUSDT", "1h", 20)) == 20
+    assert len(fake.calls) == 1
+
+
+def test_open_candle_tail_refresh_after_refresh_interval(fake, cache):
+    cache.get("BTCUSDT", "1h", 50)
+    open_ms = candle_open_ms(T0, "1h")
+    fake.now += 31 * 1000  # 還在同一根，但超過 open_tail_refresh_sec
+    c = cache.get("BTCUSDT", "1h", 50)
+
+    assert cache.stats_snapshot()["tail_refresh"] == 1
+    # 只補抓還沒收盤的那根，不整段重抓
+    assert fake.calls[-1]["start_time"] == open_ms
+    assert len(c) == 50 and int(c.open_time[-1]) == open_ms
+    _assert_contiguous(c, HOUR)
+
+
+def test_refresh_across_candle_boundary(fake, cache):
+    before = cache.get("BTCUSDT", "1h", 50)
+    fake.now = int(before.close_time[-1]) + 1 + 5 * 1000  # 下一根開盤後 5 秒
+    after = cache.get("BTCUSDT", "1h", 50)
+
+    stats = cache.stats_snapshot()
+    assert stats["tail_refresh"] == 1 and stats["full_fetch"] == 1 and stats["hit"] == 0
+    # 從上次還沒收盤的那根開始補：那根（已收盤的最終版）+ 新開的一根
+    assert fake.calls[-1]["start_time"] == int(before.open_time[-1])
+    assert int(after.open_time[-1]) == int(before.open_time[-1]) + HOUR
+    assert len(after) == 50
+    _assert_contiguous(after, HOUR)
+
+
+def test_idle_past_a_page_falls_back_to_full_fetch(fake, cache):
+    cache.get("BTCUSDT", "1h", 50)
+    fake.now += (db.BINANCE_KLINES_MAX_LIMIT + 5) * HOUR
+    c = cache.get("BTCUSDT", "1h", 50)
+
+    assert cache.stats_snapshot()["full_fetch"] == 2
+    assert int(c.open_time[-1]) == candle_open_ms(fake.now, "1h")
+    _assert_contiguous(c, HOUR)
+
+
+def test_larger_limit_triggers_full_fetch(fake, cache):
+    cache.get("BTCUSDT", "1h", 50)
+    c = cache.get("BTCUSDT", "1h", 120)
+    assert len(c) == 120
+    assert cache.stats_snapshot()["full_fetch"] == 2
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from binance_stub import STUB_FIRST_OPEN_MS, stub_klines
+from candles import CandleArray
+from kline_store import KlineStore
+from resample import INTERVAL_MS
+
+HOUR = INTERVAL_MS["1h"]
+NOW = STUB_FIRST_OPEN_MS + 1000 * HOUR + 30 * 60 * 1000  # 第 1000 根開盤後 30 分鐘（未收盤）
+
+
+class FakeFetch:
+    def __init__(self):
+        self.now = NOW
+        self.calls = []
+
+    def __call__(self, symbol, interval, start_ms, end_ms):
+        self.calls.append((start_ms, end_ms))
+        return CandleArray.from_rows(stub_klines(interval, 100000, start_ms, end_ms, now_ms=self.now))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return KlineStore(str(tmp_path / "klines.sqlite3"))
+
+
+@pytest.fixture
+def fetch():
+    return FakeFetch()
+
+
+def _expected(start_ms, end_ms, now_ms=NOW):
+    return CandleArray.from_rows(stub_klines("1h", 100000, start_ms, end_ms, now_ms=now_ms))
+
+
+def _assert_same(got, expected):
+    assert len(got) == len(expected) > 0
+    np.testing.assert_array_equal(got.open_time, expected.open_time)
+    np.testing.assert_array_equal(got.close, expected.close)
+    np.testing.assert_array_equal(got.volume, expected.volume)
+
+
+def _load(store, fetch, start, end):
+    return store.load_range("BTCUSDT", "1h", start, end, fetch.now, fetch)
+
+
+def test_empty_store_fetches_whole_range_once(store, fetch):
+    start, end = STUB_FIRST_OPEN_MS + 100 * HOUR, STUB_FIRST_OPEN_MS + 199 * HOUR
+    c = _load(store, fetch, start, end)
+
+    _assert_same(c, _expected(start, end))
+    assert fetch.calls == [(start, end)]
+    assert store.coverage("BTCUSDT", "1h") == (start, end + HOUR)
+    assert store.stats_snapshot()["rows_written"] == 100
+
+
+def test_range_inside_coverage_reads_without_fetching(store, fetch):
+    _load(store, fetch, STUB_FIRST_OPEN_MS + 100 * HOUR, STUB_FIRST_OPEN_MS + 199 * HOUR)
+    fetch.calls.clear()
+    # 起點不在 K 線邊界上：從下一根開始
+    start, end = STUB_FIRST_OPEN_MS + 120 * HOUR + 1, STUB_FIRST_OPEN_MS + 150 * HOUR
+    c = _load(store, fetch, start, end)
+
+    assert fetch.calls == []
+    _assert_same(c, _expected(start, end))
+    assert int(c.open_time[0]) == STUB_FIRST_OPEN_MS + 121 * HOUR
+    stats = store.stats_snapshot()
+    assert stats["fetch_head"] == stats["fetch_tail"] == 0
+
+
+def test_head_backfill_only_fetches_missing_prefix(store, fetch):
+    lo = STUB_FIRST_OPEN_MS + 100 * HOUR
+    _load(store, fetch, lo, STUB_FIRST_OPEN_MS + 199 * HOUR)
+    fetch.calls.clear()
+    start, end = STUB_FIRST_OPEN_MS + 40 * HOUR, STUB_FIRST_OPEN_MS + 150 * HOUR
+    c = _load(store, fetch, start, end)
+
+    assert fetch.calls == [(start, lo - 1)]
+    _assert_same(c, _expected(start, end))
+    assert store.coverage("BTCUSDT", "1h") == (start, STUB_FIRST_OPEN_MS + 200 * HOUR)
+    assert store.stats_snapshot()["fetch_head"] == 1
+
+
+def test_tail_backfill_keeps_open_candle_out_of_store(store, fetch):
+    start = STUB_FIRST_OPEN_MS + 900 * HOUR
+    _load(store, fetch, start, STUB_FIRST_OPEN_MS + 949 * HOUR)
+    fetch.calls.clear()
+
+    # 時間往前走，要到現在（含還沒收盤的那根）
+    c = _load(store, fetch, start, NOW)
+    hi = STUB_FIRST_OPEN_MS + 950 * HOUR
+    assert fetch.calls == [(hi, NOW)]
+    _assert_same(c, _expected(start, NOW))
+    assert int(c.open_time[-1]) == STUB_FIRST_OPEN_MS + 1000 * HOUR
+
+    # 未收盤那根不落地，coverage 停在它的 open_time
+    open_ms = STUB_FIRST_OPEN_MS + 1000 * HOUR
+    assert store.coverage("BTCUSDT", "1h") == (start, open_ms)
+    assert store.last_closed_open_ms("BTCUSDT", "1h") == open_ms - HOUR
+    assert store.stats_snapshot()["fetch_tail"] == 1
+
+    # 下一根開盤後只補 [上次未收盤那根, now]
+    fetch.now += HOUR
+    fetch.calls.clear()
+    c = _load(store, fetch, start, fetch.now)
+    assert fetch.calls == [(open_ms, fetch.now)]
+    _assert_same(c, _expected(start, fetch.now, now_ms=fetch.now))
+
+
+def test_empty_and_invalid_ranges(store, fetch):
+    assert len(_load(store, fetch, NOW, NOW - HOUR)) == 0
+    assert fetch.calls == []
+    with pytest.raises(ValueError):
+        store.load_range("BTCUSDT", "7m", NOW - HOUR, NOW, NOW, fetch)
@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from binance_stub import start_stub_stream, stub_kline
+from candles import CandleArray
+from kline_stream import KlineStreamIngestor, websockets
+from resample import INTERVAL_MS, candle_open_ms
+
+pytestmark = pytest.mark.skipif(websockets is None, reason="`websockets` is not installed")
+
+STEP = INTERVAL_MS["1m"]
+
+
+def _rows(end_open_ms: int, n: int) -> CandleArray:
+    return CandleArray.from_rows([stub_kline(end_open_ms - i * STEP, "1m") for i in reversed(range(n))])
+
+
+def test_slow_backfill_does_not_block_stream():
+    stream = start_stub_stream(interval_sec=0.05)
+    release = threading.Event()
+    calls = []
+
+    def seed(symbol, interval, limit):
+        # buffer 最後一根停在 10 分鐘前 → 第一則訊息進來要用 REST 補
+        now = candle_open_ms(int(time.time() * 1000), "1m")
+        return _rows(now - 10 * STEP, limit)
+
+    def slow_fetch(symbol, interval, start_ms, end_ms):
+        calls.append((start_ms, end_ms))
+        release.wait(10)
+        return _rows(candle_open_ms(end_ms, "1m"), (end_ms - start_ms) // STEP + 1)
+
+    ing = KlineStreamIngestor([("BTCUSDT", "1m")], capacity=60, url=stream.url, seed=seed, fetch_range=slow_fetch)
+    assert ing.start()
+    try:
+        deadline = time.time() + 5
+        while not calls and time.time() < deadline:
+            time.sleep(0.05)
+        assert calls, "backfill was never requested"
+
+        # 補抓卡住的時候 event loop 仍然在讀訊息，而且還沒補完不算 warm
+        before = ing.stats["messages"]
+        time.sleep(0.5)
+        assert ing.stats["messages"] > before
+        assert ing.connected
+        assert not ing.is_warm("BTCUSDT", "1m")
+
+        release.set()
+        deadline = time.time() + 5
+        while not ing.is_warm("BTCUSDT", "1m") and time.time() < deadline:
+            time.sleep(0.05)
+        assert ing.is_warm("BTCUSDT", "1m")
+        assert ing.stats["connects"] == 1
+        c = ing.get("BTCUSDT", "1m", 11)
+        assert (c.open_time[1:] - c.open_time[:-1] == STEP).all()
+    finally:
+        release.set()
+        ing.stop()
+        stream.close()
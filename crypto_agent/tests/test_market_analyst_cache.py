@@ -0,0 +1,113 @@
+import copy
+from types import SimpleNamespace
+
+import pytest
+
+import graph_crypto_agent as gca
+import indicators
+from binance_stub import stub_klines
+from cache_backend import InProcessCache
+from candles import CandleArray
+from resample import INTERVAL_MS, candle_open_ms
+
+DAY = INTERVAL_MS["1d"]
+# 某天 UTC 10:00
+T0 = candle_open_ms(1718000000000, "1d") + 10 * 3600 * 1000
+
+
+@pytest.fixture
+def env(monkeypatch):
+    """假時鐘 + stub K 線 + 新的快取；_run_analyst 換成記錄 prompt 的假 LLM。"""
+    clock = SimpleNamespace(now_ms=T0)
+    fake_time = SimpleNamespace(time=lambda: clock.now_ms / 1000)
+    monkeypatch.setattr(gca, "time", fake_time)
+    monkeypatch.setattr(indicators, "time", fake_time)
+    monkeypatch.setattr(indicators, "_states", {})
+
+    def fake_stream(symbol, intervals, base):
+        return {i: CandleArray.from_rows(stub_klines(i, n, now_ms=clock.now_ms)) for i, n in intervals.items()}
+
+    monkeypatch.setattr(gca, "stream_klines", fake_stream)
+    backend = InProcessCache()
+    monkeypatch.setattr(gca, "get_cache_backend", lambda: backend)
+
+    prompts = []
+
+    def fake_run(prompt, name):
+        prompts.append((name, prompt))
+        return {"ok": True, "decision": "hold", "summary": f"call {len(prompts)}", "notes": []}
+
+    monkeypatch.setattr(gca, "_run_analyst", fake_run)
+    return SimpleNamespace(clock=clock, prompts=prompts)
+
+
+def _state(user_text="BTC 投資建議", intent="general_advice"):
+    return gca.fetch_and_analyze({"symbol": "BTCUSDT", "user_text": user_text, "intent": intent})
+
+
+def _intraday_move(state, pct=0.01):
+    """同一根日線內價格變動：只有未收盤那根與由它算出的數值不同。"""
+    s = copy.deepcopy(state)
+    s["daily_candles"][-1]["close"] = round(s["daily_candles"][-1]["close"] * (1 + pct), 2)
+    s["weekly_row"] = {**s["weekly_row"], "close": s["daily_candles"][-1]["close"]}
+    s["daily_pattern"] = {**s["daily_pattern"], "vol_ratio": 9.99}
+    return s
+
+
+def _analyze(kind, state):
+    return gca._cached_market_analyst(kind, state, gca.build_analyst_prompt(kind, state))
+
+
+def test_market_prompt_only_depends_on_closed_candles(env):
+    a = _state()
+    b = _intraday_move(_state("BTC 怕回撤", "risk_averse"))
+    for kind in gca.MARKET_ANALYSTS:
+        pa, pb = gca.build_analyst_prompt(kind, a), gca.build_analyst_prompt(kind, b)
+        assert pa == pb
+        assert "尚未收盤" not in pa and "已收盤" in pa
+    # 風險控管分析師仍然看得到盤中那根
+    assert gca.build_analyst_prompt("risk", a) != gca.build_analyst_prompt("risk", b)
+    assert a["candle_epoch"] == candle_open_ms(T0, "1d") - DAY
+
+
+def test_hit_within_same_daily_candle(env):
+    before = gca.market_analyst_stats()
+    first = _analyze("weekly", _state())
+    env.clock.now_ms += 3 * 3600 * 1000  # 同一天晚一點、價格也動了
+    second = _analyze("weekly", _intraday_move(_state()))
+
+    assert second == first
+    assert len(env.prompts) == 1
+    after = gca.market_analyst_stats()
+    assert after["computed"] - before["computed"] == 1
+    assert after["hit"] - before["hit"] == 1
+
+
+def test_miss_after_daily_close(env):
+    first_state = _state()
+    _analyze("daily", first_state)
+    env.clock.now_ms += DAY  # 下一根日線開盤：多了一根已收盤 K 線
+    second_state = _state()
+    result = _analyze("daily", second_state)
+
+    assert second_state["candle_epoch"] == first_state["candle_epoch"] + DAY
+    assert len(env.prompts) == 2 and result["summary"] == "call 2"
+    assert env.prompts[0][1] != env.prompts[1][1]
+
+
+def test_different_closed_inputs_in_same_epoch_do_not_share(env):
+    a = _state()
+    b = copy.deepcopy(a)
+    b["daily_candles"][-2]["close"] += 1  # 例如資料源補正了一根已收盤 K 線
+    _analyze("daily", a)
+    _analyze("daily", b)
+    assert len(env.prompts) == 2
+
+
+def test_failed_result_is_not_cached(env, monkeypatch):
+    calls = []
+    monkeypatch.setattr(gca, "_run_analyst", lambda prompt, name: calls.append(1) or {"ok": False, "error": "timeout"})
+    state = _state()
+    _analyze("weekly", state)
+    _analyze("weekly", state)
+    assert len(calls) == 2
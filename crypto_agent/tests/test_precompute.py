@@ -0,0 +1,191 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import precompute
+from cache_backend import InProcessCache
+from resample import INTERVAL_MS, candle_open_ms
+
+HOUR_SEC = INTERVAL_MS["1h"] / 1000
+INTENTS = ["general_advice", "risk_averse"]
+
+
+class FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+class FakeHalt:
+    """取代 scheduler._halt：wait(t) 直接把假時鐘往前撥 t 秒，每一輪呼叫 on_tick，rounds 用完就停。"""
+
+    def __init__(self, clock: FakeClock, rounds: int, on_tick=None):
+        self.clock = clock
+        self.rounds = rounds
+        self.on_tick = on_tick
+        self.waits = []
+
+    def wait(self, timeout: float) -> bool:
+        if self.rounds <= 0:
+            return True
+        self.rounds -= 1
+        self.waits.append(timeout)
+        self.clock.now += timeout
+        if self.on_tick is not None:
+            self.on_tick(self.clock.now)
+        return False
+
+    def set(self) -> None:
+        self.rounds = 0
+
+
+class InlineExecutor:
+    """job 直接在呼叫的 thread 跑完，結果跟時鐘都是決定性的。"""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+@pytest.fixture
+def env(monkeypatch):
+    # 某根 1h K 線開盤後 100 秒（用接近真實的時間，cache backend 的 TTL 看的是真實時鐘）
+    clock = FakeClock(candle_open_ms(int(time.time() * 1000), "1h") / 1000 + 100)
+    prices = {"BTCUSDT": 60000.0, "ETHUSDT": 3000.0}
+    runs = []
+
+    def fake_run_analysis(symbol, intent, query):
+        runs.append(SimpleNamespace(symbol=symbol, intent=intent, query=query, at=clock.now))
+        return f"{symbol} {intent} #{len(runs)}"
+
+    monkeypatch.setattr(precompute, "time", clock)
+    monkeypatch.setattr(precompute, "run_analysis", fake_run_analysis)
+    monkeypatch.setattr(precompute, "_last_price", lambda symbol, interval: prices[symbol])
+    return SimpleNamespace(clock=clock, prices=prices, runs=runs)
+
+
+def _scheduler(backend=None, **kwargs):
+    opts = dict(interval="1h", delay_sec=30, move_pct=3.0, check_sec=60, max_age_sec=0)
+    opts.update(kwargs)
+    s = precompute.PrecomputeScheduler(["btcusdt", "ETHUSDT"], INTENTS, backend=backend or InProcessCache(), **opts)
+    s._executor = InlineExecutor()
+    return s
+
+
+def _run_loop(s, clock, rounds, on_tick=None):
+    s._halt = FakeHalt(clock, rounds, on_tick)
+    s._loop()
+    return s._halt
+
+
+def test_startup_computes_every_symbol_and_intent(env):
+    s = _scheduler()
+    _run_loop(s, env.clock, rounds=0)
+
+    assert {(r.symbol, r.intent) for r in env.runs} == {
+        (sym, i) for sym in ("BTCUSDT", "ETHUSDT") for i in INTENTS
+    }
+    # 用會被解析成同一個 intent 的問題去跑
+    assert all(precompute._parse_intent(r.query) == r.intent for r in env.runs)
+    report = s.get("btcusdt", "risk_averse")
+    assert report["trigger"] == "startup" and report["price"] == 60000.0
+    assert report["epoch"] == candle_open_ms(int(env.clock.now * 1000), "1h")
+    assert s.metrics()["computed"] == 4 and s.metrics()["hit"] == 1
+    assert "啟動時預先分析" in precompute.format_precomputed(report)
+
+
+def test_get_misses_for_unknown_keys(env):
+    s = _scheduler()
+    assert s.get("SOLUSDT", "general_advice") is None
+    assert s.get("BTCUSDT", "take_profit") is None
+    assert s.get("BTCUSDT", "general_advice") is None
+    assert s.metrics()["miss"] == 1
+
+
+def test_candle_close_triggers_recompute_after_delay(env):
+    s = _scheduler()
+    start = env.clock.now
+    next_close = candle_open_ms(int(start * 1000), "1h") / 1000 + HOUR_SEC
+    seen = []
+
+    def on_tick(now):
+        # 收盤後、還沒重算前：舊的結果已經不是這根 K 線的 → stale
+        if next_close <= now <= next_close + 30:
+            seen.append(s.get("BTCUSDT", "general_advice"))
+
+    # 一小時內每 60 秒檢查一次，收盤 + 30 秒那一輪觸發
+    halt = _run_loop(s, env.clock, rounds=int(HOUR_SEC / 60) + 3, on_tick=on_tick)
+
+    closes = [r for r in env.runs if r.at >= next_close]
+    assert len(closes) == 4
+    assert all(r.at >= next_close + 30 for r in closes)
+    assert max(halt.waits) <= 60
+    report = s.get("BTCUSDT", "general_advice")
+    assert report["trigger"] == "candle_close"
+    assert report["epoch"] == int(next_close * 1000)
+    assert None in seen and s.metrics()["stale"] >= 1
+
+
+def test_large_move_triggers_recompute_for_that_symbol_only(env):
+    s = _scheduler()
+
+    def on_tick(now):
+        if len(s._halt.waits) == 1:
+            env.prices["BTCUSDT"] *= 1.01  # 1%：不觸發
+            env.prices["ETHUSDT"] *= 1.02
+        elif len(s._halt.waits) == 2:
+            env.prices["BTCUSDT"] *= 1.035  # 相對計算時約 +4.5%：觸發
+
+    _run_loop(s, env.clock, rounds=4, on_tick=on_tick)
+
+    moves = [r for r in env.runs if r.at > env.runs[0].at]
+    assert {(r.symbol, r.intent) for r in moves} == {("BTCUSDT", i) for i in INTENTS}
+    assert s.get("BTCUSDT", "general_advice")["trigger"] == "move"
+    assert s.get("ETHUSDT", "general_advice")["trigger"] == "startup"
+    m = s.metrics()
+    assert m["moves"] == 1
+    # 觸發後以新價格為基準，之後沒有再動就不會一直重算
+    assert m["ref_price"]["BTCUSDT"] == pytest.approx(env.prices["BTCUSDT"])
+    assert m["last_trigger"]["BTCUSDT"]["trigger"] == "move"
+
+
+def test_reports_expire_after_max_age(env):
+    s = _scheduler(max_age_sec=600)
+    _run_loop(s, env.clock, rounds=0)
+    assert s.get("BTCUSDT", "general_advice") is not None
+
+    env.clock.now += 601  # 還在同一根 K 線，但超過 max age
+    assert s.get("BTCUSDT", "general_advice") is None
+    assert s.metrics()["stale"] == 1
+
+
+def test_other_worker_result_is_reused(env):
+    backend = InProcessCache()
+    first = _scheduler(backend)
+    _run_loop(first, env.clock, rounds=0)
+    n = len(env.runs)
+
+    # 第二個 worker 同一根 K 線內啟動：別人已經算好，不再跑 graph
+    env.clock.now += 5
+    second = _scheduler(backend)
+    _run_loop(second, env.clock, rounds=0)
+    assert len(env.runs) == n
+    assert second.metrics()["skipped"] == 4
+    assert second.metrics()["ref_price"] == {"BTCUSDT": 60000.0, "ETHUSDT": 3000.0}
+
+
+def test_failed_job_is_counted_and_not_stored(env, monkeypatch):
+    def boom(symbol, intent, query):
+        raise RuntimeError("llm down")
+
+    monkeypatch.setattr(precompute, "run_analysis", boom)
+    s = _scheduler()
+    _run_loop(s, env.clock, rounds=0)
+    m = s.metrics()
+    assert m["failed"] == 4 and m["computed"] == 0 and m["pending"] == 0
+    assert s.get("BTCUSDT", "general_advice") is None
@@ -0,0 +1,64 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from candles import CandleArray
+from resample import INTERVAL_MS, candle_open_ms, resample_klines
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "binance")
+SYMBOL = "BTCUSDT"
+
+# (base, 原生 interval)：base 合成出來的 K 線要跟 Binance 原生的一樣
+CASES = [("1d", "1w"), ("1d", "3d"), ("1h", "4h"), ("1h", "12h")]
+
+
+def _load(interval: str) -> CandleArray:
+    path = os.path.join(FIXTURE_DIR, f"{SYMBOL}_{interval}.json")
+    if not os.path.exists(path):
+        pytest.skip(f"missing {path}; run `python tests/record_binance_fixtures.py` with network access")
+    with open(path, encoding="utf-8") as f:
+        return CandleArray.from_rows(json.load(f))
+
+
+@pytest.mark.parametrize("base, interval", CASES)
+def test_resampled_bars_match_binance_native(base, interval):
+    base_rows, native = _load(base), _load(interval)
+    derived = resample_klines(base_rows, interval)
+
+    # 只比兩邊都完整涵蓋的區間（base 的頭尾可能切在一根中間）
+    first = base_rows.open_time[0]
+    last_close = base_rows.close_time[-1]
+    keep = (native.open_time >= first) & (native.close_time <= last_close)
+    expected = native.take(np.flatnonzero(keep))
+    got = derived.take(np.flatnonzero(np.isin(derived.open_time, expected.open_time)))
+    assert len(expected) >= 10
+
+    np.testing.assert_array_equal(got.open_time, expected.open_time)
+    np.testing.assert_array_equal(got.close_time, expected.close_time)
+    for col in ("open", "high", "low", "close"):
+        np.testing.assert_array_equal(getattr(got, col), getattr(expected, col), err_msg=col)
+    for col in ("volume", "quote_asset_volume", "taker_buy_base_asset_volume"):
+        np.testing.assert_allclose(getattr(got, col), getattr(expected, col), rtol=1e-9, err_msg=col)
+    np.testing.assert_array_equal(got.number_of_trades, expected.number_of_trades)
+
+
+def test_native_weekly_bars_open_on_monday():
+    native = _load("1w")
+    weekday = (native.open_time // INTERVAL_MS["1d"] + 3) % 7  # 1970-01-01 是週四（0 = 週一）
+    assert (weekday == 0).all()
+
+
+def test_native_3d_bars_follow_epoch_alignment():
+    native = _load("3d")
+    assert all(candle_open_ms(int(t), "3d") == int(t) for t in native.open_time)
+
+
+def test_alignment_rules_without_fixtures():
+    # 2024-01-01 是週一；2024-01-03（週三）那週的週線也是 2024-01-01 開盤
+    monday = 1704067200000
+    assert candle_open_ms(monday + 2 * INTERVAL_MS["1d"] + 5, "1w") == monday
+    assert candle_open_ms(monday - 1, "1w") == monday - INTERVAL_MS["1w"]
+    assert candle_open_ms(monday + 13 * INTERVAL_MS["1h"], "12h") == monday + INTERVAL_MS["12h"]
+    assert candle_open_ms(monday, "3d") % INTERVAL_MS["3d"] == 0
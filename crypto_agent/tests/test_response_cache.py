@@ -0,0 +1,77 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import llm_client as lc
+
+
+@pytest.fixture
+def llm(monkeypatch, tmp_path):
+    """假 LLM：記錄每次真的送出的 prompt；快取寫到 tmp_path。"""
+    calls = []
+
+    def fake_complete(backend, model, prompt, temperature, json_mode=False, max_tokens=None):
+        calls.append((prompt, temperature))
+        return f"answer #{len(calls)}", {"completion_tokens": 3}
+
+    cache = lc.ResponseCache(disk_dir=str(tmp_path / "llm"), shared_backend=None)
+    monkeypatch.setattr(lc, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(lc, "_response_cache", cache)
+    monkeypatch.setattr(lc, "_complete", fake_complete)
+    monkeypatch.setattr(lc, "get_llm_settings", lambda: SimpleNamespace(backend="ollama", model="test-model"))
+    return SimpleNamespace(calls=calls, cache=cache, disk_dir=str(tmp_path / "llm"))
+
+
+def test_hit_for_same_prompt_at_temperature_zero(llm):
+    first = lc.chat_text("BTC 週線怎麼看？", temperature=0)
+    second = lc.chat_text("BTC 週線怎麼看？", temperature=0)
+    assert first == second == "answer #1"
+    assert len(llm.calls) == 1
+    stats = lc.llm_cache_stats()
+    assert stats["hit_mem"] == 1 and stats["put"] == 1 and stats["mem_size"] == 1
+
+    # prompt 不同就不會共用
+    assert lc.chat_text("ETH 週線怎麼看？", temperature=0) == "answer #2"
+
+
+def test_temperature_above_zero_is_never_cached(llm):
+    assert lc.chat_text("BTC 週線怎麼看？", temperature=0.2) == "answer #1"
+    assert lc.chat_text("BTC 週線怎麼看？", temperature=0.2) == "answer #2"
+    assert len(llm.calls) == 2
+    stats = lc.llm_cache_stats()
+    assert stats["put"] == 0 and stats["hit_mem"] == 0 and stats["mem_size"] == 0
+    assert not os.path.exists(llm.disk_dir)
+
+
+def test_reload_from_disk_in_new_process(llm):
+    key = lc.ResponseCache.make_key("json", "ollama", "test-model", 0, "prompt")
+    llm.cache.put(key, {"ok": True, "summary": "多頭"})
+
+    # 新的 ResponseCache（例如重啟之後）：記憶體是空的，從硬碟讀回來
+    fresh = lc.ResponseCache(disk_dir=llm.disk_dir, shared_backend=None)
+    assert fresh.get(key) == {"ok": True, "summary": "多頭"}
+    assert fresh.get(key) == {"ok": True, "summary": "多頭"}
+    stats = fresh.stats_snapshot()
+    assert stats["hit_disk"] == 1 and stats["hit_mem"] == 1 and stats["miss"] == 0
+
+
+def test_expired_disk_entry_is_a_miss(llm):
+    key = lc.ResponseCache.make_key("text", "ollama", "test-model", 0, "prompt")
+    llm.cache.put(key, "old")
+    fresh = lc.ResponseCache(disk_dir=llm.disk_dir, max_age_sec=1e-9, shared_backend=None)
+    assert fresh.get(key) is None
+    assert not os.path.exists(fresh._path(key))
+
+
+def test_memory_lru_evicts_least_recently_used():
+    cache = lc.ResponseCache(mem_entries=2, disk_dir="", shared_backend=None)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # a 變成最近用過
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    stats = cache.stats_snapshot()
+    assert stats["evict"] == 1 and stats["mem_size"] == 2 and stats["miss"] == 1
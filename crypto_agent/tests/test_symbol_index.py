@@ -0,0 +1,57 @@
+import pytest
+
+from binance_stub import stub_exchange_info
+from symbol_index import SymbolIndex, _parse_exchange_info
+
+
+@pytest.fixture
+def index():
+    idx = SymbolIndex(default_quote="USDT")
+    idx.load(_parse_exchange_info(stub_exchange_info()), loaded_at=0.0, source="stub")
+    return idx
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("BTC投資建議", ("BTCUSDT", None)),
+        ("btc投資建議", ("BTCUSDT", None)),
+        ("我想抄底 eth", ("ETHUSDT", None)),
+        ("ETHBTC 怎麼看", ("ETHBTC", None)),
+        ("比特幣投資建議", ("BTCUSDT", None)),
+        ("以太坊 想加倉", ("ETHUSDT", None)),
+        ("狗狗幣 怕回撤", ("DOGEUSDT", None)),
+        ("hello BTC", ("BTCUSDT", None)),
+        ("RSI 跟 SOL", ("SOLUSDT", None)),
+        ("我想抄底", (None, None)),
+        ("hello 投資建議", (None, None)),
+    ],
+)
+def test_resolves_known_symbols_and_aliases(index, text, expected):
+    assert index.resolve_text(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text, rejected",
+    [
+        ("XYZ投資建議", "XYZ"),
+        ("xyz投資建議", "XYZ"),
+        ("Xyz 想賣出", "XYZ"),
+        # 已下架（status 不是 TRADING）
+        ("luna 投資建議", "LUNA"),
+    ],
+)
+def test_unknown_tickers_are_rejected_in_any_case(index, text, rejected):
+    assert index.resolve_text(text) == (None, rejected)
+    assert index.stats["rejected"] >= 1
+
+
+def test_first_valid_symbol_wins_over_unknown_token(index):
+    assert index.resolve_text("xyz 還是 BNB") == ("BNBUSDT", None)
+
+
+def test_not_ready_index_keeps_legacy_fallback():
+    idx = SymbolIndex(default_quote="USDT")
+    assert idx.resolve_text("xyz投資建議") == ("XYZUSDT", None)
+    assert idx.resolve_text("比特幣") == ("BTCUSDT", None)
+    assert idx.resolve_text("buy") == (None, None)
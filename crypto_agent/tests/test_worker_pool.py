@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+from worker_pool import AnalysisWorkerPool
+
+
+@pytest.fixture
+def pool():
+    p = AnalysisWorkerPool(max_workers=1, max_queue=2, name="test-analysis")
+    yield p
+    p.shutdown(wait=False)
+
+
+def test_queue_full_rejects_and_recovers(pool):
+    release = threading.Event()
+    started = threading.Event()
+    done = []
+
+    def job(i):
+        started.set()
+        release.wait(5)
+        done.append(i)
+
+    # 1 個在跑 + 2 個排隊 = 滿
+    assert pool.submit(job, 0)
+    assert started.wait(2)
+    assert pool.submit(job, 1)
+    assert pool.submit(job, 2)
+    assert not pool.submit(job, 3)
+    assert not pool.submit(job, 4)
+
+    m = pool.metrics()
+    assert m["running"] == 1 and m["queue_depth"] == 2
+    assert m["submitted"] == 3 and m["rejected"] == 2
+
+    release.set()
+    pool.shutdown(wait=True)
+    assert sorted(done) == [0, 1, 2]
+    m = pool.metrics()
+    assert m["completed"] == 3 and m["queue_depth"] == 0 and m["running"] == 0
+
+
+def test_capacity_is_released_after_failures():
+    pool = AnalysisWorkerPool(max_workers=1, max_queue=0)
+
+    def boom():
+        raise ValueError("boom")
+
+    try:
+        for _ in range(3):
+            assert pool.submit(boom)
+            # 失敗的 job 也要把名額還回來（拿得到就代表已經 release）
+            assert pool._capacity.acquire(timeout=2)
+            pool._capacity.release()
+        m = pool.metrics()
+        assert m["failed"] == 3 and m["rejected"] == 0 and m["running"] == 0
+    finally:
+        pool.shutdown(wait=False)
+
+
+def test_submit_after_shutdown_is_rejected(pool):
+    pool.shutdown(wait=True)
+    assert not pool.submit(lambda: None)
+    assert pool.metrics()["rejected"] == 1
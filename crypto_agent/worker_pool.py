@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+"""
+背景 worker pool：LINE webhook 收到訊息後馬上回 200，把耗時的 graph 分析丟到這裡跑，
+不會卡住 uvicorn event loop（/health 與其他聊天室照常回應）。
+
+- max_workers：同時跑幾個分析
+- max_queue  ：最多排隊幾個；滿了 submit() 回 False，由呼叫端決定怎麼回覆使用者
+"""
+
+
+class AnalysisWorkerPool:
+    def __init__(self, max_workers: int, max_queue: int, name: str = "analysis"):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        # 排隊 + 執行中 的總量上限
+        self._capacity = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self._total_wait_sec = 0.0
+        self._total_run_sec = 0.0
+        self._max_run_sec = 0.0
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> bool:
+        if not self._capacity.acquire(blocking=False):
+            with self._lock:
+                self._counters["rejected"] += 1
+            return False
+
+        with self._lock:
+            self._queued += 1
+            self._counters["submitted"] += 1
+
+        enqueued_at = time.monotonic()
+        try:
+            self._executor.submit(self._run, enqueued_at, fn, args, kwargs)
+        except RuntimeError:
+            # executor 已 shutdown
+            with self._lock:
+                self._queued -= 1
+                self._counters["rejected"] += 1
+            self._capacity.release()
+            return False
+        return True
+
+    def _run(self, enqueued_at: float, fn: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+        started = time.monotonic()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._total_wait_sec += started - enqueued_at
+
+        ok = True
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            ok = False
+            print(f"[ERROR] {fn.__name__} failed in worker pool:", repr(e))
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._running -= 1
+                self._counters["completed" if ok else "failed"] += 1
+                self._total_run_sec += elapsed
+                self._max_run_sec = max(self._max_run_sec, elapsed)
+            self._capacity.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            done = self._counters["completed"] + self._counters["failed"]
+            started = done + self._running
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self._queued,
+                "running": self._running,
+                **self._counters,
+                "avg_wait_sec": round(self._total_wait_sec / started, 3) if started else None,
+                "avg_run_sec": round(self._total_run_sec / done, 3) if done else None,
+                "max_run_sec": round(self._max_run_sec, 3),
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)